@@ -0,0 +1,287 @@
+import csv
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import tracemalloc
+import types
+
+# Times every stage of the analysis on a synthetic cohort (see synthetic_cohort.py).
+# Every stage reports its wall and CPU time, the rows and sessions it went through and the
+# throughput (rows/s, sessions/s). Its peak memory (what Python and NumPy allocated) is measured
+# with tracemalloc in a second run of the stage, as tracing slows pandas down several times.
+# The results are printed and saved as benchmark_results.csv / .json in the work folder.
+# A stage whose script cannot be imported here (a missing package) is reported as skipped with the
+# reason, the other stages still run.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The scripts import each other by module name, as when they are run from their folders
+SCRIPT_FOLDERS = ['preproccesing', 'deltas_of_turns', 'straight_walking_gaze_positions', 'pupil_dynamics',
+                  'confidence_at_different_sessions', 'machine_learning']
+FREQUENCY_RANGES = [(0, 0.1), (0.1, 0.5), (0.5, 1), (1, 5), (5, 10)]
+DELTA_ANCHORS = ['start', '25%', 'middle', '75%']
+# The anonymized copies of the scripts cannot be imported by name ("- Copy" in the file name) and
+# leave the paths of their main() empty ("pd_on_paths = # add the paths here"); load_script
+# loads them from their files with these lines set to an empty list. pupil_diameter comes first:
+# the session catalog and the scripts import its filter_file_path by name
+SCRIPT_COPIES = {
+    'pupil_diameter': os.path.join('pupil_dynamics', 'pupil_diameter - Copy.py'),
+    'confidence_level': os.path.join('confidence_at_different_sessions', 'confidence_level - Copy.py'),
+    'fft_pupil_size': os.path.join('pupil_dynamics', 'fft_pupil_size - Copy.py'),
+    'preprocessing_data_for_ml': os.path.join('machine_learning', 'preprocessing_data_for_ml - Copy.py'),
+}
+PATH_PLACEHOLDER = re.compile(r'=[ \t]*#.*$', re.MULTILINE)
+
+for folder in [os.path.dirname(os.path.abspath(__file__))] + [os.path.join(REPO_ROOT, f) for f in SCRIPT_FOLDERS]:
+    if folder not in sys.path:
+        sys.path.append(folder)
+
+
+def load_script(module_name):
+    """ The anonymized copy of a script (see SCRIPT_COPIES) as a module, loaded once. """
+    if module_name != 'pupil_diameter':
+        load_script('pupil_diameter')
+    if module_name not in sys.modules:
+        path = os.path.join(REPO_ROOT, SCRIPT_COPIES[module_name])
+        with open(path, encoding='utf-8') as f:
+            source = PATH_PLACEHOLDER.sub('= []', f.read())
+        module = types.ModuleType(module_name)
+        module.__file__ = path
+        # Registered first, so the worker processes of the script find its functions by name
+        sys.modules[module_name] = module
+        try:
+            exec(compile(source, path, 'exec'), module.__dict__)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
+    return sys.modules[module_name]
+
+
+def group_folders(manifest):
+    """ The folders of every group, as the scripts' main functions pass them. """
+    return {'EC': manifest['ec_folder'], 'PD_OFF': manifest['pd_folder'], 'PD_ON': manifest['pd_on_paths']}
+
+
+def rows_of(manifest, paths):
+    return sum(manifest['rows'].get(path, 0) for path in paths)
+
+
+def files_named(manifest, folder, file_name):
+    """ The CSV files of the manifest called file_name under folder. """
+    prefix = os.path.join(folder, '')
+    return [path for path in manifest['rows'] if path.startswith(prefix) and os.path.basename(path) == file_name]
+
+
+def fresh_folder(work_dir, name):
+    """ An empty output folder of a stage in the work folder, so every run writes the same files. """
+    folder = os.path.join(work_dir, name)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    return folder
+
+
+def stage_scaling(manifest, work_dir):
+    """ ChangeScaling over every gaze_positions.csv of the sessions. """
+    import ChangeScaling
+    from parallel import report_failures, run_parallel
+    files = [path for folder in (manifest['ec_folder'], manifest['pd_folder'], *manifest['pd_on_paths'])
+             for path in files_named(manifest, folder, 'gaze_positions.csv')]
+    report_failures(run_parallel(ChangeScaling.changeScaling, [(path,) for path in files], label='scaling'))
+    return rows_of(manifest, files), len(files)
+
+
+def stage_turn_extraction(manifest, work_dir):
+    """ Turns of the annotation workbooks, and the gaze data of every turn. """
+    import collect_data_turns
+    import gaze_positions_extraction
+    turns_folder = fresh_folder(work_dir, 'turns_data')
+    turns_gaze_folder = fresh_folder(work_dir, 'turns_gaze_data')
+    collect_data_turns.process_all_files_in_folder(manifest['annotations_folder'], turns_folder)
+    results = gaze_positions_extraction.process_all_files_in_folder(turns_folder, manifest['data_folder'],
+                                                                   turns_gaze_folder)
+    gaze_files = files_named(manifest, manifest['data_folder'], 'gaze_positions_new.csv')
+    return rows_of(manifest, gaze_files), len(results)
+
+
+def stage_deltas(manifest, work_dir):
+    """ The gaze deltas of every turn for all anchors, with the reports. """
+    from turn_deltas import collect_turn_deltas, write_delta_reports
+    turns_folder = os.path.join(work_dir, 'turns_data')
+    if not os.path.isdir(turns_folder):
+        raise RuntimeError("The deltas need the turns_data of the turn_extraction stage")
+    deltas = collect_turn_deltas(turns_folder, manifest['data_folder'], DELTA_ANCHORS)
+    write_delta_reports(deltas, fresh_folder(work_dir, 'deltas'))
+    gaze_files = files_named(manifest, manifest['data_folder'], 'gaze_positions_new.csv')
+    return rows_of(manifest, gaze_files), len(gaze_files)
+
+
+def stage_confidence_sweep(manifest, work_dir):
+    """ Low confidence percentages of every group and filter option. """
+    confidence_level = load_script('confidence_level')
+    patients = manifest['config']['patients']
+    loaded = {}
+    for group_name, folders in group_folders(manifest).items():
+        confidence_level.process_patient_data_by_option(folders, group_name, max_patients=patients,
+                                                        confidence_thresholds=confidence_level.DENSE_CONFIDENCE_THRESHOLDS,
+                                                        loaded=loaded)
+    return rows_of(manifest, loaded), len(loaded)
+
+
+def stage_fft_band_areas(manifest, work_dir):
+    """ Pupil diameter spectra of every group and filter option, and their band areas. """
+    fft_pupil_size = load_script('fft_pupil_size')
+    patients = manifest['config']['patients']
+    loaded = {}
+    datasets = {}
+    for group_name, folders in group_folders(manifest).items():
+        for folder in (folders if isinstance(folders, list) else [folders]):
+            for option, data in fft_pupil_size.process_patient_data_by_option(
+                    folder, group_name, max_patients=patients, loaded=loaded).items():
+                datasets.setdefault((option, group_name), []).append(data)
+    datasets = {key: fft_pupil_size.GroupSignals.concat(groups, key[1]) for key, groups in datasets.items()}
+
+    fft_results = fft_pupil_size.compute_fft_results(datasets)
+    for key, results in fft_results.items():
+        for _, area_table in fft_pupil_size.build_area_tables(results):
+            area_table.areas(FREQUENCY_RANGES)
+    return rows_of(manifest, loaded), len(loaded)
+
+
+def stage_gaze_statistics(manifest, work_dir):
+    """ Gaze statistics of both axes of every gaze_positions.csv of the gaze data folder. """
+    from gaze_positions_mean_and_std import VALUE_COLUMNS, process_all_files_in_folder_axes
+    process_all_files_in_folder_axes(manifest['data_folder'], list(VALUE_COLUMNS.values()))
+    gaze_files = files_named(manifest, manifest['data_folder'], 'gaze_positions.csv')
+    return rows_of(manifest, gaze_files), len(gaze_files)
+
+
+def stage_ml_loading(manifest, work_dir):
+    """ The filtered copies of the pupil files, loaded into the model's feature matrix. """
+    preprocessing_data_for_ml = load_script('preprocessing_data_for_ml')
+    import nn_parckinson_2
+    save_dir = fresh_folder(work_dir, 'preprocessing')
+    for group_name, folders in group_folders(manifest).items():
+        preprocessing_data_for_ml.process_patient_data(folders, group_name, save_dir=save_dir)
+    file_paths = nn_parckinson_2.get_csv_files(save_dir)
+    nn_parckinson_2.load_and_process_data(file_paths)
+    rows = 0
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            rows += sum(1 for _ in f) - 1
+    return rows, len(file_paths)
+
+
+STAGES = {
+    'scaling': stage_scaling,
+    'turn_extraction': stage_turn_extraction,
+    'deltas': stage_deltas,
+    'confidence_sweep': stage_confidence_sweep,
+    'fft_band_areas': stage_fft_band_areas,
+    'gaze_statistics': stage_gaze_statistics,
+    'ml_loading': stage_ml_loading,
+}
+
+
+def peak_memory(stage, manifest, work_dir):
+    """ The peak of the memory traced by tracemalloc while the stage runs, in MB. """
+    tracemalloc.start()
+    try:
+        stage(manifest, work_dir)
+        return round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def run_stage(name, stage, manifest, work_dir, memory=True):
+    """ Runs one stage with the timers on, and once more for its peak memory. Returns its result row. """
+    result = {'stage': name, 'status': 'ok', 'error': '', 'seconds': None, 'cpu_seconds': None, 'rows': None,
+              'sessions': None, 'rows_per_s': None, 'sessions_per_s': None, 'peak_mb': None}
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        rows, sessions = stage(manifest, work_dir)
+        seconds = time.perf_counter() - wall_start
+        result.update(seconds=round(seconds, 3), cpu_seconds=round(time.process_time() - cpu_start, 3),
+                      rows=rows, sessions=sessions,
+                      rows_per_s=round(rows / seconds, 1) if seconds > 0 else None,
+                      sessions_per_s=round(sessions / seconds, 3) if seconds > 0 else None)
+        if memory:
+            result['peak_mb'] = peak_memory(stage, manifest, work_dir)
+    except ImportError as e:
+        result.update(status='skipped', error=str(e))
+    except Exception as e:
+        result.update(status='failed', error=f"{type(e).__name__}: {e}")
+    return result
+
+
+def write_results(results, work_dir):
+    with open(os.path.join(work_dir, 'benchmark_results.json'), 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    with open(os.path.join(work_dir, 'benchmark_results.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def print_results(results):
+    print(f"{'stage':<18}{'status':<9}{'seconds':>9}{'cpu s':>9}{'rows':>12}{'rows/s':>12}{'sessions/s':>12}{'peak MB':>9}")
+    for result in results:
+        if result['status'] != 'ok':
+            print(f"{result['stage']:<18}{result['status']:<9} {result['error']}")
+            continue
+        print(f"{result['stage']:<18}{result['status']:<9}{result['seconds']:>9}{result['cpu_seconds']:>9}"
+              f"{result['rows']:>12}{result['rows_per_s']:>12}{result['sessions_per_s']:>12}{str(result['peak_mb']):>9}")
+
+
+def run_benchmarks(cohort_root, work_dir, stages=None, workers=1, memory=True, patients=3, minutes=2.0, rate=120,
+                   seed=0):
+    """
+    Runs the benchmark stages on a synthetic cohort, generating it first if cohort_root has none.
+
+    Parameters:
+    - cohort_root: Folder of the synthetic cohort
+    - work_dir: Folder for the outputs of the stages and the results
+    - stages: Names of the stages to run (see STAGES), None for all, in the order of STAGES
+    - workers: Processes of the parallel stages (ANALYSIS_WORKERS); the default 1 keeps all work
+      in this process, where its time and memory are measured
+    - memory: Run every stage a second time to measure its peak memory
+    - patients, minutes, rate, seed: Scale of the cohort when it is generated
+
+    Returns:
+    - List of result rows, one per stage
+    """
+    # The scripts' catalog and workers are set before they are imported; the catalog starts empty
+    # so its first scan is part of the timings
+    os.makedirs(work_dir, exist_ok=True)
+    catalog_file = os.path.join(work_dir, 'session_catalog.json')
+    if os.path.exists(catalog_file):
+        os.remove(catalog_file)
+    os.environ['SESSION_CATALOG'] = catalog_file
+    os.environ['ANNOTATION_CACHE'] = os.path.join(work_dir, 'annotation_cache')
+    os.environ['ANALYSIS_WORKERS'] = str(workers)
+
+    from synthetic_cohort import generate_cohort, load_manifest
+    if os.path.exists(os.path.join(cohort_root, 'manifest.json')):
+        manifest = load_manifest(cohort_root)
+    else:
+        manifest = generate_cohort(cohort_root, patients, minutes, rate, seed)
+
+    results = []
+    for name in (stages or list(STAGES)):
+        print(f"Running stage {name}...")
+        results.append(run_stage(name, STAGES[name], manifest, work_dir, memory))
+    write_results(results, work_dir)
+    print_results(results)
+    return results
+
+
+def main():
+    benchmarks_folder = os.path.dirname(os.path.abspath(__file__))
+    cohort_root = os.path.join(benchmarks_folder, 'synthetic_data')
+    work_dir = os.path.join(benchmarks_folder, 'results')
+
+    run_benchmarks(cohort_root, work_dir, workers=1, patients=3, minutes=2.0, rate=120)
+
+
+if __name__ == "__main__":
+    main()
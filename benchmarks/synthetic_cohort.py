@@ -0,0 +1,246 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Writes a synthetic cohort laid out like the real data, so every stage can be timed without the
+# patient data on D:\. For every patient and walking condition (STRAIGHT, STRAIGHT_DT, RESH, RESH_DT)
+# a Pupil Labs export with gaze_positions.csv and pupil_positions.csv is written:
+#   <root>/EC/<id>/<id>_<CONDITION>/000/exports/000/           (EC group, D:\EC)
+#   <root>/PD/<id>/<id>_OFF_<CONDITION>/000/exports/000/       (PD_OFF group, D:\PD)
+#   <root>/PD_ON/PD/<id>/<id>_ON_<CONDITION>/000/exports/000/  (PD_ON group, the pd_on_paths)
+# The straight walking session of every patient is also copied to the gaze data folder of the
+# turn analysis, with the scaled gaze_positions_new.csv, and gets its annotation workbook:
+#   <root>/data/EC_<id>/exports/, <root>/data/<id>_off/exports/, <root>/data/<id>_on/exports/
+#   <root>/annotations/EC/<id>_straight_ניתוח.xlsx
+#   <root>/annotations/PD_STRAIGHT/<id>/<id>_off_straight.xlsx (and _on_)
+CONDITIONS = ['STRAIGHT', 'STRAIGHT_DT', 'RESH', 'RESH_DT']
+# Words the scripts look for anywhere in a path, which the cohort root must not contain
+PATH_KEYWORDS = ['EC', 'ON', 'OFF', 'DT', 'RESH', 'STRAIGHT', 'STRIGHT']
+EXPORT_FOLDER = os.path.join('000', 'exports', '000')
+# Pupil diameter (pixels of the 2d detector) of each group
+BASE_DIAMETERS = {'EC': 42.0, 'PD_OFF': 36.0, 'PD_ON': 38.0}
+START_EVENT, TURN_START, TURN_END, END_EVENT = 'תחילת הליכה', 'תחילת סיבוב', 'סיום סיבוב', 'סוף הליכה'
+
+
+def walking_events(rng, duration):
+    """
+    The annotated events of one straight walking session: the walking start, turns of 2-3 s
+    after every 8-12 s of walking, and the walking end.
+
+    Returns:
+    - DataFrame with the PL_EVENTS and SEC.MILI columns, in time order
+    """
+    events = [(START_EVENT, 2.0)]
+    time = 2.0
+    while True:
+        turn_start = time + rng.uniform(8, 12)
+        turn_end = turn_start + rng.uniform(2, 3)
+        if turn_end > duration - 3:
+            break
+        events += [(TURN_START, turn_start), (TURN_END, turn_end)]
+        # A remark now and then, as the annotators add
+        if rng.random() < 0.2:
+            events.append(('הערה', turn_end + 0.5))
+        time = turn_end
+    events.append((END_EVENT, max(time + 1, duration - 2)))
+    df = pd.DataFrame(events, columns=['PL_EVENTS', 'SEC.MILI'])
+    df['SEC.MILI'] = df['SEC.MILI'].round(3)
+    return df
+
+
+def turn_profile(times, events):
+    """ 0 outside the turns, rising to 1 in the middle of every turn and back to 0 at its end. """
+    profile = np.zeros(len(times))
+    starts = events.loc[events['PL_EVENTS'] == TURN_START, 'SEC.MILI'].to_numpy()
+    ends = events.loc[events['PL_EVENTS'] == TURN_END, 'SEC.MILI'].to_numpy()
+    for start, end in zip(starts, ends):
+        first, last = np.searchsorted(times, [start, end])
+        profile[first:last] = np.sin(np.pi * (times[first:last] - start) / (end - start))
+    return profile
+
+
+def gaze_positions(rng, duration, rate, events, start_timestamp):
+    """
+    A gaze_positions.csv table. The gaze moves sideways and down during the turns, about 1% of the
+    values fall outside [0, 1], and the confidence drops during blinks.
+    The '#VALUE!' column (seconds from the start of the recording, the time axis of the
+    annotations) is what the turn analysis reads from gaze_positions_new.csv.
+    """
+    times = np.arange(int(duration * rate)) / rate
+    n = len(times)
+    turning = turn_profile(times, events)
+    direction = rng.choice([-1, 1])
+
+    norm_pos_x = 0.5 + direction * 0.25 * turning + np.cumsum(rng.normal(0, 0.002, n)) * 0.1 + rng.normal(0, 0.03, n)
+    norm_pos_y = 0.45 - 0.15 * turning + rng.normal(0, 0.03, n)
+    outliers = rng.random(n) < 0.01
+    norm_pos_x[outliers] += rng.choice([-1.5, 1.5], outliers.sum())
+
+    confidence = rng.beta(8, 1.2, n)
+    blinks = blink_mask(rng, times)
+    confidence[blinks] = rng.uniform(0, 0.3, blinks.sum())
+
+    return pd.DataFrame({
+        '#VALUE!': np.round(times, 4),
+        'gaze_timestamp': start_timestamp + times,
+        'world_index': (times * 30).astype(np.int64),
+        'confidence': confidence,
+        'norm_pos_x': norm_pos_x,
+        'norm_pos_y': norm_pos_y,
+    })
+
+
+def blink_mask(rng, times):
+    """ About one 150 ms blink every 4 s. """
+    mask = np.zeros(len(times), dtype=bool)
+    for blink in rng.uniform(0, times[-1] if len(times) else 0, int(len(times) and times[-1] / 4)):
+        first, last = np.searchsorted(times, [blink, blink + 0.15])
+        mask[first:last] = True
+    return mask
+
+
+def pupil_positions(rng, duration, rate, group_name, start_timestamp):
+    """
+    A pupil_positions.csv table with both eyes. The diameter has slow drifts and oscillations
+    between 0.05 and 1 Hz (the bands of the FFT analysis) plus noise, and drops during blinks,
+    where the confidence is low.
+    """
+    times = np.arange(int(duration * rate)) / rate
+    n = len(times)
+    base = BASE_DIAMETERS[group_name] * rng.uniform(0.9, 1.1)
+    drift = np.cumsum(rng.normal(0, 0.05, n))
+    drift -= np.linspace(drift[0], drift[-1], n) if n else 0
+    oscillation = sum(amplitude * np.sin(2 * np.pi * frequency * times + rng.uniform(0, 2 * np.pi))
+                      for frequency, amplitude in ((0.08, 1.5), (0.3, 0.8), (0.9, 0.4)))
+    diameter = base + drift + oscillation
+    blinks = blink_mask(rng, times)
+
+    eyes = []
+    for eye_id in (0, 1):
+        eye_diameter = diameter + rng.normal(0, 0.5, n)
+        confidence = rng.beta(9, 1.1, n)
+        confidence[blinks] = rng.uniform(0, 0.3, blinks.sum())
+        eye_diameter[blinks] *= rng.uniform(0.2, 0.6, blinks.sum())
+        eyes.append(pd.DataFrame({
+            'pupil_timestamp': start_timestamp + times + eye_id * 0.001,
+            'world_index': (times * 30).astype(np.int64),
+            'eye_id': eye_id,
+            'confidence': confidence,
+            'norm_pos_x': 0.5 + rng.normal(0, 0.05, n),
+            'norm_pos_y': 0.5 + rng.normal(0, 0.05, n),
+            'diameter': eye_diameter,
+            'method': '2d c++',
+        }))
+    return pd.concat(eyes, ignore_index=True).sort_values('pupil_timestamp', kind='stable', ignore_index=True)
+
+
+def scaled_gaze(gaze):
+    """ The gaze table as ChangeScaling writes it to gaze_positions_new.csv (pixels of a 1280x720 frame). """
+    scaled = gaze.copy()
+    scaled['norm_pos_x'] = scaled['norm_pos_x'] * (1280 - 1) + 1
+    scaled['norm_pos_y'] = scaled['norm_pos_y'] * (720 - 1) + 1
+    return scaled
+
+
+def write_csv(df, path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, index=False, float_format='%.6f')
+    rows[path] = len(df)
+
+
+def write_annotations(events, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        events.to_excel(writer, sheet_name='PL', index=False)
+
+
+def generate_cohort(root, patients=3, minutes=2.0, rate=120, seed=0):
+    """
+    Writes a synthetic cohort.
+
+    Parameters:
+    - root: Output folder; its path must not contain the words in PATH_KEYWORDS
+    - patients: Number of patients of each group (EC, PD); every PD patient has an OFF and an ON visit
+    - minutes: Length of every session
+    - rate: Samples per second of the gaze and of each eye's pupil data
+    - seed: Seed of the random generator, the same seed writes the same cohort
+
+    Returns:
+    - Manifest dictionary with the folders to pass to the scripts and the rows of every CSV file
+      (also saved as manifest.json in root)
+    """
+    root = os.path.abspath(root)
+    found = [keyword for keyword in PATH_KEYWORDS if keyword in root.upper()]
+    if found:
+        raise ValueError(f"The cohort root {root} contains {found}, which the scripts read as a group or condition")
+
+    rng = np.random.default_rng(seed)
+    duration = minutes * 60
+    manifest = {
+        'root': root,
+        'ec_folder': os.path.join(root, 'EC'),
+        'pd_folder': os.path.join(root, 'PD'),
+        'pd_on_paths': [os.path.join(root, 'PD_ON')],
+        'data_folder': os.path.join(root, 'data'),
+        'annotations_folder': os.path.join(root, 'annotations'),
+        'config': {'patients': patients, 'minutes': minutes, 'rate': rate, 'seed': seed},
+        'rows': {},
+    }
+    rows = manifest['rows']
+
+    visits = [('EC', f"HC{number:03d}") for number in range(1, patients + 1)]
+    visits += [(group_name, f"PD{number:03d}") for number in range(1, patients + 1) for group_name in ('PD_OFF', 'PD_ON')]
+    for group_name, patient_id in visits:
+        start_timestamp = rng.uniform(1000, 50000)
+        for condition in CONDITIONS:
+            if group_name == 'EC':
+                session = os.path.join(manifest['ec_folder'], patient_id, f"{patient_id}_{condition}")
+            elif group_name == 'PD_OFF':
+                session = os.path.join(manifest['pd_folder'], patient_id, f"{patient_id}_OFF_{condition}")
+            else:
+                session = os.path.join(manifest['pd_on_paths'][0], 'PD', patient_id, f"{patient_id}_ON_{condition}")
+            export_folder = os.path.join(session, EXPORT_FOLDER)
+
+            events = walking_events(rng, duration)
+            gaze = gaze_positions(rng, duration, rate, events, start_timestamp)
+            write_csv(gaze, os.path.join(export_folder, 'gaze_positions.csv'), rows)
+            write_csv(pupil_positions(rng, duration, rate, group_name, start_timestamp),
+                      os.path.join(export_folder, 'pupil_positions.csv'), rows)
+
+            if condition != 'STRAIGHT':
+                continue
+            # The straight walking session feeds the turn analysis
+            if group_name == 'EC':
+                data_folder = os.path.join(manifest['data_folder'], f"EC_{patient_id}", 'exports')
+                workbook = os.path.join(manifest['annotations_folder'], 'EC', f"{patient_id}_straight_ניתוח.xlsx")
+            else:
+                state = 'off' if group_name == 'PD_OFF' else 'on'
+                data_folder = os.path.join(manifest['data_folder'], f"{patient_id}_{state}", 'exports')
+                workbook = os.path.join(manifest['annotations_folder'], 'PD_STRAIGHT', patient_id,
+                                        f"{patient_id}_{state}_straight.xlsx")
+            write_csv(gaze, os.path.join(data_folder, 'gaze_positions.csv'), rows)
+            write_csv(scaled_gaze(gaze), os.path.join(data_folder, 'gaze_positions_new.csv'), rows)
+            write_annotations(events, workbook)
+        print(f"Synthetic sessions written for {group_name} {patient_id}")
+
+    with open(os.path.join(root, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+
+def load_manifest(root):
+    """ The manifest of a cohort written earlier. """
+    with open(os.path.join(root, 'manifest.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    # Output folder and scale of the cohort
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synthetic_data')
+    manifest = generate_cohort(root, patients=3, minutes=2.0, rate=120)
+    print(f"{len(manifest['rows'])} files, {sum(manifest['rows'].values())} rows written to {root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,81 @@
-from pupil_diameter import filter_file_path
+from session_catalog import FILTER_OPTIONS, get_catalog, load_partitions
+from session_store import read_session
 import os
+import numpy as np
 import pandas as pd
 
+# Define confidence thresholds
+CONFIDENCE_THRESHOLDS = [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8]
+# A dense curve, e.g. for plotting the low confidence percentage against the threshold
+DENSE_CONFIDENCE_THRESHOLDS = np.round(np.linspace(0, 1, 101), 2).tolist()
+
+
+def load_sorted_confidence(file_path):
+    """ Reads the confidence column once and returns it sorted (NaNs dropped) with the total number of rows. """
+    confidence = read_session(file_path, columns=['confidence'])['confidence'].to_numpy(dtype=float)
+    return np.sort(confidence[~np.isnan(confidence)]), len(confidence)
+
+
+def confidence_sweep(sorted_confidence, total_rows, confidence_thresholds):
+    """
+    Percentage of rows with confidence <= threshold, for every threshold at once.
+
+    Parameters:
+    - sorted_confidence, total_rows: Output of load_sorted_confidence
+    - confidence_thresholds: Any number of thresholds
+    """
+    low_confidence_rows = np.searchsorted(sorted_confidence, confidence_thresholds, side='right')
+    return (low_confidence_rows / total_rows) * 100
+
 
 def process_gaze_file(file_path, confidence_threshold):
-    df = pd.read_csv(file_path, low_memory=False)
-    total_rows = len(df)
-    low_confidence_rows = len(df[df['confidence'] <= confidence_threshold])
-    percentage = (low_confidence_rows / total_rows) * 100
-    return percentage
+    sorted_confidence, total_rows = load_sorted_confidence(file_path)
+    return confidence_sweep(sorted_confidence, total_rows, [confidence_threshold])[0]
 
-def process_patient_data(folders, group_name, filter_option, max_patients=10):
-    patient_files = []
-    processed_patients = set()
-    group_identifier = 'ON' if group_name == 'PD_ON' else 'OFF' if group_name == 'PD_OFF' else 'EC'
+def process_patient_data_by_option(folders, group_name, filter_options=FILTER_OPTIONS, max_patients=10,
+                                   confidence_thresholds=CONFIDENCE_THRESHOLDS, loaded=None):
+    """
+    The results of process_patient_data for several filter options, classifying the sessions in
+    one pass and reading every file once, even when it matches more than one option.
 
+    Parameters:
+    - loaded: Dictionary {file_path: (sorted_confidence, total_rows)} shared between calls
+
+    Returns:
+    - Dictionary {filter_option: DataFrame}
+    """
     # Handle multiple folders for 'PD_ON', single for other groups
-    folder_list = folders if isinstance(folders, list) else [folders]
-    for folder in folder_list:
-        for root, dirs, files in os.walk(folder):
-            for file in files:
-                if file == 'pupil_positions.csv':
-                    file_path = os.path.join(root, file)
-                    if filter_file_path(file_path, group_identifier, filter_option):
-                        parts = file_path.split(os.sep)
-                        ec_index = parts.index("PD") if "PD" in parts else parts.index("EC")
-                        patient_id = parts[ec_index + 1] if ec_index != -1 and ec_index + 1 < len(parts) else None
-                        if patient_id and patient_id not in processed_patients:
-                            patient_files.append((file_path, patient_id))
-                            processed_patients.add(patient_id)
-                            if len(patient_files) >= max_patients:
-                                break
-
-    # List to store results
-    results = []
-
-    # Define confidence thresholds
-    confidence_thresholds = [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8]
-
-    # Process each file
-    for file_path, patient_id in patient_files:
-        for threshold in confidence_thresholds:
-            percentage = process_gaze_file(file_path, threshold)
-            results.append({
+    partitions = get_catalog().pupil_file_partitions(folders, group_name, filter_options, max_patients)
+
+    data = {}
+    for filter_option, patient_files in load_partitions(partitions, load_sorted_confidence, loaded).items():
+        # List to store results, one DataFrame per file
+        results = []
+
+        # All thresholds answered from the sorted column of each file
+        for file_path, patient_id, (sorted_confidence, total_rows) in patient_files:
+            percentages = confidence_sweep(sorted_confidence, total_rows, confidence_thresholds)
+            results.append(pd.DataFrame({
                 "File_Path": file_path,
                 "Patient_ID": patient_id,
-                "Confidence_Threshold": threshold,
-                "Low_Confidence_Percentage": percentage,
+                "Confidence_Threshold": confidence_thresholds,
+                "Low_Confidence_Percentage": percentages,
                 "Group": group_name
-            })
+            }))
 
-    # Convert results to a DataFrame
-    return pd.DataFrame(results)
+        # Convert results to a DataFrame
+        if not results:
+            data[filter_option] = pd.DataFrame(columns=["File_Path", "Patient_ID", "Confidence_Threshold",
+                                                        "Low_Confidence_Percentage", "Group"])
+        else:
+            data[filter_option] = pd.concat(results, ignore_index=True)
+    return data
+
+
+def process_patient_data(folders, group_name, filter_option, max_patients=10,
+                         confidence_thresholds=CONFIDENCE_THRESHOLDS):
+    return process_patient_data_by_option(folders, group_name, [filter_option], max_patients,
+                                          confidence_thresholds)[filter_option]
 
 
 def create_excel_report(df, output_folder, filter_option):
@@ -91,12 +115,16 @@ def main():
     output_dir = r'C:\Users\shach\Documents\Shachar-s_Thesis2\results\confidence\confidence_at_different_sessions'
     os.makedirs(output_dir, exist_ok=True)
 
-    # Get data for each group
-    for i in range(1,5):
-        filter_option = i
-        ec_data= process_patient_data(ec_folder, 'EC', filter_option)
-        pd_off_data = process_patient_data(pd_folder, 'PD_OFF', filter_option)
-        pd_on_data = process_patient_data(pd_on_paths, 'PD_ON', filter_option)
+    # Get data for each group, for all filter options from one read of every file
+    loaded = {}
+    ec_data_by_option = process_patient_data_by_option(ec_folder, 'EC', loaded=loaded)
+    pd_off_data_by_option = process_patient_data_by_option(pd_folder, 'PD_OFF', loaded=loaded)
+    pd_on_data_by_option = process_patient_data_by_option(pd_on_paths, 'PD_ON', loaded=loaded)
+
+    for filter_option in FILTER_OPTIONS:
+        ec_data = ec_data_by_option[filter_option]
+        pd_off_data = pd_off_data_by_option[filter_option]
+        pd_on_data = pd_on_data_by_option[filter_option]
 
         # Combine all data into one DataFrame
         all_data = pd.concat([ec_data, pd_off_data, pd_on_data], ignore_index=True)
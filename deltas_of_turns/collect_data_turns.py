@@ -1,36 +1,19 @@
 # i have a file D:\annotations\EC\NB325_straight_ניתוח.xlsx that contains a sheet called PL
 # in this sheet there is a table with column PL_EVENTS that contains events in hebrew
 # i am looking for events that contains "תחילת סיבוב" or "סוף סיבוב" and i want to extract the value in the column SEC.MILI
-# i want to save the output to a new Excel file called "turns_data_EC_NB325.xlsx"
+# i want to save the output to a new file called "turns_data_EC_NB325.parquet" (and optionally an Excel copy)
 
-import pandas as pd
 import os
+from annotation_events import read_pl_events, turn_rows
+from intermediate_store import INTERMEDIATE_SUFFIX, write_intermediate
 
 
-def collect_data_turns(input_file, output_file):
-    # Read the Excel file
-    df = pd.read_excel(input_file, sheet_name='PL', engine='openpyxl')
+def collect_data_turns(input_file, output_file, excel=False):
+    # Read the PL sheet of the Excel file
+    df = read_pl_events(input_file)
 
-    # Filter rows based on the criteria with a regex pattern
-    filtered_df = df[df['PL_EVENTS'].str.contains(r"תחילת.*סיבוב|סיום.*סיבוב", na=False, regex=True)]
-
-    # Initialize a list to store the indices of rows to keep
-    indices_to_keep = []
-
-    i = 0
-    while i < len(filtered_df):
-        current_event = filtered_df.iloc[i]['PL_EVENTS']
-        if "תחילת" in current_event:
-            # Keep the current row
-            indices_to_keep.append(i)
-            # Check if next row contains "סיום"
-            if i < len(filtered_df) - 1 and "סיום" in filtered_df.iloc[i + 1]['PL_EVENTS']:
-                indices_to_keep.append(i + 1)
-                i += 1
-        i += 1
-
-    # Create a new DataFrame with only the rows to keep
-    cleaned_df = filtered_df.iloc[indices_to_keep]
+    # Keep every "תחילת ... סיבוב" row and the "סיום ... סיבוב" row that follows it
+    cleaned_df = turn_rows(df)
 
     # Extract the 'SEC.MILI' column from the cleaned dataframe
     result_df = cleaned_df[['SEC.MILI']]
@@ -39,12 +22,12 @@ def collect_data_turns(input_file, output_file):
     if os.path.exists(output_file):
         os.remove(output_file)
 
-    # Save the cleaned data to a new Excel file
-    result_df.to_excel(output_file, index=False, engine='openpyxl')
+    # Save the cleaned data to a new file (Parquet, and an Excel copy if asked for)
+    write_intermediate(result_df, output_file, excel=excel)
     print("Data collection complete. Data saved to:", output_file)
 
 
-def process_all_files_in_folder(folder_path, output_folder):
+def process_all_files_in_folder(folder_path, output_folder, excel=False):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
@@ -53,10 +36,9 @@ def process_all_files_in_folder(folder_path, output_folder):
             if file.endswith('.xlsx'):
                 input_file = os.path.join(root, file)
                 try:
-                    df = pd.read_excel(input_file, sheet_name='PL', engine='openpyxl')
-                    output_file_name = f"turns_data_{os.path.splitext(file)[0]}.xlsx"
+                    output_file_name = f"turns_data_{os.path.splitext(file)[0]}{INTERMEDIATE_SUFFIX}"
                     output_file = os.path.join(output_folder, output_file_name)
-                    collect_data_turns(input_file, output_file)
+                    collect_data_turns(input_file, output_file, excel)
                 except Exception as e:
                     print(f"Skipping file {input_file}: {e}")
 
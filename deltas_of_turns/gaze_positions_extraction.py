@@ -1,12 +1,17 @@
 import os
-import pandas as pd
+from instrumentation import stage
+from intermediate_store import INTERMEDIATE_SUFFIX, intermediate_files, read_intermediate, write_intermediate
+from interval_index import TimeIntervalIndex
+from parallel import report_failures, run_parallel
+from session_catalog import get_catalog
+from session_store import read_session
 
 # In this example, we have defined a function extract_gaze_positions that takes the path to a turns data file,
 # the path to a folder containing gaze positions data, and the path to an output folder as input.
 # The function reads the turns data and gaze positions data, extracts gaze positions for each turn,
-# and saves the extracted data to an Excel file.
+# and saves the extracted data to a Parquet file (and optionally an Excel copy for the R Markdown reports).
 
-def extract_gaze_positions(turns_file, gaze_folder, output_folder):
+def extract_gaze_positions(turns_file, gaze_folder, output_folder, excel=False):
     # Extract patient ID and ON/OFF state from the turns file name
     base_name = os.path.basename(turns_file)
     patient_id = base_name.split('_')[2]
@@ -18,84 +23,58 @@ def extract_gaze_positions(turns_file, gaze_folder, output_folder):
 
     # Determine the patient's folder name
     # if the folder name contains the patient ID
-    patient_folder = next((f for f in os.listdir(gaze_folder) if
-                           patient_id.lower().replace('_', '-').replace('-', '_')
-                           in f.lower().replace('_','-').replace('-','_')),
-                          None)
+    catalog = get_catalog()
+    patient_folder = catalog.patient_folder(gaze_folder, patient_id)
     if not patient_folder:
-        patient_folder = next((f for f in os.listdir(gaze_folder) if patient_id in f), None)
-        if not patient_folder:
-
-            print(f"Patient folder not found for patient {patient_id}. Skipping...")
-            return
+        raise FileNotFoundError(f"Patient folder not found for patient {patient_id}")
 
     # find the Path to the patient's gaze positions data
-    # the file is inside one sub folder (that may has other subfolder) in the patient_folder so we need to walk through the folder
-    # untill we find 'gaze_positions_new.xlsx' file
-    gaze_file = None
-    for root, dirs, files in os.walk(os.path.join(gaze_folder, patient_folder)):
-        for file in files:
-            if file == 'gaze_positions_new.csv':
-                gaze_file = os.path.join(root, file)
-                break
-        if gaze_file:
-            break
+    # the file is inside one sub folder (that may has other subfolder) in the patient_folder
+    gaze_file = catalog.find_file(os.path.join(gaze_folder, patient_folder), 'gaze_positions_new.csv')
 
     if not gaze_file:
-        print(f"Gaze file not found for patient {patient_id}. Skipping...")
-        return
+        raise FileNotFoundError(f"Gaze file not found for patient {patient_id}")
 
     # Read the turns data and gaze positions data
-    turns_df = pd.read_excel(turns_file)
+    turns_df = read_intermediate(turns_file)
     # Read the gaze data
-    try:
-        gaze_df = pd.read_csv(gaze_file, low_memory=False)
-    except Exception as e:
-        print(f"Error reading gaze file for patient {patient_id}: {e}")
-        return
+    gaze_df = read_session(gaze_file)
 
     # Check if 'SEC.MILI' column exists
     if 'SEC.MILI' not in turns_df.columns:
-        print(f"'SEC.MILI' column not found in turns file for patient {patient_id}. Columns found: {turns_df.columns}")
-        return
-
-    # Initialize an empty DataFrame to store the extracted gaze data
-    extracted_gaze_data = pd.DataFrame()
+        raise ValueError(f"'SEC.MILI' column not found in turns file for patient {patient_id}. Columns found: {turns_df.columns}")
 
     # Ensure the turns data has an even number of rows
     if len(turns_df) % 2 != 0:
-        print(f"Turns data for patient {patient_id} does not contain an even number of rows. Skipping...")
-        return
-
-
+        raise ValueError(f"Turns data for patient {patient_id} does not contain an even number of rows")
 
-    # Iterate through the turns data to extract gaze positions
-    for i in range(0, len(turns_df), 2):
-        start_time = turns_df.iloc[i]['SEC.MILI']
-        if i + 1 < len(turns_df):
-            end_time = turns_df.iloc[i + 1]['SEC.MILI']
-        else:
-            print(f"Turns data for patient {patient_id} has incomplete pairs. Skipping...")
-            return
+    # Rows 0, 2, 4... hold the turn start times and rows 1, 3, 5... the matching end times
+    turn_times = turns_df['SEC.MILI'].to_numpy()
+    start_times, end_times = turn_times[0::2], turn_times[1::2]
 
-        # Extract gaze positions for the current turn
-        turn_gaze_data = gaze_df[(gaze_df.iloc[:, 0] >= start_time) & (gaze_df.iloc[:, 0] <= end_time)]
-        extracted_gaze_data = pd.concat([extracted_gaze_data, turn_gaze_data])
+    # Extract gaze positions for all turns at once: the windows are found by binary search
+    # on the timestamp column and gathered in one go
+    with stage('filter', patient=f"{patient_id}_{state}", file=gaze_file) as record:
+        gaze_index = TimeIntervalIndex.from_frame(gaze_df)
+        extracted_gaze_data = gaze_index.take(gaze_df, start_times, end_times)
+        record.add(rows_in=len(gaze_df), rows_out=len(extracted_gaze_data))
 
     # Output file path
-    output_file_name = f"gaze_data_{patient_id}_{state}.xlsx"
+    output_file_name = f"gaze_data_{patient_id}_{state}{INTERMEDIATE_SUFFIX}"
     output_file_path = os.path.join(output_folder, output_file_name)
 
-    # Save the extracted gaze data to an Excel file
-    extracted_gaze_data.to_excel(output_file_path, index=False)
+    # Save the extracted gaze data (Parquet, and an Excel copy if asked for)
+    write_intermediate(extracted_gaze_data, output_file_path, excel=excel)
     print(f"Gaze data extracted and saved to: {output_file_path}")
+    return output_file_path
 
-def process_all_files_in_folder(turns_folder, gaze_folder, output_folder):
-    for root, _, files in os.walk(turns_folder):
-        for file in files:
-            if file.endswith('.xlsx'):
-                turns_file = os.path.join(root, file)
-                extract_gaze_positions(turns_file, gaze_folder, output_folder)
+def process_all_files_in_folder(turns_folder, gaze_folder, output_folder, excel=False, workers=None):
+    # One task per turns file, run in parallel; the files that could not be processed are listed at the end
+    tasks = [(turns_file, gaze_folder, output_folder, excel)
+             for turns_file in intermediate_files(turns_folder, recursive=True)]
+    results = run_parallel(extract_gaze_positions, tasks, workers, label='gaze extraction')
+    report_failures(results, label='gaze extraction')
+    return results
 
 
 def main():
@@ -103,7 +82,8 @@ def main():
     gaze_folder = r"C:\Users\shach\Documents\Shachar's_Thesis1\preproccesing_data\data"
     output_folder = r"C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\output_files"
 
-    process_all_files_in_folder(turns_folder, gaze_folder, output_folder)
+    # The R Markdown reports read the gaze data from Excel files
+    process_all_files_in_folder(turns_folder, gaze_folder, output_folder, excel=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+import os
+import numpy as np
+import pandas as pd
+from instrumentation import stage
+from intermediate_store import intermediate_files, read_intermediate, write_intermediate
+from interval_index import TimeIntervalIndex
+from parallel import report_failures, run_parallel
+from session_catalog import get_catalog
+from session_store import read_session
+
+# One engine for the gaze deltas of the 180-degree turns (end point - anchor point).
+# An anchor is the point of the turn the delta is measured from, given as a fraction of the
+# turn duration: 'start' gives the deltas of x_deltas.xlsx, 'middle' the ones of x_deltas_middle.xlsx.
+# Any other fraction (e.g. 0.3) can be passed as well.
+ANCHORS = {'start': 0.0, '25%': 0.25, 'middle': 0.5, '75%': 0.75}
+# Anchor name -> suffix of the report files (x_deltas{suffix}.xlsx / y_deltas{suffix}.xlsx)
+REPORT_SUFFIXES = {'start': '', 'middle': '_middle', '25%': '_25', '75%': '_75'}
+
+
+def parse_turns_file_name(turns_file):
+    """ Extracts the patient ID and the state (ON/OFF/EC) from a turns_data file name. """
+    base_name = os.path.basename(turns_file)
+    patient_id = base_name.split('_')[2]
+
+    # not all patients have the state in the file name
+    if 'off' in base_name.lower() or 'on' in base_name.lower():
+        state = 'OFF' if 'off' in base_name.lower() else 'ON'
+    else:
+        state = 'EC'
+    return patient_id, state
+
+
+def anchor_fraction(anchor):
+    """ The fraction of the turn duration for an anchor name or a number between 0 and 1. """
+    if anchor in ANCHORS:
+        return ANCHORS[anchor]
+    fraction = float(anchor)
+    if not 0 <= fraction <= 1:
+        raise ValueError(f"Anchor {anchor} is not a fraction of the turn between 0 and 1")
+    return fraction
+
+
+def find_gaze_file(gaze_folder, patient_id):
+    """ Finds the patient's gaze_positions_new.csv in the data folder, or None. """
+    catalog = get_catalog()
+    patient_folder = catalog.patient_folder(gaze_folder, patient_id)
+    if not patient_folder:
+        print(f"Patient folder not found for patient {patient_id}. Skipping...")
+        return None
+
+    gaze_file = catalog.find_file(os.path.join(gaze_folder, patient_folder), 'gaze_positions_new.csv')
+    if not gaze_file:
+        print(f"Gaze file not found for patient {patient_id}. Skipping...")
+    return gaze_file
+
+
+def turn_deltas(gaze_df, start_times, end_times, fractions):
+    """
+    Calculate the x/y gaze deltas of every turn of one session for every anchor at once.
+
+    For anchor fraction f the delta is taken between the first and the last gaze sample in
+    [start + f * (end - start), end].
+
+    Parameters:
+    - gaze_df: Gaze data with the '#VALUE!', 'norm_pos_x' and 'norm_pos_y' columns
+    - start_times, end_times: Arrays with the start and end time of every turn
+    - fractions: List of anchor fractions
+
+    Returns:
+    - x_deltas, y_deltas: Arrays of shape (anchors, turns)
+    - found: Boolean array of the same shape, False where the window holds no gaze data
+    """
+    fractions = np.asarray(fractions, dtype=float)[:, np.newaxis]
+    anchor_times = start_times + fractions * (end_times - start_times)
+    window_ends = np.broadcast_to(end_times, anchor_times.shape)
+
+    gaze_index = TimeIntervalIndex(gaze_df['#VALUE!'])
+    first_rows, last_rows = gaze_index.window_ends(anchor_times.ravel(), window_ends.ravel())
+    first_rows = first_rows.reshape(anchor_times.shape)
+    last_rows = last_rows.reshape(anchor_times.shape)
+    empty = first_rows == -1
+    if len(gaze_df) == 0:
+        first_rows = last_rows = np.zeros_like(first_rows)
+        gaze_df = gaze_df.reindex([0])
+
+    x_values = gaze_df['norm_pos_x'].to_numpy(dtype=float)
+    y_values = gaze_df['norm_pos_y'].to_numpy(dtype=float)
+    x_deltas = np.where(empty, np.nan, x_values[last_rows] - x_values[first_rows])
+    y_deltas = np.where(empty, np.nan, y_values[last_rows] - y_values[first_rows])
+    return x_deltas, y_deltas, ~empty
+
+
+def session_turn_deltas(gaze_file, session_turns_files, fractions):
+    """
+    The deltas of all turns files of one gaze file (read once).
+
+    Returns:
+    - List of (position, ('patient_id_state', x_deltas, y_deltas, found)) for the turns files
+    """
+    gaze_df = read_session(gaze_file, columns=['#VALUE!', 'norm_pos_x', 'norm_pos_y'])
+    results = []
+    for position, turns_file, patient_id, state in session_turns_files:
+        turn_times = read_intermediate(turns_file, columns=['SEC.MILI'])['SEC.MILI'].to_numpy(dtype=float)
+        start_times, end_times = turn_times[0:len(turn_times) - 1:2], turn_times[1::2]
+        if len(turn_times) % 2 != 0:
+            print(f"Turns data for patient {patient_id} has incomplete pairs. Skipping the last turn...")
+
+        with stage('deltas', patient=f"{patient_id}_{state}", file=gaze_file) as record:
+            x_deltas, y_deltas, found = turn_deltas(gaze_df, start_times, end_times, fractions)
+            record.add(rows_in=len(start_times), rows_out=int(found.all(axis=0).sum()))
+        for turn in np.flatnonzero(~found.all(axis=0)):
+            print(f"No matching gaze data found for turn {turn + 1} of patient {patient_id}. Skipping this turn...")
+        results.append((position, (f"{patient_id}_{state}", x_deltas, y_deltas, found)))
+    return results
+
+
+def collect_turn_deltas(turns_folder, gaze_folder, anchors=('start', 'middle'), workers=None):
+    """
+    Calculate the deltas of all turns of all patients for all anchors.
+    Every gaze file is read once, however many turns files and anchors refer to it, and the
+    gaze files are processed on a pool of workers (see parallel.run_parallel).
+
+    Returns:
+    - Dictionary {anchor: (x_df, y_df)} with the 'patient_id_state' and 'delta' columns
+    """
+    fractions = [anchor_fraction(anchor) for anchor in anchors]
+
+    # Step 1: Find the gaze file of every turns file
+    turns_files = intermediate_files(turns_folder, recursive=True)
+
+    sessions = {}
+    for position, turns_file in enumerate(turns_files):
+        patient_id, state = parse_turns_file_name(turns_file)
+        gaze_file = find_gaze_file(gaze_folder, patient_id)
+        if gaze_file:
+            sessions.setdefault(gaze_file, []).append((position, turns_file, patient_id, state))
+
+    # Step 2: Read every gaze file once and calculate the deltas of all its turns
+    results = [None] * len(turns_files)
+    session_results = run_parallel(session_turn_deltas,
+                                   [(gaze_file, session_turns_files, fractions)
+                                    for gaze_file, session_turns_files in sessions.items()],
+                                   workers, label='turn deltas')
+    report_failures(session_results, label='turn deltas')
+    for session_result in session_results:
+        for position, result in session_result.value or []:
+            results[position] = result
+
+    # Step 3: One table per anchor, in the order of the turns files
+    return delta_tables(results, anchors)
+
+
+def delta_tables(results, anchors):
+    """
+    The deltas of session_turn_deltas results as one table per anchor, in the order of the results.
+
+    Returns:
+    - Dictionary {anchor: (x_df, y_df)} with the 'patient_id_state' and 'delta' columns
+    """
+    deltas = {}
+    for anchor_index, anchor in enumerate(anchors):
+        tables = {}
+        for axis, axis_index in (('x', 1), ('y', 2)):
+            frames = [
+                pd.DataFrame({'patient_id_state': result[0],
+                              'delta': result[axis_index][anchor_index][result[3][anchor_index]]})
+                for result in results if result is not None
+            ]
+            tables[axis] = pd.concat(frames, ignore_index=True) if frames else \
+                pd.DataFrame(columns=['patient_id_state', 'delta'])
+        deltas[anchor] = (tables['x'], tables['y'])
+    return deltas
+
+
+def write_session_deltas(turns_file, gaze_file, output_file, anchors=('start', 'middle')):
+    """
+    Calculates the deltas of one turns file for all anchors and writes them as an intermediate file
+    (one row per anchor and turn), so turns_pipeline only recalculates the sessions that changed.
+    """
+    patient_id, state = parse_turns_file_name(turns_file)
+    fractions = [anchor_fraction(anchor) for anchor in anchors]
+    [(_, (name, x_deltas, y_deltas, found))] = session_turn_deltas(gaze_file, [(0, turns_file, patient_id, state)],
+                                                                   fractions)
+    turns = x_deltas.shape[1]
+    table = pd.DataFrame({
+        'patient_id_state': name,
+        'anchor': np.repeat([str(anchor) for anchor in anchors], turns),
+        'turn': np.tile(np.arange(1, turns + 1), len(anchors)),
+        'x_delta': x_deltas.ravel(),
+        'y_delta': y_deltas.ravel(),
+        'found': found.ravel(),
+    })
+    return write_intermediate(table, output_file)
+
+
+def collect_session_deltas(session_files, anchors=('start', 'middle')):
+    """
+    The tables of collect_turn_deltas from files written by write_session_deltas, in the order of
+    the files; files that do not exist (e.g. a session that failed) are left out.
+    """
+    results = []
+    for session_file in session_files:
+        if not os.path.exists(session_file):
+            continue
+        table = read_intermediate(session_file)
+        if table.empty:
+            continue
+        by_anchor = [table[table['anchor'] == str(anchor)].sort_values('turn') for anchor in anchors]
+        results.append((table['patient_id_state'].iloc[0],
+                        np.stack([rows['x_delta'].to_numpy(dtype=float) for rows in by_anchor]),
+                        np.stack([rows['y_delta'].to_numpy(dtype=float) for rows in by_anchor]),
+                        np.stack([rows['found'].to_numpy(dtype=bool) for rows in by_anchor])))
+    return delta_tables(results, anchors)
+
+
+def write_delta_reports(deltas, output_folder):
+    """ Writes x_deltas{suffix}.xlsx and y_deltas{suffix}.xlsx with the Deltas and Statistics sheets for every anchor. """
+    os.makedirs(output_folder, exist_ok=True)
+
+    for anchor, (x_df, y_df) in deltas.items():
+        suffix = REPORT_SUFFIXES.get(anchor, f"_{anchor}")
+        for axis, df in (('x', x_df), ('y', y_df)):
+            stats = df.groupby('patient_id_state')['delta'].agg(['mean', 'std']).reset_index()
+            with pd.ExcelWriter(os.path.join(output_folder, f'{axis}_deltas{suffix}.xlsx')) as writer:
+                df.to_excel(writer, sheet_name='Deltas', index=False)
+                stats.to_excel(writer, sheet_name='Statistics', index=False)
+
+    print(f"Excel files have been saved in: {output_folder}")
+
+
+def main():
+    turns_folder = r"C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\output_files\turns_data"
+    gaze_folder = r"C:\Users\shach\Documents\Shachar's_Thesis1\preproccesing_data\data"
+    output_folder = r"C:\Users\shach\Documents\Shachar-s_Thesis2\results\deltas_of_turns"
+
+    # All anchors in one pass over the cohort
+    deltas = collect_turn_deltas(turns_folder, gaze_folder, anchors=['start', '25%', 'middle', '75%'])
+    write_delta_reports(deltas, output_folder)
+
+
+if __name__ == "__main__":
+    main()
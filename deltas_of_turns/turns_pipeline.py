@@ -0,0 +1,157 @@
+import os
+import collect_data_straight
+import gaze_positions_extraction
+import gaze_positions_non_data_extraction
+from collect_data_turns import collect_data_turns
+from intermediate_store import INTERMEDIATE_SUFFIX, excel_path, intermediate_files
+from pipeline_runner import PipelineRunner, Task
+from session_catalog import get_catalog
+from turn_deltas import REPORT_SUFFIXES, collect_session_deltas, find_gaze_file, parse_turns_file_name, \
+    write_delta_reports, write_session_deltas
+
+# The turn analysis as one incremental pipeline:
+#   annotation workbooks -> turns_data -> non_turns_data (straight walking)
+#   turns_data + gaze files -> gaze data of the turns
+#   turns_data + gaze files -> deltas of every session -> delta reports of the cohort
+#   non_turns_data + gaze files -> gaze data of the straight walking
+# Every stage runs the existing script function for one patient at a time, and only for the
+# patients whose annotation workbook, turns file or gaze file changed since the last run.
+# The stages hand each other Parquet files; with excel=True an Excel copy of every intermediate
+# file is written as well (the R Markdown reports read the gaze data from Excel).
+FOLDERS = {
+    'annotations': r"D:\annotations",
+    'gaze': r"C:\Users\shach\Documents\Shachar's_Thesis1\preproccesing_data\data",
+    'turns': r"C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\output_files\turns_data",
+    'non_turns': r"C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\non_turns_data",
+    'turns_gaze': r"C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\output_files\gaze_data",
+    'non_turns_gaze': r"C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\non_turns_data\gaze_data",
+    'deltas': r"C:\Users\shach\Documents\Shachar-s_Thesis2\results\deltas_of_turns",
+}
+DELTA_ANCHORS = ['start', '25%', 'middle', '75%']
+STATE_FILE_NAME = '.turns_pipeline_state.json'
+# Subfolder of the deltas folder with the deltas of every session
+SESSION_DELTAS_FOLDER = 'session_deltas'
+
+
+def outputs_of(output_file, excel):
+    """ The files a task writes: the Parquet file, and its Excel copy if asked for. """
+    return [output_file, excel_path(output_file)] if excel else [output_file]
+
+
+def plan_turns(folders, excel=False):
+    """ One task per annotation workbook: the start/end times of its turns. """
+    tasks = []
+    for input_file in get_catalog().files(folders['annotations'], 'annotation'):
+        output_file = os.path.join(folders['turns'],
+                                   f"turns_data_{os.path.splitext(os.path.basename(input_file))[0]}{INTERMEDIATE_SUFFIX}")
+        tasks.append(Task(input_file, lambda i=input_file, o=output_file: collect_data_turns(i, o, excel),
+                          inputs=[input_file], outputs=outputs_of(output_file, excel), params={'excel': excel}))
+    return tasks
+
+
+def plan_non_turns(folders, excel=False):
+    """ One task per turns_data file: the straight walking intervals between the turns. """
+    tasks = []
+    for turns_file in intermediate_files(folders['turns'], 'turns_data'):
+        annotations_file = collect_data_straight.find_annotations_file(turns_file, folders['annotations'])
+        output_file = os.path.join(folders['non_turns'],
+                                   f"non_turns_data_{os.path.splitext(os.path.basename(turns_file))[0]}{INTERMEDIATE_SUFFIX}")
+        tasks.append(Task(
+            os.path.basename(turns_file),
+            lambda t=turns_file, o=output_file: collect_data_straight.collect_data_turns(t, o, folders['annotations'], excel),
+            inputs=[turns_file, annotations_file], outputs=outputs_of(output_file, excel), params={'excel': excel}))
+    return tasks
+
+
+def plan_turns_gaze(folders, excel=False):
+    """ One task per turns_data file: the gaze positions recorded during the turns. """
+    tasks = []
+    for turns_file in intermediate_files(folders['turns'], 'turns_data'):
+        patient_id, state = parse_turns_file_name(turns_file)
+        gaze_file = find_gaze_file(folders['gaze'], patient_id)
+        output_file = os.path.join(folders['turns_gaze'], f"gaze_data_{patient_id}_{state}{INTERMEDIATE_SUFFIX}")
+        tasks.append(Task(
+            os.path.basename(turns_file),
+            lambda t=turns_file: gaze_positions_extraction.extract_gaze_positions(
+                t, folders['gaze'], folders['turns_gaze'], excel),
+            inputs=[turns_file, gaze_file], outputs=outputs_of(output_file, excel), params={'excel': excel}))
+    return tasks
+
+
+def plan_non_turns_gaze(folders, excel=False):
+    """ One task per non_turns_data file: the gaze positions recorded while walking straight. """
+    tasks = []
+    for turns_file in intermediate_files(folders['non_turns'], 'non_turns_data'):
+        patient_id, output_file_name = gaze_positions_non_data_extraction.parse_non_turns_file_name(turns_file)
+        gaze_file = find_gaze_file(folders['gaze'], patient_id)
+        output_file = os.path.join(folders['non_turns_gaze'], output_file_name)
+        tasks.append(Task(
+            os.path.basename(turns_file),
+            lambda t=turns_file: gaze_positions_non_data_extraction.extract_gaze_positions(
+                t, folders['gaze'], folders['non_turns_gaze'], excel),
+            inputs=[turns_file, gaze_file], outputs=outputs_of(output_file, excel), params={'excel': excel}))
+    return tasks
+
+
+def delta_sessions(folders):
+    """ (turns_file, gaze_file, session deltas file) of every turns_data file that has a gaze file. """
+    sessions = []
+    for turns_file in intermediate_files(folders['turns'], 'turns_data'):
+        patient_id, _ = parse_turns_file_name(turns_file)
+        gaze_file = find_gaze_file(folders['gaze'], patient_id)
+        if gaze_file:
+            session_file = os.path.join(folders['deltas'], SESSION_DELTAS_FOLDER,
+                                        f"deltas_{os.path.splitext(os.path.basename(turns_file))[0]}{INTERMEDIATE_SUFFIX}")
+            sessions.append((turns_file, gaze_file, session_file))
+    return sessions
+
+
+def plan_session_deltas(folders, anchors=DELTA_ANCHORS):
+    """ One task per turns_data file: the deltas of its turns for every anchor. """
+    return [Task(os.path.basename(turns_file),
+                 lambda t=turns_file, g=gaze_file, s=session_file: write_session_deltas(t, g, s, anchors),
+                 inputs=[turns_file, gaze_file], outputs=[session_file], params={'anchors': list(anchors)})
+            for turns_file, gaze_file, session_file in delta_sessions(folders)]
+
+
+def plan_deltas(folders, anchors=DELTA_ANCHORS):
+    """ One task for the cohort that only gathers the session deltas into the Excel reports. """
+    session_files = [session_file for _, _, session_file in delta_sessions(folders)]
+    outputs = [os.path.join(folders['deltas'], f"{axis}_deltas{REPORT_SUFFIXES.get(anchor, f'_{anchor}')}.xlsx")
+               for anchor in anchors for axis in ('x', 'y')]
+
+    def run_deltas():
+        write_delta_reports(collect_session_deltas(session_files, anchors), folders['deltas'])
+
+    return [Task('cohort', run_deltas, inputs=session_files, outputs=outputs, params={'anchors': list(anchors)})]
+
+
+def build_turns_pipeline(folders=FOLDERS, state_file=None, excel=False):
+    """
+    The PipelineRunner of the turn analysis; the state is kept next to the turns_data folder by default.
+    With excel=True every intermediate file also gets an Excel copy.
+    """
+    for key in ('turns', 'non_turns', 'turns_gaze', 'non_turns_gaze', 'deltas'):
+        os.makedirs(folders[key], exist_ok=True)
+    os.makedirs(os.path.join(folders['deltas'], SESSION_DELTAS_FOLDER), exist_ok=True)
+    if state_file is None:
+        state_file = os.path.join(os.path.dirname(folders['turns']), STATE_FILE_NAME)
+
+    runner = PipelineRunner(state_file)
+    runner.add_stage('turns', lambda: plan_turns(folders, excel))
+    runner.add_stage('non_turns', lambda: plan_non_turns(folders, excel), after=['turns'])
+    runner.add_stage('turns_gaze', lambda: plan_turns_gaze(folders, excel), after=['turns'])
+    runner.add_stage('non_turns_gaze', lambda: plan_non_turns_gaze(folders, excel), after=['non_turns'])
+    runner.add_stage('session_deltas', lambda: plan_session_deltas(folders), after=['turns'])
+    runner.add_stage('deltas', lambda: plan_deltas(folders), after=['session_deltas'])
+    return runner
+
+
+def main():
+    # Re-runs only what changed since the last run; pass force=True to run everything again
+    runner = build_turns_pipeline()
+    runner.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from parallel import default_workers, report_failures, run_parallel
+
+# Patient-grouped cross-validation of the classifiers.
+# The samples of one patient are strongly correlated, so a split over single samples puts the same
+# patient in training and test and the score says little about new patients. Here every fold
+# holds out whole patients:
+#   'stratified'            - k folds of patients with about the same share of every class (StratifiedGroupKFold)
+#   'group'                 - k folds of patients of about the same size (GroupKFold)
+#   'leave_one_patient_out' - one fold per patient
+# The folds are trained at the same time, one per worker process (see parallel.run_parallel), each
+# limited to its share of the CPU threads so the workers do not compete for the cores. The data is
+# written once as .npy files that every worker memory-maps instead of receiving a copy; the scaling
+# is fitted on the training patients of each fold. The metrics of the folds are summarized with
+# their mean, standard deviation and a t confidence interval.
+CV_METHODS = ('stratified', 'group', 'leave_one_patient_out')
+NUM_CLASSES = 3
+CONFIDENCE = 0.95
+METRICS = ['accuracy', 'balanced_accuracy', 'f1_macro', 'loss']
+FEATURES_FILE = 'features.npy'
+LABELS_FILE = 'labels.npy'
+FOLDS_FILE = 'folds.npy'
+
+_threads = None
+
+
+def patient_folds(labels, patient_ids, method='stratified', n_splits=5, seed=42):
+    """
+    The test fold of every sample, with each patient in exactly one fold.
+
+    Parameters:
+    - labels: Class of every sample
+    - patient_ids: Patient of every sample
+    - method: One of CV_METHODS
+    - n_splits: Number of folds of 'stratified' and 'group' (at most the number of patients)
+    - seed: Seed of the shuffle of 'stratified'
+
+    Returns:
+    - int32 array with the fold number (0..folds-1) of every sample
+    """
+    from sklearn.model_selection import GroupKFold, LeaveOneGroupOut, StratifiedGroupKFold
+
+    patient_count = len(np.unique(patient_ids))
+    if method == 'leave_one_patient_out':
+        splitter = LeaveOneGroupOut()
+    elif method in ('stratified', 'group'):
+        n_splits = min(n_splits, patient_count)
+        if method == 'stratified':
+            splitter = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+        else:
+            splitter = GroupKFold(n_splits=n_splits)
+    else:
+        raise ValueError(f"Unknown cross-validation method: {method} (use one of {CV_METHODS})")
+    if patient_count < 2:
+        raise ValueError("Cross-validation needs at least two patients")
+
+    folds = np.full(len(labels), -1, dtype=np.int32)
+    for fold, (_, test_indices) in enumerate(splitter.split(np.zeros(len(labels)), labels, patient_ids)):
+        folds[test_indices] = fold
+    return folds
+
+
+def limit_threads(threads):
+    """ Limits the threads TensorFlow uses in this process (only possible before it starts running). """
+    global _threads
+    if _threads == threads:
+        return
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(min(2, threads))
+    except RuntimeError:
+        # TensorFlow is already running in this process (e.g. workers=1); keep its settings
+        pass
+    _threads = threads
+
+
+def fold_metrics(labels, probabilities):
+    """ accuracy, balanced_accuracy, f1_macro and loss (cross-entropy) of the predicted class probabilities. """
+    from sklearn.metrics import accuracy_score, balanced_accuracy_score, f1_score, log_loss
+
+    predicted = probabilities.argmax(axis=1)
+    return {
+        'accuracy': accuracy_score(labels, predicted),
+        'balanced_accuracy': balanced_accuracy_score(labels, predicted),
+        'f1_macro': f1_score(labels, predicted, labels=list(range(NUM_CLASSES)), average='macro', zero_division=0),
+        'loss': log_loss(labels, probabilities, labels=list(range(NUM_CLASSES))),
+    }
+
+
+def run_fold(fold, build, data_dir, epochs, batch_size, threads, seed):
+    """
+    Trains build(input_dim) on all folds but `fold` and evaluates it on that fold (runs in a worker).
+
+    Returns:
+    - Dictionary with the fold, its train/test sizes and its METRICS
+    """
+    limit_threads(threads)
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed + fold)
+    features = np.load(os.path.join(data_dir, FEATURES_FILE), mmap_mode='r')
+    labels = np.load(os.path.join(data_dir, LABELS_FILE), mmap_mode='r')
+    folds = np.load(os.path.join(data_dir, FOLDS_FILE), mmap_mode='r')
+    train_indices = np.flatnonzero(folds != fold)
+    test_indices = np.flatnonzero(folds == fold)
+
+    # Scaling fitted on the training patients only
+    x_train = features[train_indices]
+    mean = x_train.mean(axis=0)
+    std = x_train.std(axis=0)
+    std[std == 0] = 1
+    x_train = (x_train - mean) / std
+    x_test = (features[test_indices] - mean) / std
+
+    model = build(features.shape[1])
+    model.fit(x_train, tf.keras.utils.to_categorical(labels[train_indices], NUM_CLASSES),
+              epochs=epochs, batch_size=batch_size, verbose=0)
+    probabilities = model.predict(x_test, batch_size=max(batch_size, 1024), verbose=0)
+    result = {'fold': fold, 'train_samples': len(train_indices), 'test_samples': len(test_indices)}
+    result.update(fold_metrics(np.asarray(labels[test_indices]), probabilities))
+    return result
+
+
+def summarize(fold_results, confidence=CONFIDENCE):
+    """
+    Mean, standard deviation and t confidence interval of every metric over the folds.
+
+    Returns:
+    - DataFrame with one row per metric (the interval is NaN with a single fold)
+    """
+    from scipy import stats
+
+    rows = []
+    for metric in METRICS:
+        values = fold_results[metric].to_numpy(dtype=float)
+        n = len(values)
+        mean = values.mean() if n else np.nan
+        std = values.std(ddof=1) if n > 1 else np.nan
+        half_width = stats.t.ppf((1 + confidence) / 2, n - 1) * std / np.sqrt(n) if n > 1 else np.nan
+        rows.append({'metric': metric, 'mean': mean, 'std': std, 'ci_low': mean - half_width,
+                     'ci_high': mean + half_width, 'folds': n})
+    return pd.DataFrame(rows)
+
+
+def cross_validate(features, labels, patient_ids, build, method='stratified', n_splits=5, epochs=20, batch_size=32,
+                   workers=None, threads=None, seed=42, output_dir=None, data_dir=None):
+    """
+    Patient-grouped cross-validation of a model, training the folds in parallel.
+
+    Parameters:
+    - features: (samples, features) array; labels: class of every sample (0..NUM_CLASSES-1);
+      patient_ids: patient of every sample
+    - build: Module-level function(input_dim) returning a compiled Keras model (e.g. nn_parckinson_2.build_model)
+    - method, n_splits, seed: How the patients are split (see patient_folds)
+    - epochs, batch_size: Training of every fold
+    - workers: Folds trained at the same time (None for one per fold, up to default_workers())
+    - threads: CPU threads of every worker (None to share the cores between the workers)
+    - output_dir: If given, the fold results and the summary are saved there as CSV
+    - data_dir: Folder for the memory-mapped data (None for a temporary folder that is removed)
+
+    Returns:
+    - (DataFrame of the fold results, summary DataFrame)
+    """
+    folds = patient_folds(labels, patient_ids, method, n_splits, seed)
+    fold_count = int(folds.max()) + 1
+    workers = min(fold_count, default_workers() if workers is None else workers)
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+
+    temporary = data_dir is None
+    data_dir = tempfile.mkdtemp(prefix='cross_validation_') if temporary else data_dir
+    os.makedirs(data_dir, exist_ok=True)
+    try:
+        np.save(os.path.join(data_dir, FEATURES_FILE), np.asarray(features, dtype=np.float32))
+        np.save(os.path.join(data_dir, LABELS_FILE), np.asarray(labels, dtype=np.int64))
+        np.save(os.path.join(data_dir, FOLDS_FILE), folds)
+        print(f"Cross-validation ({method}): {fold_count} folds of {len(np.unique(patient_ids))} patients, "
+              f"{workers} workers with {threads} threads each")
+
+        # Workers are started fresh, as the caller has usually loaded TensorFlow already
+        tasks = [(fold, build, data_dir, epochs, batch_size, threads, seed) for fold in range(fold_count)]
+        results = run_parallel(run_fold, tasks, workers, label='cross-validation', start_method='spawn')
+        report_failures(results, label='cross-validation')
+    finally:
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    fold_results = pd.DataFrame([result.value for result in results if result.ok],
+                                columns=['fold', 'train_samples', 'test_samples'] + METRICS)
+    summary = summarize(fold_results)
+    for row in summary.itertuples():
+        print(f"{row.metric}: {row.mean:.4f} ± {row.std:.4f} "
+              f"({CONFIDENCE:.0%} CI {row.ci_low:.4f} - {row.ci_high:.4f}, {row.folds} folds)")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        fold_results.to_csv(os.path.join(output_dir, 'cross_validation_folds.csv'), index=False)
+        summary.to_csv(os.path.join(output_dir, 'cross_validation_summary.csv'), index=False)
+    return fold_results, summary
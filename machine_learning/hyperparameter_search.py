@@ -0,0 +1,235 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from cross_validation import NUM_CLASSES, limit_threads, patient_folds
+from parallel import default_workers, report_failures, run_parallel
+
+# Hyperparameter search for the dense classifier (nn_parckinson_2.build_model) by successive halving.
+# n_trials configurations are drawn at random from a search space and trained for min_epochs; the
+# best 1/eta of them (by validation loss) are trained on to eta times as many epochs, and so on up
+# to max_epochs, so the poor configurations are stopped after a few epochs. A trial continues from
+# the model (weights and optimizer state) it saved at the previous rung.
+# min_epochs == max_epochs is a plain random search.
+# The trials of a rung run at the same time in worker processes with a bounded number of threads.
+# The data is split once by patient (see cross_validation.patient_folds), scaled with the training
+# statistics and written to .npy files that every worker memory-maps.
+# Everything is kept in search_dir, so an interrupted search picks up where it stopped when it is
+# run again with the same settings:
+#   search.json                       the settings of the search
+#   data/                             the memory-mapped training and validation arrays
+#   trials/<trial>/rung<k>.json       the configuration and validation metrics of a finished rung
+#   trials/<trial>/rung<k>.keras      the model the next rung continues from
+#   results.csv                       all finished rungs, written at the end
+SEARCH_FILE = 'search.json'
+RESULTS_FILE = 'results.csv'
+DATA_FILES = ('x_train.npy', 'y_train.npy', 'x_val.npy', 'y_val.npy')
+
+# Lists are sampled uniformly, ('log', low, high) log-uniformly
+SEARCH_SPACE = {
+    'units': [(64, 32), (128, 64), (128, 64, 32), (256, 128, 64), (256, 128, 64, 32)],
+    'dropout': [0.0, 0.1, 0.2, 0.3, 0.5],
+    'optimizer': ['adam', 'rmsprop', 'sgd'],
+    'learning_rate': ('log', 1e-4, 1e-2),
+    'batch_size': [32, 64, 128, 256],
+}
+
+
+def sample_configs(n_trials, space=SEARCH_SPACE, seed=42):
+    """ n_trials random configurations of the space; the same seed gives the same configurations. """
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(n_trials):
+        config = {}
+        for name, values in space.items():
+            if isinstance(values, tuple) and values[0] == 'log':
+                config[name] = float(np.exp(rng.uniform(np.log(values[1]), np.log(values[2]))))
+            else:
+                value = values[rng.integers(len(values))]
+                config[name] = list(value) if isinstance(value, tuple) else value
+        configs.append(config)
+    return configs
+
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    """ Total epochs of a trial at every rung: min_epochs, min_epochs * eta, ..., max_epochs. """
+    epochs = [min_epochs]
+    while epochs[-1] < max_epochs:
+        epochs.append(min(max_epochs, epochs[-1] * eta))
+    return epochs
+
+
+def write_search_data(data_dir, features, labels, patient_ids, validation_size=0.2, seed=42):
+    """
+    Splits the data by patient (about validation_size of the patients for validation), scales it
+    with the mean and deviation of the training part and writes the DATA_FILES.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    n_splits = max(2, int(round(1 / validation_size)))
+    validation = patient_folds(labels, patient_ids, 'stratified', n_splits, seed) == 0
+    features = np.asarray(features, dtype=np.float32)
+    mean = features[~validation].mean(axis=0)
+    std = features[~validation].std(axis=0)
+    std[std == 0] = 1
+    arrays = [(features[~validation] - mean) / std, labels[~validation], (features[validation] - mean) / std,
+              labels[validation]]
+    for file_name, array in zip(DATA_FILES, arrays):
+        np.save(os.path.join(data_dir, file_name), np.asarray(array, dtype=np.int64 if file_name.startswith('y') else np.float32))
+    np.savez(os.path.join(data_dir, 'scaling.npz'), mean=mean, std=std)
+    print(f"Search data: {int((~validation).sum())} training and {int(validation.sum())} validation samples")
+
+
+def trial_name(trial):
+    return f"trial_{trial:04d}"
+
+
+def load_finished(search_dir):
+    """ {(trial, rung): result} of the rungs finished so far. """
+    finished = {}
+    trials_dir = os.path.join(search_dir, 'trials')
+    if not os.path.isdir(trials_dir):
+        return finished
+    for name in os.listdir(trials_dir):
+        for file in os.listdir(os.path.join(trials_dir, name)):
+            if file.startswith('rung') and file.endswith('.json'):
+                with open(os.path.join(trials_dir, name, file), encoding='utf-8') as f:
+                    result = json.load(f)
+                finished[(result['trial'], result['rung'])] = result
+    return finished
+
+
+def run_trial(trial, build, config, search_dir, rung, epochs, initial_epoch, threads, seed):
+    """
+    Trains one configuration from initial_epoch to epochs and saves the model and its validation
+    metrics (runs in a worker).
+
+    Returns:
+    - Dictionary with the trial, rung, epochs, config, val_loss and val_accuracy
+    """
+    limit_threads(threads)
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed + trial)
+    data_dir = os.path.join(search_dir, 'data')
+    x_train, y_train, x_val, y_val = [np.load(os.path.join(data_dir, file_name), mmap_mode='r') for file_name in DATA_FILES]
+    trial_dir = os.path.join(search_dir, 'trials', trial_name(trial))
+    if initial_epoch > 0:
+        model = tf.keras.models.load_model(os.path.join(trial_dir, f"rung{rung - 1}.keras"))
+    else:
+        model = build(x_train.shape[1], **{name: value for name, value in config.items() if name != 'batch_size'})
+    model.fit(x_train, tf.keras.utils.to_categorical(y_train, NUM_CLASSES), epochs=epochs, initial_epoch=initial_epoch,
+              batch_size=config['batch_size'], verbose=0)
+    val_loss, val_accuracy = model.evaluate(x_val, tf.keras.utils.to_categorical(y_val, NUM_CLASSES),
+                                            batch_size=max(config['batch_size'], 1024), verbose=0)
+    model.save(os.path.join(trial_dir, f"rung{rung}.keras"))
+
+    result = {'trial': trial, 'rung': rung, 'epochs': epochs, 'config': config,
+              'val_loss': float(val_loss), 'val_accuracy': float(val_accuracy)}
+    # Written last and atomically: a rung counts as finished only once its model is saved
+    result_path = os.path.join(trial_dir, f"rung{rung}.json")
+    with open(result_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+    os.replace(result_path + '.tmp', result_path)
+    return result
+
+
+def search(features, labels, patient_ids, build, search_dir, n_trials=27, min_epochs=2, max_epochs=20, eta=3,
+           space=SEARCH_SPACE, workers=None, threads=None, validation_size=0.2, seed=42):
+    """
+    Successive halving search over the configurations of build.
+
+    Parameters:
+    - features, labels, patient_ids: The samples, as for cross_validation.cross_validate
+    - build: Module-level function(input_dim, **config) returning a compiled Keras model (e.g.
+      nn_parckinson_2.build_model); 'batch_size' of the config is used for training instead
+    - search_dir: Folder of the search (see above); an existing search with the same settings is resumed
+    - n_trials: Configurations drawn from space
+    - min_epochs, max_epochs, eta: Epochs of the first and last rung, and the factor between rungs
+      (and between the trials of consecutive rungs)
+    - workers: Trials trained at the same time (None for default_workers())
+    - threads: CPU threads of every worker (None to share the cores between the workers)
+    - validation_size: Share of the patients held out to compare the configurations
+
+    Returns:
+    - DataFrame of all finished rungs, best (lowest val_loss at the last rung) first
+    """
+    # rung_epochs would never reach max_epochs otherwise
+    if eta < 2:
+        raise ValueError(f"eta must be at least 2, got {eta}")
+    if not 1 <= min_epochs <= max_epochs:
+        raise ValueError(f"Expected 1 <= min_epochs <= max_epochs, got min_epochs={min_epochs}, max_epochs={max_epochs}")
+    settings = {'n_trials': n_trials, 'min_epochs': min_epochs, 'max_epochs': max_epochs, 'eta': eta,
+                'space': json.loads(json.dumps(space)), 'validation_size': validation_size, 'seed': seed,
+                'samples': int(len(labels))}
+    settings_path = os.path.join(search_dir, SEARCH_FILE)
+    if os.path.exists(settings_path):
+        with open(settings_path, encoding='utf-8') as f:
+            if json.load(f) != settings:
+                raise ValueError(f"{search_dir} holds a search with other settings; use a new folder")
+    else:
+        os.makedirs(search_dir, exist_ok=True)
+        write_search_data(os.path.join(search_dir, 'data'), features, labels, patient_ids, validation_size, seed)
+        with open(settings_path, 'w', encoding='utf-8') as f:
+            json.dump(settings, f, indent=1)
+
+    configs = sample_configs(n_trials, space, seed)
+    epochs = rung_epochs(min_epochs, max_epochs, eta)
+    finished = load_finished(search_dir)
+    workers = default_workers() if workers is None else workers
+    survivors = list(range(n_trials))
+    print(f"Successive halving: {n_trials} trials, rungs of {epochs} epochs, "
+          f"{total_epochs(n_trials, min_epochs, max_epochs, eta)} epochs in total "
+          f"instead of {n_trials * max_epochs}")
+    for rung, rung_total in enumerate(epochs):
+        for trial in survivors:
+            os.makedirs(os.path.join(search_dir, 'trials', trial_name(trial)), exist_ok=True)
+        initial_epoch = epochs[rung - 1] if rung > 0 else 0
+        tasks = [(trial, build, configs[trial], search_dir, rung, rung_total, initial_epoch,
+                  threads or max(1, (os.cpu_count() or 1) // min(workers, len(survivors))), seed)
+                 for trial in survivors if (trial, rung) not in finished]
+        print(f"Rung {rung}: {len(survivors)} trials to {rung_total} epochs "
+              f"({len(survivors) - len(tasks)} finished before)")
+        if tasks:
+            results = run_parallel(run_trial, tasks, workers, label=f'search rung {rung}', start_method='spawn')
+            report_failures(results, label=f'search rung {rung}')
+            finished.update({(result.value['trial'], rung): result.value for result in results if result.ok})
+
+        # The best 1/eta of the trials that finished the rung go on to the next one
+        ranked = sorted((trial for trial in survivors if (trial, rung) in finished),
+                        key=lambda trial: finished[(trial, rung)]['val_loss'])
+        if rung + 1 < len(epochs):
+            survivors = ranked[:max(1, len(ranked) // eta)]
+
+    rows = [dict(trial=result['trial'], rung=result['rung'], epochs=result['epochs'], val_loss=result['val_loss'],
+                 val_accuracy=result['val_accuracy'], **{name: str(value) if isinstance(value, list) else value
+                                                         for name, value in result['config'].items()})
+            for result in finished.values()]
+    results = pd.DataFrame(rows)
+    if not results.empty:
+        results = results.sort_values(['rung', 'val_loss'], ascending=[False, True], ignore_index=True)
+        results.to_csv(os.path.join(search_dir, RESULTS_FILE), index=False)
+        best = results.iloc[0]
+        print(f"Best: trial {best['trial']} after {best['epochs']} epochs, val_loss {best['val_loss']:.4f}, "
+              f"val_accuracy {best['val_accuracy']:.4f}: {configs[int(best['trial'])]}")
+    return results
+
+
+def best_config(search_dir):
+    """ The configuration of the best trial of a finished search (from results.csv and its rung file). """
+    results = pd.read_csv(os.path.join(search_dir, RESULTS_FILE))
+    best = results.iloc[0]
+    with open(os.path.join(search_dir, 'trials', trial_name(int(best['trial'])), f"rung{int(best['rung'])}.json"),
+              encoding='utf-8') as f:
+        return json.load(f)['config']
+
+
+def total_epochs(n_trials, min_epochs, max_epochs, eta):
+    """ Epochs the search trains in total, to compare with n_trials * max_epochs of a full random search. """
+    total = 0
+    trials = n_trials
+    previous = 0
+    for epochs in rung_epochs(min_epochs, max_epochs, eta):
+        total += trials * (epochs - previous)
+        previous = epochs
+        trials = max(1, trials // eta)
+    return total
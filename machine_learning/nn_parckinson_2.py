@@ -4,9 +4,14 @@ import tensorflow as tf
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, Dropout
+from tensorflow.keras.layers import Conv1D, Dense, Dropout, GlobalAveragePooling1D, Input, MaxPooling1D
 from tensorflow.keras.utils import to_categorical
 import os
+from cross_validation import cross_validate
+from hyperparameter_search import search
+from numpy_inference import export_model
+from streaming_dataset import ensure_shards, make_dataset, scaling_stats, split_shards
+from window_dataset import STRIDE, WINDOW, build_window_dataset, parse_file_name
 
 
 def get_csv_files(directory):
@@ -30,22 +35,30 @@ def extract_patient_state(file_path):
     return None, None
 
 
+def prepare_file(file_path):
+    """ Loads one CSV file with its label, keeping the rows with confidence > 0.7. None for unknown files. """
+    patient_state, label = extract_patient_state(file_path)
+    if patient_state is None:
+        print(f"⚠️ Skipping file (unknown patient state): {file_path}")
+        return None
+    df = pd.read_csv(file_path)
+    df['pupil_timestamp'] = df['pupil_timestamp'] - df['pupil_timestamp'].iloc[0]
+    df['label'] = label
+    df = df[df['confidence'] > 0.7]  # Filter by confidence
+    df = df.dropna()
+    return df
+
+
 def load_and_process_data(file_paths):
     """ Loads CSV files, concatenates them, and prepares features (X) and labels (y). """
     data = []
     labels = []
     for file_path in file_paths:
-        patient_state, label = extract_patient_state(file_path)
-        if patient_state is None:
-            print(f"⚠️ Skipping file (unknown patient state): {file_path}")
+        df = prepare_file(file_path)
+        if df is None:
             continue
-        df = pd.read_csv(file_path)
-        df['pupil_timestamp'] = df['pupil_timestamp'] - df['pupil_timestamp'].iloc[0]
-        df['label'] = label
-        df = df[df['confidence'] > 0.7]  # Filter by confidence
-        df = df.dropna()
         data.append(df)
-        labels.append(label)
+        labels.append(df['label'].iloc[0] if len(df) else None)
 
     if not data:
         print("⚠️ No valid CSV files found.")
@@ -58,25 +71,176 @@ def load_and_process_data(file_paths):
     return X_scaled, y
 
 
-def build_model(input_dim):
-    """Builds a neural network model for classification."""
+def load_patient_data(file_paths):
+    """ Like load_and_process_data, but unscaled, with integer labels and the patient of every sample (for cross_validation). """
+    features, labels, patient_ids = [], [], []
+    for file_path in file_paths:
+        parsed = parse_file_name(file_path)
+        df = prepare_file(file_path)
+        if df is None or parsed is None or df.empty:
+            continue
+        features.append(df.drop(columns=['label', 'patient_state'], errors='ignore').to_numpy(dtype=np.float32))
+        labels.append(df['label'].to_numpy(dtype=np.int64))
+        patient_ids.append(np.full(len(df), parsed[1], dtype=object))
+
+    if not features:
+        print("⚠️ No valid CSV files found.")
+        return None, None, None
+    return np.concatenate(features), np.concatenate(labels), np.concatenate(patient_ids)
+
+
+def build_model(input_dim, units=(128, 64, 32), dropout=0.2, optimizer='adam', learning_rate=0.001):
+    """
+    Builds a neural network model for classification.
+
+    Parameters:
+    - input_dim: Number of features
+    - units: Units of the hidden layers; all but the last are followed by dropout
+    - dropout: Dropout rate
+    - optimizer: Name of a Keras optimizer ('adam', 'rmsprop', 'sgd', ...)
+    - learning_rate: Learning rate of the optimizer
+    """
+    layers = [Input(shape=(input_dim,))]
+    for i, layer_units in enumerate(units):
+        layers.append(Dense(layer_units, activation='relu'))
+        if i < len(units) - 1 and dropout > 0:
+            layers.append(Dropout(dropout))
+    layers.append(Dense(3, activation='softmax'))
+    model = Sequential(layers)
+    model.compile(optimizer=tf.keras.optimizers.get({'class_name': optimizer, 'config': {'learning_rate': learning_rate}}),
+                  loss='categorical_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def build_window_model(window, channels):
+    """Builds a 1D convolutional network classifying windows of the pupil signal."""
     model = Sequential([
-        Dense(128, input_dim=input_dim, activation='relu'),
-        Dropout(0.2),
-        Dense(64, activation='relu'),
-        Dropout(0.2),
+        Input(shape=(window, channels)),
+        Conv1D(32, 7, activation='relu'),
+        MaxPooling1D(4),
+        Conv1D(64, 5, activation='relu'),
+        MaxPooling1D(4),
+        Conv1D(64, 5, activation='relu'),
+        GlobalAveragePooling1D(),
         Dense(32, activation='relu'),
+        Dropout(0.2),
         Dense(3, activation='softmax')
     ])
     model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
     return model
 
 
+def train_windows(file_paths, window=WINDOW, stride=STRIDE, epochs=20, batch_size=32):
+    """
+    Trains and evaluates the window model (see window_dataset): every example is a window of a
+    recording's pupil diameter. The patients are split between training and test, and the
+    windows are scaled with the statistics of the training recordings.
+    """
+    dataset = build_window_dataset(file_paths, window, stride)
+    if len(dataset) == 0:
+        print("⚠️ No valid CSV files found.")
+        return None
+    train_indices, test_indices = dataset.split_by_patient(test_size=0.2, seed=42)
+    mean, std = dataset.channel_stats(train_indices)
+    print(f"{len(dataset)} windows of {len(dataset.recordings)} recordings: "
+          f"{len(train_indices)} for training, {len(test_indices)} for test")
+
+    train_data = dataset.to_tf_dataset(train_indices, batch_size, seed=42, mean=mean, std=std)
+    test_data = dataset.to_tf_dataset(test_indices, batch_size, shuffle=False, mean=mean, std=std)
+
+    model = build_window_model(window, dataset.channels)
+    model.fit(train_data, epochs=epochs, validation_data=test_data)
+    loss, accuracy = model.evaluate(test_data)
+    print(f"Test Loss: {loss}")
+    print(f"Test Accuracy: {accuracy}")
+    return model
+
+
+def train_streaming(file_paths, shard_dir, epochs=20, batch_size=32, shuffle_buffer=100_000, model_path=None):
+    """
+    Trains and evaluates the model from Parquet shards of the files (see streaming_dataset), so
+    the data is read from disk batch by batch instead of being loaded whole. The shards are
+    written on the first run and again only when the files change; the features are scaled
+    with the statistics of the training shards. With model_path the trained model and its scaling
+    are exported there for numpy_inference.
+    """
+    manifest = ensure_shards(file_paths, shard_dir, prepare_file)
+    if not manifest['shards']:
+        print("⚠️ No valid CSV files found.")
+        return None
+    feature_columns = manifest['feature_columns']
+    train_shards, test_shards = split_shards(manifest['shards'], test_size=0.2, seed=42)
+    mean, std = scaling_stats(train_shards, feature_columns)
+
+    train_data = make_dataset(shard_dir, train_shards, feature_columns, mean, std, batch_size,
+                              shuffle_buffer=shuffle_buffer, seed=42)
+    test_data = make_dataset(shard_dir, test_shards, feature_columns, mean, std, batch_size, shuffle=False)
+
+    model = build_model(len(feature_columns))
+    model.fit(train_data, epochs=epochs, validation_data=test_data)
+    loss, accuracy = model.evaluate(test_data)
+    print(f"Test Loss: {loss}")
+    print(f"Test Accuracy: {accuracy}")
+    if model_path:
+        export_model(model, mean, std, feature_columns, model_path)
+    return model
+
+
+def evaluate_cross_validation(file_paths, method='stratified', n_splits=5, epochs=20, batch_size=32, workers=None,
+                              output_dir=None):
+    """
+    Evaluates build_model with patient-grouped cross-validation (see cross_validation), the folds
+    trained in parallel. Returns the fold results and their summary.
+    """
+    X, labels, patient_ids = load_patient_data(file_paths)
+    if X is None:
+        return None
+    return cross_validate(X, labels, patient_ids, build_model, method, n_splits, epochs, batch_size, workers,
+                          output_dir=output_dir)
+
+
+def search_hyperparameters(file_paths, search_dir, n_trials=27, min_epochs=2, max_epochs=20, workers=None):
+    """
+    Searches the units, dropout, optimizer, learning rate and batch size of build_model by
+    successive halving (see hyperparameter_search). Run it again with the same search_dir to
+    resume an interrupted search. Returns the results of all trials, best first.
+    """
+    X, labels, patient_ids = load_patient_data(file_paths)
+    if X is None:
+        return None
+    return search(X, labels, patient_ids, build_model, search_dir, n_trials, min_epochs, max_epochs, workers=workers)
+
+
 def main():
     data_path = r"/home/dsi/oronsha/preprocessing"
+    # Stream the data from Parquet shards instead of loading it all into memory
+    streaming = True
+    shard_dir = r"/home/dsi/oronsha/preprocessing_shards"
+    # The trained model, for scoring new sessions with numpy_inference.py
+    model_path = r"/home/dsi/oronsha/parkinson_model.npz"
+    # Train the window model on windows of the pupil signal instead of single samples
+    windows = False
+    # Evaluate with patient-grouped cross-validation ('stratified', 'group' or 'leave_one_patient_out')
+    # instead of training one model on a single split
+    cross_validation_method = None
+    # Search the hyperparameters of build_model instead (resumed from search_dir if interrupted)
+    hyperparameter_search = False
+    search_dir = r"/home/dsi/oronsha/hyperparameter_search"
     file_paths = get_csv_files(data_path)
     if not file_paths:
         return
+    if cross_validation_method:
+        evaluate_cross_validation(file_paths, cross_validation_method)
+        return
+    if hyperparameter_search:
+        search_hyperparameters(file_paths, search_dir)
+        return
+    if windows:
+        train_windows(file_paths)
+        return
+    if streaming:
+        train_streaming(file_paths, shard_dir, model_path=model_path)
+        return
     X, y = load_and_process_data(file_paths)
     if X is None or y is None:
         return
@@ -0,0 +1,202 @@
+import argparse
+import os
+import time
+import numpy as np
+from session_store import read_session
+
+# Scoring of new recordings with a trained dense classifier without TensorFlow.
+# export_model writes the Dense layers of a trained Keras model (kernels, biases, activations)
+# together with the StandardScaler mean/std and the feature columns it was trained on into one
+# .npz file. load_model reads it back into a DenseClassifier, which runs the network with NumPy
+# matrix products on batches of samples. Starting up takes a fraction of a second (NumPy and
+# pandas only), so single sessions can be scored from the command line:
+#   python numpy_inference.py model.npz <pupil_positions.csv or folder> [...] [--output scores.csv]
+# A session is prepared as for training (nn_parckinson_2.prepare_file: pupil_timestamp from the
+# start of the recording, samples with confidence > 0.7, no missing values) and its class
+# probabilities are the mean of the probabilities of its samples.
+FORMAT_VERSION = 1
+CLASS_NAMES = ['EC', 'PD_OFF', 'PD_ON']
+MIN_CONFIDENCE = 0.7
+BATCH_SIZE = 65_536
+SESSION_FILE_SUFFIX = 'pupil_positions.csv'
+
+
+def softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+
+# The Keras activations the exported layers may use
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'tanh': np.tanh,
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'softmax': softmax,
+}
+
+
+def export_model(model, mean, std, feature_columns, path, class_names=CLASS_NAMES):
+    """
+    Saves a trained Keras model of Dense (and Dropout) layers with its scaling as a .npz file.
+
+    Parameters:
+    - model: The trained model (e.g. from nn_parckinson_2.train_streaming)
+    - mean, std: The scaling of the features the model was trained with
+    - feature_columns: Names of the features, in the order of mean and std
+    - path: Output .npz file
+    - class_names: Name of every output class
+    """
+    arrays = {}
+    activations = []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in ('Dropout', 'InputLayer'):
+            continue
+        if kind != 'Dense':
+            raise ValueError(f"Cannot export layer {layer.name} ({kind}): only Dense layers are supported")
+        activation = layer.get_config()['activation']
+        if activation not in ACTIVATIONS:
+            raise ValueError(f"Cannot export layer {layer.name}: unsupported activation {activation}")
+        kernel, bias = layer.get_weights()
+        arrays[f"kernel_{len(activations)}"] = kernel.astype(np.float32)
+        arrays[f"bias_{len(activations)}"] = bias.astype(np.float32)
+        activations.append(activation)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.savez_compressed(path, format_version=np.int64(FORMAT_VERSION), activations=np.array(activations),
+                        mean=np.asarray(mean, dtype=np.float32), std=np.asarray(std, dtype=np.float32),
+                        feature_columns=np.array(feature_columns), class_names=np.array(class_names), **arrays)
+    print(f"Model exported to {path} ({os.path.getsize(path)} bytes)")
+    return path
+
+
+class DenseClassifier:
+    """
+    A dense network evaluated with NumPy.
+
+    Parameters:
+    - kernels, biases, activations: One entry per layer
+    - mean, std: Scaling of the inputs
+    - feature_columns, class_names: Names of the inputs and outputs
+    """
+
+    def __init__(self, kernels, biases, activations, mean, std, feature_columns, class_names):
+        self.kernels = kernels
+        self.biases = biases
+        self.activations = activations
+        self.mean = mean
+        self.std = np.where(std > 0, std, 1).astype(np.float32)
+        self.feature_columns = feature_columns
+        self.class_names = class_names
+
+    def predict_proba(self, features, batch_size=BATCH_SIZE):
+        """ Class probabilities (samples, classes) of unscaled features, batch_size samples at a time. """
+        features = np.asarray(features, dtype=np.float32)
+        probabilities = np.empty((len(features), len(self.class_names)), dtype=np.float32)
+        for start in range(0, len(features), batch_size):
+            x = (features[start:start + batch_size] - self.mean) / self.std
+            for kernel, bias, activation in zip(self.kernels, self.biases, self.activations):
+                x = x @ kernel
+                x += bias
+                x = ACTIVATIONS[activation](x)
+            probabilities[start:start + batch_size] = x
+        return probabilities
+
+
+def load_model(path):
+    """ The DenseClassifier saved by export_model. """
+    with np.load(path) as data:
+        if int(data['format_version']) != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {int(data['format_version'])}, expected {FORMAT_VERSION}")
+        activations = [str(activation) for activation in data['activations']]
+        return DenseClassifier([data[f"kernel_{i}"] for i in range(len(activations))],
+                               [data[f"bias_{i}"] for i in range(len(activations))],
+                               activations, data['mean'], data['std'],
+                               [str(column) for column in data['feature_columns']],
+                               [str(name) for name in data['class_names']])
+
+
+def session_features(file_path, feature_columns, min_confidence=MIN_CONFIDENCE):
+    """ The feature matrix of one pupil_positions.csv, prepared as nn_parckinson_2.prepare_file does. """
+    df = read_session(file_path, columns=list(dict.fromkeys(list(feature_columns) + ['confidence', 'pupil_timestamp'])))
+    missing = [column for column in feature_columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"{file_path} is missing the columns {missing}")
+    if len(df):
+        df['pupil_timestamp'] = df['pupil_timestamp'] - df['pupil_timestamp'].iloc[0]
+    df = df[df['confidence'] > min_confidence]
+    return df[list(feature_columns)].dropna().to_numpy(dtype=np.float32)
+
+
+def score_session(model, file_path, batch_size=BATCH_SIZE):
+    """
+    Class probabilities of one session.
+
+    Returns:
+    - Dictionary with the file, its number of samples, the mean probability of every class and
+      the predicted class (None when no sample is left after filtering)
+    """
+    features = session_features(file_path, model.feature_columns)
+    result = {'file': file_path, 'samples': len(features)}
+    if len(features) == 0:
+        result.update({name: np.nan for name in model.class_names}, predicted=None)
+        return result
+    probabilities = model.predict_proba(features, batch_size).mean(axis=0)
+    result.update(zip(model.class_names, probabilities.tolist()))
+    result['predicted'] = model.class_names[int(np.argmax(probabilities))]
+    return result
+
+
+def find_sessions(paths):
+    """ The pupil_positions.csv files (also the preprocessed *_pupil_positions.csv) of files and folders. """
+    sessions = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                sessions.extend(os.path.join(root, file) for file in sorted(files) if file.endswith(SESSION_FILE_SUFFIX))
+        else:
+            sessions.append(path)
+    return sessions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scores pupil_positions.csv sessions with an exported model.")
+    parser.add_argument('model', help=".npz file written by export_model")
+    parser.add_argument('paths', nargs='+', help="pupil_positions.csv files or folders to search for them")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="samples per matrix product")
+    parser.add_argument('--output', help="CSV file for the scores")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    model = load_model(args.model)
+    sessions = find_sessions(args.paths)
+    print(f"Loaded {args.model} in {time.perf_counter() - start:.3f} s; {len(sessions)} sessions to score")
+
+    results = []
+    start = time.perf_counter()
+    for file_path in sessions:
+        try:
+            result = score_session(model, file_path, args.batch_size)
+        except Exception as error:
+            print(f"⚠️ {file_path}: {error}")
+            continue
+        results.append(result)
+        probabilities = ", ".join(f"{name} {result[name]:.3f}" for name in model.class_names)
+        print(f"{file_path}: {result['predicted']} ({probabilities}; {result['samples']} samples)")
+    elapsed = time.perf_counter() - start
+
+    samples = sum(result['samples'] for result in results)
+    print(f"Scored {len(results)} sessions, {samples} samples in {elapsed:.3f} s "
+          f"({len(results) / elapsed if elapsed else 0:.1f} sessions/s, {samples / elapsed if elapsed else 0:,.0f} samples/s)")
+    if args.output:
+        import pandas as pd
+        pd.DataFrame(results, columns=['file', 'samples'] + model.class_names + ['predicted']).to_csv(args.output, index=False)
+        print(f"Scores saved to {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
 import os
-import pandas as pd
+from parallel import report_failures, run_parallel
+from session_catalog import get_catalog
+from session_store import read_session
+
+SAVE_DIR = r"D:\preprocessing"
 
 
 def filter_file_path(file_path, group_identifier):
@@ -25,18 +29,16 @@ def filter_file_path(file_path, group_identifier):
     return -1
 
 
-def save_filtered_file(file_path, patient_id, group, filter_option):
-    """Loads the CSV, filters columns, and saves the new file in D:\preprocessing."""
+def save_filtered_file(file_path, patient_id, group, filter_option, save_dir=SAVE_DIR):
+    """Loads the CSV, filters columns, and saves the new file in save_dir (D:\preprocessing)."""
     # Construct the new filename with filter option
     new_filename = f"{group}_{patient_id}_filter{filter_option}_pupil_positions.csv"
-    save_dir = r"D:\preprocessing"
+    os.makedirs(save_dir, exist_ok=True)
     if new_filename not in os.listdir(save_dir):
-        os.makedirs(save_dir, exist_ok=True)
 
         # Load data and filter only necessary columns
-        df = pd.read_csv(file_path, low_memory=False)
         required_columns = ["norm_pos_x", "norm_pos_y", "confidence", "pupil_timestamp", "diameter"]
-        df_filtered = df[required_columns]
+        df_filtered = read_session(file_path, columns=required_columns)[required_columns]
 
 
         save_path = os.path.join(save_dir, new_filename)
@@ -44,15 +46,19 @@ def save_filtered_file(file_path, patient_id, group, filter_option):
         # Save the filtered file
         df_filtered.to_csv(save_path, index=False)
         print(f"Saved: {save_path}")
+        return save_path
 
 
-def process_patient_data(folders, group_name):
-    """Finds pupil_positions.csv files, extracts patient IDs, and saves filtered copies."""
+def process_patient_data(folders, group_name, workers=None, save_dir=SAVE_DIR):
+    """Finds pupil_positions.csv files, extracts patient IDs, and saves filtered copies (in parallel)."""
     group_identifier = 'ON' if group_name == 'PD_ON' else 'OFF' if group_name == 'PD_OFF' else 'EC'
     folder_list = folders if isinstance(folders, list) else [folders]
+    # Output file name -> arguments of save_filtered_file; the first session found for a name is
+    # the one saved, as when the files were saved one by one
+    tasks = {}
 
     for folder in folder_list:
-        for root, dirs, files in os.walk(folder):
+        for root, dirs, files in get_catalog().walk(folder):
             for file in files:
                 if file == 'pupil_positions.csv':
                     file_path = os.path.join(root, file)
@@ -69,7 +75,12 @@ def process_patient_data(folders, group_name):
 
                     patient_id = parts[ec_index + 1] if ec_index != -1 and ec_index + 1 < len(parts) else None
                     if patient_id:
-                        save_filtered_file(file_path, patient_id, group_name, filter_option)
+                        new_filename = f"{group_name}_{patient_id}_filter{filter_option}_pupil_positions.csv"
+                        tasks.setdefault(new_filename, (file_path, patient_id, group_name, filter_option, save_dir))
+
+    results = run_parallel(save_filtered_file, list(tasks.values()), workers, label=group_name)
+    report_failures(results, label=group_name)
+    return results
 
 
 def main():
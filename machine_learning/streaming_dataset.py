@@ -0,0 +1,206 @@
+import json
+import os
+import numpy as np
+from running_stats import RunningStats
+
+# Streaming input for the Parkinson classifiers, so the training data does not have to fit in memory.
+# 1. write_shards converts the preprocessed CSV files (D:\preprocessing) one at a time into Parquet
+#    shards of at most ROWS_PER_SHARD rows, holding the float32 features and the label. The
+#    manifest (shards.json) lists the shards with their source file, rows, label and the running
+#    statistics (see running_stats.RunningStats) of every feature column.
+# 2. scaling_stats merges the statistics of the training shards into the mean and standard
+#    deviation of StandardScaler, without reading the data again.
+# 3. make_dataset streams the shards through tf.data: the shards are read batch by batch,
+#    interleaved, shuffled in a buffer of a bounded number of rows, batched, scaled and prefetched
+#    while the model trains on the previous batches.
+SHARD_PREFIX = 'shard_'
+SHARD_SUFFIX = '.parquet'
+MANIFEST_FILE = 'shards.json'
+LABEL_COLUMN = 'label'
+NUM_CLASSES = 3
+ROWS_PER_SHARD = 1_000_000
+# Rows read from a shard at a time
+READ_ROWS = 65_536
+
+
+def source_key(file_path):
+    """ Size and mtime of a source file, which its shards have to match to be reused. """
+    stat = os.stat(file_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def load_manifest(shard_dir):
+    """ The manifest of a shard folder, or None if there is none. """
+    manifest_path = os.path.join(shard_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_shards(file_paths, shard_dir, prepare, rows_per_shard=ROWS_PER_SHARD):
+    """
+    Converts the files into Parquet shards, reading one file at a time.
+
+    Parameters:
+    - file_paths: The preprocessed CSV files
+    - shard_dir: Output folder; shards written before are replaced
+    - prepare: Function(file_path) returning the DataFrame of one file with the feature columns and
+      LABEL_COLUMN, or None to leave the file out (e.g. nn_parckinson_2.prepare_file)
+    - rows_per_shard: Upper bound on the rows of a shard
+
+    Returns:
+    - The manifest, also saved as shards.json in shard_dir
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(shard_dir, exist_ok=True)
+    for file in os.listdir(shard_dir):
+        if file.startswith(SHARD_PREFIX) and file.endswith(SHARD_SUFFIX):
+            os.remove(os.path.join(shard_dir, file))
+
+    feature_columns = None
+    shards = []
+    sources = {}
+    for file_path in file_paths:
+        df = prepare(file_path)
+        sources[file_path] = source_key(file_path)
+        if df is None or df.empty:
+            continue
+        if feature_columns is None:
+            feature_columns = [column for column in df.columns if column != LABEL_COLUMN]
+        missing = [column for column in feature_columns + [LABEL_COLUMN] if column not in df.columns]
+        if missing:
+            raise ValueError(f"{file_path} is missing the columns {missing}")
+
+        for start in range(0, len(df), rows_per_shard):
+            part = df.iloc[start:start + rows_per_shard]
+            file_name = f"{SHARD_PREFIX}{len(shards):05d}{SHARD_SUFFIX}"
+            arrays = [pa.array(part[column].to_numpy(dtype=np.float32)) for column in feature_columns]
+            arrays.append(pa.array(part[LABEL_COLUMN].to_numpy(dtype=np.int64)))
+            pq.write_table(pa.Table.from_arrays(arrays, names=feature_columns + [LABEL_COLUMN]),
+                           os.path.join(shard_dir, file_name), row_group_size=READ_ROWS)
+            labels = np.unique(part[LABEL_COLUMN].to_numpy(dtype=np.int64))
+            shards.append({
+                'file': file_name,
+                'source': file_path,
+                'rows': len(part),
+                'labels': labels.tolist(),
+                'stats': {column: RunningStats.from_values(part[column]).to_dict() for column in feature_columns},
+            })
+        print(f"Sharded: {file_path} ({len(df)} rows)")
+
+    manifest = {'feature_columns': feature_columns or [], 'label_column': LABEL_COLUMN, 'num_classes': NUM_CLASSES,
+                'sources': sources, 'shards': shards}
+    manifest_path = os.path.join(shard_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def ensure_shards(file_paths, shard_dir, prepare, rows_per_shard=ROWS_PER_SHARD):
+    """ The manifest of shard_dir, writing the shards again only if the source files changed. """
+    manifest = load_manifest(shard_dir)
+    if manifest is not None:
+        try:
+            current = {file_path: source_key(file_path) for file_path in file_paths}
+        except OSError:
+            current = None
+        if current == manifest['sources']:
+            return manifest
+    return write_shards(file_paths, shard_dir, prepare, rows_per_shard)
+
+
+def split_shards(shards, test_size=0.2, seed=42):
+    """
+    Splits the shards into (train, test) at random, test_size being the fraction of rows in test.
+    At least one shard is left for training.
+    """
+    order = np.random.default_rng(seed).permutation(len(shards))
+    total = sum(shard['rows'] for shard in shards)
+    train, test = [], []
+    test_rows = 0
+    for index in order:
+        if test_rows < test_size * total and len(test) < len(shards) - 1:
+            test.append(shards[index])
+            test_rows += shards[index]['rows']
+        else:
+            train.append(shards[index])
+    return train, test
+
+
+def scaling_stats(shards, feature_columns):
+    """
+    Mean and standard deviation (ddof=0, as StandardScaler) of every feature column over the
+    shards, from their saved statistics. A column that does not vary gets a deviation of 1.
+    """
+    mean = np.zeros(len(feature_columns), dtype=np.float32)
+    std = np.ones(len(feature_columns), dtype=np.float32)
+    for i, column in enumerate(feature_columns):
+        stats = RunningStats()
+        for shard in shards:
+            stats.merge(RunningStats.from_dict(shard['stats'][column]))
+        if stats.count:
+            mean[i] = stats.mean
+            deviation = stats.std(ddof=0)
+            std[i] = deviation if deviation > 0 else 1.0
+    return mean, std
+
+
+def iter_shard(path, columns, read_rows=READ_ROWS):
+    """ Yields (features, labels) of a shard, read_rows rows at a time. """
+    import pyarrow.parquet as pq
+    label_column = columns[-1]
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=read_rows, columns=columns):
+        features = np.column_stack([batch.column(column).to_numpy() for column in columns[:-1]])
+        yield features.astype(np.float32, copy=False), batch.column(label_column).to_numpy()
+
+
+def make_dataset(shard_dir, shards, feature_columns, mean, std, batch_size=32, shuffle=True,
+                 shuffle_buffer=100_000, seed=None, cycle_length=4):
+    """
+    tf.data pipeline over shards.
+
+    Parameters:
+    - shard_dir: Folder of the shards
+    - shards: Manifest entries of the shards to read (e.g. one side of split_shards)
+    - feature_columns: The manifest's feature columns
+    - mean, std: Scaling of the features (see scaling_stats)
+    - batch_size: Rows per batch
+    - shuffle: Shuffle the shard order and the rows; False reads them in order, e.g. for evaluation
+    - shuffle_buffer: Rows held by the shuffle buffer, which bounds the memory of the shuffle
+    - seed: Seed of the shuffles
+    - cycle_length: Shards read at the same time
+
+    Returns:
+    - tf.data.Dataset of (scaled features, one-hot labels) batches
+    """
+    import tensorflow as tf
+
+    paths = [os.path.join(shard_dir, shard['file']) for shard in shards]
+    columns = list(feature_columns) + [LABEL_COLUMN]
+    signature = (tf.TensorSpec(shape=(None, len(feature_columns)), dtype=tf.float32),
+                 tf.TensorSpec(shape=(None,), dtype=tf.int64))
+
+    def read(path):
+        return iter_shard(path.decode() if isinstance(path, bytes) else path, columns)
+
+    files = tf.data.Dataset.from_tensor_slices(paths)
+    if shuffle:
+        files = files.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    dataset = files.interleave(
+        lambda path: tf.data.Dataset.from_generator(read, args=(path,), output_signature=signature),
+        cycle_length=cycle_length, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    # Rows are shuffled one by one, then batched and scaled a batch at a time
+    dataset = dataset.unbatch()
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    mean = tf.constant(mean, dtype=tf.float32)
+    std = tf.constant(std, dtype=tf.float32)
+    dataset = dataset.batch(batch_size).map(
+        lambda features, labels: ((features - mean) / std, tf.one_hot(labels, NUM_CLASSES)),
+        num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,183 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Fixed-length windows of the pupil signal of every recording, as training examples for sequence
+# models (instead of one example per sample).
+# The signals of all recordings are kept in one contiguous float32 array; a window is only its
+# start offset into that array, so overlapping windows cost no memory. The values of a window are
+# read through a strided view of the array (numpy's sliding_window_view), and copied only when a
+# batch is built. Windows never cross from one recording into the next.
+# Every window carries its recording's patient ID, group (EC, PD_OFF, PD_ON), label and filter
+# option, read from the names the ML preprocessing gives the files:
+#   EC_<patient_id>_filter<option>_pupil_positions.csv, PD_OFF_..., PD_ON_...
+FILE_NAME_PATTERN = re.compile(r'^(EC|PD_OFF|PD_ON)_(.+)_filter(\d+)_pupil_positions\.csv$')
+GROUP_LABELS = {'EC': 0, 'PD_OFF': 1, 'PD_ON': 2}
+NUM_CLASSES = 3
+# 5 s of both eyes' samples at 120 Hz, half overlapping
+WINDOW = 1200
+STRIDE = 600
+
+
+def parse_file_name(file_path):
+    """ (group, patient_id, filter_option) of a preprocessed file, or None if the name does not match. """
+    match = FILE_NAME_PATTERN.match(os.path.basename(file_path))
+    if match is None:
+        return None
+    return match.group(1), match.group(2), int(match.group(3))
+
+
+def load_signal(file_path, columns=('diameter',), min_confidence=0.7):
+    """ The columns of one preprocessed file as a float32 (samples, channels) array, keeping the samples with confidence > min_confidence. """
+    df = pd.read_csv(file_path, usecols=lambda column: column in set(columns) | {'confidence'})
+    if 'confidence' in df.columns:
+        df = df[df['confidence'] > min_confidence]
+    return df[list(columns)].dropna().to_numpy(dtype=np.float32)
+
+
+class WindowDataset:
+    """
+    Windows over the recordings of a cohort.
+
+    Parameters:
+    - values: float32 array (samples, channels) with the recordings one after the other
+    - recordings: List of dicts, one per recording, with its 'offset' and 'length' in values and its
+      metadata ('file', 'patient_id', 'group', 'label', 'filter_option')
+    - window, stride: Length of a window and step between the starts of consecutive windows
+    """
+
+    def __init__(self, values, recordings, window=WINDOW, stride=STRIDE):
+        self.values = values
+        self.recordings = recordings
+        self.window = window
+        self.stride = stride
+
+        starts = []
+        recording_index = []
+        for i, recording in enumerate(recordings):
+            count = max(0, (recording['length'] - window) // stride + 1)
+            starts.append(recording['offset'] + stride * np.arange(count, dtype=np.int64))
+            recording_index.append(np.full(count, i, dtype=np.int32))
+        self.starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+        self.recording_index = np.concatenate(recording_index) if recording_index else np.zeros(0, dtype=np.int32)
+        # (windows at every sample, channels, window): a view, no values are copied
+        self._view = sliding_window_view(values, window, axis=0) if len(values) >= window else None
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def channels(self):
+        return self.values.shape[1]
+
+    def metadata(self, field):
+        """ The value of a recording field ('patient_id', 'group', 'label', ...) for every window. """
+        return np.array([recording[field] for recording in self.recordings])[self.recording_index]
+
+    @property
+    def labels(self):
+        return self.metadata('label').astype(np.int64)
+
+    def recording_windows(self, i):
+        """ All windows of recording i as a (windows, window, channels) view of the values, without copying. """
+        recording = self.recordings[i]
+        count = max(0, (recording['length'] - self.window) // self.stride + 1)
+        if count == 0:
+            return np.zeros((0, self.window, self.channels), dtype=self.values.dtype)
+        first = recording['offset']
+        return self._view[first:first + self.stride * (count - 1) + 1:self.stride].transpose(0, 2, 1)
+
+    def windows(self, indices):
+        """ The values of the given windows as a new (len(indices), window, channels) array. """
+        return self._view[self.starts[indices]].transpose(0, 2, 1)
+
+    def split_by_patient(self, test_size=0.2, seed=42):
+        """
+        (train, test) window indices with every patient on one side only, so overlapping windows
+        of a patient never end up on both. test_size is the fraction of patients in test.
+        """
+        patients = np.array(sorted({recording['patient_id'] for recording in self.recordings}))
+        rng = np.random.default_rng(seed)
+        test_count = min(len(patients) - 1, max(1, int(round(test_size * len(patients))))) if len(patients) > 1 else 0
+        test_patients = set(rng.permutation(patients)[:test_count])
+        in_test = np.isin(self.metadata('patient_id'), list(test_patients))
+        return np.flatnonzero(~in_test), np.flatnonzero(in_test)
+
+    def channel_stats(self, indices):
+        """ Mean and standard deviation of every channel over the recordings the windows come from. """
+        recordings = np.unique(self.recording_index[indices])
+        if len(recordings) == 0:
+            return np.zeros(self.channels, np.float32), np.ones(self.channels, np.float32)
+        values = np.concatenate([self.values[self.recordings[i]['offset']:self.recordings[i]['offset'] + self.recordings[i]['length']]
+                                 for i in recordings])
+        std = values.std(axis=0)
+        return values.mean(axis=0).astype(np.float32), np.where(std > 0, std, 1).astype(np.float32)
+
+    def batches(self, indices, batch_size=32, shuffle=True, seed=None, mean=None, std=None):
+        """ Yields (windows, labels) batches of the given windows, scaled with mean and std if given. """
+        indices = np.asarray(indices)
+        if shuffle:
+            indices = np.random.default_rng(seed).permutation(indices)
+        labels = self.labels
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+            x = self.windows(batch)
+            if mean is not None:
+                x = (x - mean) / std
+            yield x.astype(np.float32, copy=False), labels[batch]
+
+    def to_tf_dataset(self, indices, batch_size=32, shuffle=True, seed=None, mean=None, std=None):
+        """ tf.data.Dataset of (windows, one-hot labels) batches, prefetched while the model trains. """
+        import tensorflow as tf
+
+        signature = (tf.TensorSpec(shape=(None, self.window, self.channels), dtype=tf.float32),
+                     tf.TensorSpec(shape=(None,), dtype=tf.int64))
+        epoch = [0]
+
+        def generate():
+            # A new order every epoch, reproducible from the seed
+            epoch[0] += 1
+            epoch_seed = None if seed is None else seed + epoch[0]
+            return self.batches(indices, batch_size, shuffle, epoch_seed, mean, std)
+
+        dataset = tf.data.Dataset.from_generator(generate, output_signature=signature)
+        dataset = dataset.map(lambda x, y: (x, tf.one_hot(y, NUM_CLASSES)))
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def build_window_dataset(file_paths, window=WINDOW, stride=STRIDE, columns=('diameter',), min_confidence=0.7):
+    """
+    Reads the preprocessed files into a WindowDataset.
+
+    Parameters:
+    - file_paths: Preprocessed CSV files (see FILE_NAME_PATTERN); other files are skipped
+    - window, stride: Samples per window and between window starts (stride < window overlaps)
+    - columns: Columns of the signal, one channel each
+    - min_confidence: Samples with a lower confidence are left out
+
+    Returns:
+    - WindowDataset
+    """
+    signals = []
+    recordings = []
+    offset = 0
+    for file_path in file_paths:
+        parsed = parse_file_name(file_path)
+        if parsed is None:
+            print(f"⚠️ Skipping file (unknown name): {file_path}")
+            continue
+        group, patient_id, filter_option = parsed
+        signal = load_signal(file_path, columns, min_confidence)
+        if len(signal) < window:
+            print(f"⚠️ Skipping file (shorter than one window): {file_path}")
+            continue
+        signals.append(signal)
+        recordings.append({'file': file_path, 'patient_id': patient_id, 'group': group,
+                           'label': GROUP_LABELS[group], 'filter_option': filter_option,
+                           'offset': offset, 'length': len(signal)})
+        offset += len(signal)
+
+    values = np.concatenate(signals) if signals else np.zeros((0, len(columns)), dtype=np.float32)
+    return WindowDataset(values, recordings, window, stride)
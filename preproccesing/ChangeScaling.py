@@ -1,9 +1,11 @@
 import os
-import pandas as pd
+from parallel import report_failures, run_parallel
+from session_catalog import get_catalog
+from session_store import read_session
 
 def changeScaling(filePath):
     # Read the CSV file
-    data = pd.read_csv(filePath)
+    data = read_session(filePath)
 
     # Scaling factors
     old_range = (1 - 0)
@@ -19,18 +21,23 @@ def changeScaling(filePath):
 
     # Save the modified data to a new CSV file
     data.to_csv(new_file_path, index=False)
+    return new_file_path
 
 
-def main():
+def main(workers=None):
     # Set the root directory
     root_dir = 'C:/Users/shach/master/Master/data'  # Update with the correct root directory
 
-    # Iterate over all files in the directory tree
-    for root, dirs, files in os.walk(root_dir):
+    # Find all files in the directory tree
+    tasks = []
+    for root, dirs, files in get_catalog().walk(root_dir):
         for file in files:
             if file.endswith("gaze_positions.csv"):
-                file_path = os.path.join(root, file)
-                changeScaling(file_path)
+                tasks.append((os.path.join(root, file),))
+
+    # Rescale them in parallel
+    results = run_parallel(changeScaling, tasks, workers, label='rescaling')
+    report_failures(results, label='rescaling')
 
 
 
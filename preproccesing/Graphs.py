@@ -2,9 +2,21 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sb
+from batch_rendering import axes_pixels, min_max_envelope, occupied_pixels, reusable_axes, use_headless_backend
+from parallel import report_failures, run_parallel
+from session_catalog import get_catalog
+from session_store import read_session
 
 
-def createGraphs(data, output_dir):
+def createGraphs(data, output_dir, batch=False):
+    """
+    Plots norm_pos_x and norm_pos_y with the confidence against the first column and saves the PNG.
+    With batch=True the figure of the process is reused and the dense series are reduced to what
+    the pixels can show (see batch_rendering) before they are drawn.
+    """
+    if batch:
+        return createGraphsBatch(data, output_dir)
+
     # Plotting the first column with "norm_pos_x" and confidence
     plt.figure(figsize=(10, 6))
     plt.subplot(2, 1, 1)
@@ -31,6 +43,37 @@ def createGraphs(data, output_dir):
     file_path = os.path.join(output_dir, file_name)
     plt.savefig(file_path)
     plt.close()  # Close the plot to free up resources
+    return file_path
+
+
+def createGraphsBatch(data, output_dir):
+    """ createGraphs on the reused figure, with the lines and markers reduced per pixel. """
+    fig, axes = reusable_axes(2, 1, figsize=(10, 6))
+    x = data.iloc[:, 0].to_numpy(dtype=float)
+    confidence = data['confidence'].to_numpy(dtype=float)
+
+    for ax, column in zip(axes, ['norm_pos_x', 'norm_pos_y']):
+        columns, rows = axes_pixels(ax, oversample=1)
+        values = data[column].to_numpy(dtype=float)
+        # The line and its markers are drawn separately: the line through the per-pixel min/max,
+        # the markers on the pixels that have samples; an empty line with both stands in the legend
+        line = ax.plot(*min_max_envelope(x, values, 2 * columns))[0]
+        ax.plot(*occupied_pixels(x, values, columns, rows), marker='o', linestyle='none', color=line.get_color())
+        ax.plot([], [], marker='o', color=line.get_color(), label=column)
+        ax.scatter(*occupied_pixels(x, confidence, columns, rows), color='red', label='confidence')
+        ax.set_title(f'First Column with {column} and Confidence')
+        ax.set_xlabel('First Column')
+        ax.set_ylabel(column)
+        # A fixed corner: searching for the 'best' one over every point takes longer than the drawing
+        ax.legend(loc='upper right')
+
+    fig.tight_layout()
+
+    # Save the plot as a PNG file with a unique name
+    file_name = f"graph_{data.iloc[0, 0]}.png"
+    file_path = os.path.join(output_dir, file_name)
+    fig.savefig(file_path)
+    return file_path
 
 
 def createHeatMap(data, output_dir):
@@ -54,38 +97,55 @@ def createHeatMap(data, output_dir):
     plt.close()
 
 
-def main():
+def graphSession(file_path, batch=True):
+    """ Draws the graphs of one gaze_positions_new.csv into graphs_cleaned next to it. Returns the PNG path. """
+    if batch:
+        use_headless_backend()
+    root = os.path.dirname(file_path)
+    data = read_session(file_path)
+    # Dropping the missing rows.
+    data_cleaned = data.dropna(how='any')
+
+    # Create a directory to save PNG files in the same directory as the data file
+    output_dir = os.path.join(root, 'graphs_cleaned')
+    os.makedirs(output_dir, exist_ok=True)
+
+    graph_path = createGraphs(data_cleaned, output_dir, batch)
+
+    # # For the second call to createGraphs, add a suffix to the directory name
+    # output_dir = os.path.join(root, 'graphs')
+    # os.makedirs(output_dir, exist_ok=True)
+    #
+    # createGraphs(data, output_dir)
+
+    # output_dir = os.path.join(root, 'heatmaps')
+    # os.makedirs(output_dir, exist_ok=True)
+    # createHeatMap(data, output_dir)
+
+    # output_dir = os.path.join(root, 'heatmaps_cleaned')
+    # os.makedirs(output_dir, exist_ok=True)
+    # createHeatMap(data_cleaned, output_dir)
+    return graph_path
+
+
+def main(batch=True, workers=None):
+    """
+    Draws the graphs of every gaze_positions_new.csv under the root directory.
+    batch=True renders headless on a pool of workers; batch=False draws one figure at a time
+    as before.
+    """
     # Set the root directory
     root_dir = 'C:/Users/shach/Documants/Master/data'  # Update with the correct root directory
 
     # Iterate over all files in the directory tree
-    for root, dirs, files in os.walk(root_dir):
-        for file in files:
-            if file.endswith("gaze_positions_new.csv"):
-                file_path = os.path.join(root, file)
-                data = pd.read_csv(file_path)
-                # Dropping the missing rows.
-                data_cleaned = data.dropna(how='any')
-
-                # Create a directory to save PNG files in the same directory as the data file
-                output_dir = os.path.join(root, 'graphs_cleaned')
-                os.makedirs(output_dir, exist_ok=True)
-
-                createGraphs(data_cleaned, output_dir)
-
-                # # For the second call to createGraphs, add a suffix to the directory name
-                # output_dir = os.path.join(root, 'graphs')
-                # os.makedirs(output_dir, exist_ok=True)
-                #
-                # createGraphs(data, output_dir)
-
-                # output_dir = os.path.join(root, 'heatmaps')
-                # os.makedirs(output_dir, exist_ok=True)
-                # createHeatMap(data, output_dir)
-
-                # output_dir = os.path.join(root, 'heatmaps_cleaned')
-                # os.makedirs(output_dir, exist_ok=True)
-                # createHeatMap(data_cleaned, output_dir)
+    file_paths = [os.path.join(root, file) for root, dirs, files in get_catalog().walk(root_dir)
+                  for file in files if file.endswith("gaze_positions_new.csv")]
+    if batch:
+        results = run_parallel(graphSession, [(file_path, True) for file_path in file_paths], workers, label='graphs')
+        report_failures(results, label='graphs')
+    else:
+        for file_path in file_paths:
+            graphSession(file_path, batch=False)
 
 
 if "__main__" == __name__:
@@ -0,0 +1,163 @@
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from annotation_store import read_annotation_sheet
+
+# Parser for the events of the PL sheet of the annotation workbooks.
+# Every distinct event text is normalized and matched once against a vocabulary of terms; each
+# term is one bit of an integer flag code, so a row can carry several terms (e.g. "סיום סיבוב" is
+# both a turn event and an end). Event types are defined on top of the flags: which rows belong
+# to the type, which of them open an interval and which close it. Adding a term or an event type
+# only adds a column to the small table of distinct texts, the rows are never scanned again.
+EVENT_COLUMN = 'PL_EVENTS'
+TIME_COLUMN = 'SEC.MILI'
+
+# term name -> (flag bit, regular expression searched in the normalized text)
+EVENT_VOCABULARY = {
+    'TURN': (1, r"תחילת.*סיבוב|סיום.*סיבוב"),
+    'START': (2, r"תחילת"),
+    'END': (4, r"סיום"),
+    'WALK_START': (8, r"תחילת הליכה"),
+    'WALK_END': (16, r"סוף|סיום"),
+}
+FLAGS = {term: bit for term, (bit, _) in EVENT_VOCABULARY.items()}
+
+# event type -> flags of the rows of the type, of the rows that open and of the rows that close an interval
+EVENT_TYPES = {
+    'turn': {'rows': FLAGS['TURN'], 'start': FLAGS['START'], 'end': FLAGS['END']},
+    'walk': {'rows': FLAGS['WALK_START'] | FLAGS['WALK_END'], 'start': FLAGS['WALK_START'], 'end': FLAGS['WALK_END']},
+}
+
+# Direction marks and Hebrew points that do not change the meaning of an event
+_IGNORED_CHARACTERS = re.compile(r"[\u200e\u200f\u202a-\u202e\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4\u05c5\u05c7]")
+
+
+def normalize_event(text):
+    """ The event text without direction marks and Hebrew points, with single spaces. """
+    text = unicodedata.normalize('NFC', str(text))
+    text = _IGNORED_CHARACTERS.sub('', text)
+    return ' '.join(text.split())
+
+
+def term_flags(text, vocabulary=EVENT_VOCABULARY):
+    """ The flag code of one normalized event text. """
+    flags = 0
+    for bit, pattern in vocabulary.values():
+        if re.search(pattern, text):
+            flags |= bit
+    return flags
+
+
+def event_flags(events, vocabulary=EVENT_VOCABULARY):
+    """ The flag code of every event (0 for empty cells), matching each distinct text only once. """
+    codes, texts = pd.factorize(pd.Series(events, dtype=object))
+    text_flags = np.array([term_flags(normalize_event(text), vocabulary) if isinstance(text, str) else 0
+                           for text in texts] + [0], dtype=np.int64)
+    # code -1 (missing) picks the trailing 0
+    return text_flags[codes]
+
+
+def pair_events(is_start, is_end):
+    """
+    Which rows open and which close an interval, as the old while loop over the turn rows did:
+    a start row is kept, and the row right after it is kept as its end if it is an end row.
+    A row that is both a start and an end closes the interval before it if there is one, and
+    opens a new one otherwise.
+
+    Returns:
+    - start_kept, end_kept: Boolean arrays
+    """
+    is_start = np.asarray(is_start, dtype=bool)
+    is_end = np.asarray(is_end, dtype=bool)
+    n = len(is_start)
+    if n == 0:
+        return is_start.copy(), is_end.copy()
+    positions = np.arange(n)
+    only_start = is_start & ~is_end
+    both = is_start & is_end
+
+    # Runs of rows that are both alternate between closing and opening, starting from the state
+    # left by the row before the run (open only after a plain start row)
+    previous_both = np.r_[False, both[:-1]]
+    run_first = np.maximum.accumulate(np.where(both & ~previous_both, positions, 0))
+    position_in_run = positions - run_first
+    open_before_run = np.r_[False, only_start[:-1]][run_first]
+    both_closes = both & ((position_in_run + open_before_run) % 2 == 1)
+
+    start_kept = only_start | (both & ~both_closes)
+    end_kept = both_closes | (is_end & ~is_start & np.r_[False, start_kept[:-1]])
+    return start_kept, end_kept
+
+
+def read_pl_events(file_path, sheet_name='PL'):
+    """ Reads the PL sheet of an annotation workbook (from its cached copy when the workbook did not change). """
+    return read_annotation_sheet(file_path, sheet_name)
+
+
+def event_rows(df, event_type, flags=None):
+    """
+    The positions (in df) of the rows kept for an event type, in row order, with start/end masks.
+
+    Returns:
+    - positions, start_kept, end_kept
+    """
+    definition = EVENT_TYPES[event_type]
+    if flags is None:
+        flags = event_flags(df[EVENT_COLUMN])
+    positions = np.flatnonzero(flags & definition['rows'])
+    type_flags = flags[positions]
+    start_kept, end_kept = pair_events(type_flags & definition['start'] != 0, type_flags & definition['end'] != 0)
+    keep = start_kept | end_kept
+    return positions[keep], start_kept[keep], end_kept[keep]
+
+
+def turn_rows(df, flags=None):
+    """ The rows of the PL sheet that collect_data_turns keeps: every turn start and the end that follows it. """
+    positions, _, _ = event_rows(df, 'turn', flags)
+    return df.iloc[positions]
+
+
+def event_intervals(df, event_types=tuple(EVENT_TYPES)):
+    """
+    One row per interval of every event type: the event type, start and end time (NaN for an
+    interval without an end) and the row positions in the sheet.
+    """
+    flags = event_flags(df[EVENT_COLUMN])
+    times = pd.to_numeric(df[TIME_COLUMN], errors='coerce').to_numpy(dtype=float)
+    tables = []
+    for event_type in event_types:
+        positions, start_kept, end_kept = event_rows(df, event_type, flags)
+        start_rows = positions[start_kept]
+        # the end of an interval is the next kept row if it is an end
+        interval_index = np.cumsum(start_kept) - 1
+        end_rows = np.full(len(start_rows), -1, dtype=np.int64)
+        closing = end_kept & (interval_index >= 0)
+        end_rows[interval_index[closing]] = positions[closing]
+        tables.append(pd.DataFrame({
+            'event': event_type,
+            'start': times[start_rows],
+            'end': np.where(end_rows >= 0, times[np.maximum(end_rows, 0)], np.nan),
+            'start_row': start_rows.astype(np.int64),
+            'end_row': end_rows,
+            'complete': end_rows >= 0,
+        }))
+    intervals = pd.concat(tables, ignore_index=True)
+    intervals['event'] = pd.Categorical(intervals['event'], categories=list(EVENT_TYPES))
+    return intervals
+
+
+def walking_bounds(df, flags=None):
+    """
+    The walking start and end times of a straight walking session, as collect_data_straight
+    takes them: the first 'תחילת הליכה' row and the first row with 'סוף' or 'סיום'.
+    Each is None if the sheet has no such row.
+    """
+    if flags is None:
+        flags = event_flags(df[EVENT_COLUMN])
+    times = df[TIME_COLUMN].to_numpy()
+    starts = np.flatnonzero(flags & FLAGS['WALK_START'])
+    ends = np.flatnonzero(flags & FLAGS['WALK_END'])
+    first_walking_time = times[starts[0]] if len(starts) else None
+    end_walking_time = times[ends[0]] if len(ends) else None
+    return first_walking_time, end_walking_time
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import pandas as pd
+from openpyxl import load_workbook
+from instrumentation import file_size, stage
+
+# Cache of the annotation workbooks (D:\annotations\...\*.xlsx).
+# A sheet is parsed once with openpyxl's read-only streaming reader and stored in a Parquet
+# sidecar in a cache folder outside the annotation tree (~/.annotation_cache, override with the
+# ANNOTATION_CACHE environment variable), so the scripts that pick the workbook of a patient by
+# listing its folder never see the cached copies:
+#   NB325_straight_ניתוח.xlsx -> <cache>/NB325_straight_ניתוח.<hash of the workbook path>.PL.parquet
+# The sidecar records the size and mtime of the workbook it was made from, so it is used until the
+# workbook is edited. Within one run every sheet is also kept in memory, so the scripts that read
+# the same workbook one after the other share a single parse.
+CACHE_DIR = os.environ.get('ANNOTATION_CACHE', os.path.join(os.path.expanduser('~'), '.annotation_cache'))
+SIDECAR_SUFFIX = '.parquet'
+SOURCE_KEY = b'annotation_source'
+MISSING_SHEET_KEY = b'annotation_missing_sheet'
+
+_loaded = {}
+
+
+def sidecar_path(workbook_path, sheet_name='PL'):
+    """ Returns the path of the cached copy of one sheet of a workbook, in CACHE_DIR. """
+    path_hash = hashlib.sha1(os.path.abspath(workbook_path).encode('utf-8')).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(workbook_path))[0]
+    return os.path.join(CACHE_DIR, f"{stem}.{path_hash}.{sheet_name}{SIDECAR_SUFFIX}")
+
+
+def workbook_key(workbook_path):
+    """ Size and mtime of the workbook, which the sidecar has to match to be used. """
+    stat = os.stat(workbook_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _cell_value(value):
+    # Whole numbers stored as floats are read as integers, as pandas.read_excel does
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _column_names(header):
+    """ The header row as pandas.read_excel names it: 'Unnamed: i' for empty cells, '.1' for repeated names. """
+    names = []
+    seen = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None else name
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def parse_sheet(workbook_path, sheet_name='PL'):
+    """
+    Parses one sheet with the read-only streaming reader. The first row holds the column names.
+    Raises ValueError if the workbook has no such sheet, like pandas.read_excel.
+    """
+    workbook = load_workbook(workbook_path, read_only=True, data_only=True)
+    try:
+        if sheet_name not in workbook.sheetnames:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+        rows = [[_cell_value(value) for value in row] for row in workbook[sheet_name].iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+    # Trailing empty rows are left out
+    while rows and all(value is None for value in rows[-1]):
+        rows.pop()
+    if not rows:
+        return pd.DataFrame()
+
+    width = max(len(row) for row in rows)
+    rows = [row + [None] * (width - len(row)) for row in rows]
+    return pd.DataFrame(rows[1:], columns=_column_names(rows[0]))
+
+
+def _typed(df):
+    """ The sheet with text column names and its columns of mixed values kept as text, like in the session store. """
+    df.columns = [str(column) for column in df.columns]
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].astype('string')
+    return df
+
+
+def _write_sidecar(df, workbook_path, sheet_name, key):
+    """ Stores the sheet, or an empty marker if the workbook has no such sheet (df is None). """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(pd.DataFrame() if df is None else df, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), SOURCE_KEY: key.encode()}
+    if df is None:
+        metadata[MISSING_SHEET_KEY] = b'1'
+    table = table.replace_schema_metadata(metadata)
+    parquet_path = sidecar_path(workbook_path, sheet_name)
+    os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+    # Worker processes of a parallel run may cache the same workbook, each through its own file
+    tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, parquet_path)
+
+
+def _read_sidecar(workbook_path, sheet_name, key):
+    """
+    The cached sheet as (True, DataFrame), or (True, None) if the workbook is known to have no
+    such sheet, or (False, None) if there is no sidecar made from the current workbook.
+    """
+    parquet_path = sidecar_path(workbook_path, sheet_name)
+    if not os.path.exists(parquet_path):
+        return False, None
+    import pyarrow.parquet as pq
+    try:
+        table = pq.read_table(parquet_path)
+    except Exception:
+        return False, None
+    metadata = table.schema.metadata or {}
+    if metadata.get(SOURCE_KEY) != key.encode():
+        return False, None
+    if metadata.get(MISSING_SHEET_KEY):
+        return True, None
+    return True, table.to_pandas()
+
+
+def read_annotation_sheet(workbook_path, sheet_name='PL'):
+    """
+    Load one sheet of an annotation workbook, parsing the workbook only if it changed since it
+    was last cached. Raises ValueError if the workbook has no such sheet.
+    """
+    key = workbook_key(workbook_path)
+    memo_key = (os.path.abspath(workbook_path), sheet_name)
+    cached = _loaded.get(memo_key)
+    if cached is None or cached[0] != key:
+        with stage('annotation_read', file=workbook_path) as record:
+            found, df = _read_sidecar(workbook_path, sheet_name, key)
+            if found:
+                record.add(bytes_read=file_size(sidecar_path(workbook_path, sheet_name)))
+            else:
+                try:
+                    df = _typed(parse_sheet(workbook_path, sheet_name))
+                except ValueError:
+                    # Remember that the sheet is missing, so the workbook is not parsed again to find out
+                    df = None
+                record.add(bytes_read=file_size(workbook_path))
+                try:
+                    _write_sidecar(df, workbook_path, sheet_name, key)
+                except Exception as e:
+                    print(f"Could not cache {workbook_path} ({sheet_name}): {e}")
+            record.add(rows_out=0 if df is None else len(df))
+        cached = (key, df)
+        _loaded[memo_key] = cached
+    if cached[1] is None:
+        raise ValueError(f"Worksheet named '{sheet_name}' not found")
+    return cached[1].copy()
+
+
+def has_sheet(workbook_path, sheet_name='PL'):
+    """ True if the workbook has the sheet (answered from the cache when possible). """
+    try:
+        read_annotation_sheet(workbook_path, sheet_name)
+    except ValueError:
+        return False
+    return True
+
+
+def ingest_folder(root_dir, sheet_name='PL'):
+    """ Caches the sheet of every workbook under root_dir that has it. """
+    cached = 0
+    for root, dirs, files in os.walk(root_dir):
+        for file in files:
+            if file.endswith('.xlsx') and not file.startswith('~$'):
+                workbook_path = os.path.join(root, file)
+                try:
+                    read_annotation_sheet(workbook_path, sheet_name)
+                    cached += 1
+                except Exception as e:
+                    print(f"Skipping file {workbook_path}: {e}")
+    return cached
+
+
+def main():
+    annotations_folder = r"D:\annotations"
+    cached = ingest_folder(annotations_folder)
+    print(f"{cached} annotation sheets cached in {annotations_folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,13 @@
-import pandas as pd
 import os
-from openpyxl import load_workbook
 from tkinter import Tk, filedialog
 import tkinter as tk
 from tkinter import ttk
 from PIL import Image, ImageTk # pip install pillow
 from moviepy.video.io.VideoFileClip import VideoFileClip
 import moviepy.editor as mp
+from annotation_store import read_annotation_sheet
+from session_catalog import get_catalog
 
-import glob
 
 
 class GuiApp:
@@ -47,25 +46,9 @@ class GuiApp:
 
 
 def read_excel_sheet(file_path, sheet_name):
-    # Load the Excel workbook
-    workbook = load_workbook(file_path, read_only=True, data_only=True)
-
-    # Select the desired sheet
-    sheet = workbook[sheet_name]
-
-    # Read the entire sheet into a DataFrame
-    result_df = pd.DataFrame(sheet.values)
-
-    # Set the column names based on the first row
-    result_df.columns = result_df.iloc[0]
-
-    # Drop the first row, which contains the column names
-    result_df = result_df[1:]
-
-    # Close the workbook
-    workbook.close()
-
-    return result_df
+    # The sheet is parsed once and then read from its cached copy until the workbook changes;
+    # the first row holds the column names
+    return read_annotation_sheet(file_path, sheet_name)
 
 
 def find_video_path(excel_file_path):
@@ -74,25 +57,14 @@ def find_video_path(excel_file_path):
     # Extract participant code from the Excel file path
     participant_code = os.path.basename(excel_file_path).split('_')[0]
 
-    for root, dirs, files in os.walk(data_directory):
-        for directory in dirs:
-            if participant_code in directory:
-                # Construct the search pattern for 'world.mp4' within the participant's directory
-                # if the participant is pd, the path will be different because there is ON and OFF
-                if excel_file_path.__contains__('ON'):
-                    search_pattern = os.path.join(root, directory, '**', 'world_on.mp4')
-                else:
-                    search_pattern = os.path.join(root, directory, '**', 'world.mp4')
-
-                # Use glob to find the file
-                video_files = glob.glob(search_pattern, recursive=True)
-
-                # Return the first found path (if any)
-                if video_files:
-                    return video_files[0]
-
-    # If the 'world.mp4' file is not found, return None
-    return None
+    # if the participant is pd, the path will be different because there is ON and OFF
+    if excel_file_path.__contains__('ON'):
+        video_name = 'world_on.mp4'
+    else:
+        video_name = 'world.mp4'
+
+    # Look up the first video inside a directory named after the participant (None if not found)
+    return get_catalog().find_video(data_directory, participant_code, video_name)
 
 
 def get_video_thumbnail(video_path, save_path='thumbnail.jpg', time_seconds=0.5):
@@ -0,0 +1,102 @@
+import numpy as np
+
+# Helpers for rendering many matplotlib graphs in a batch (Graphs.py, horizontal_gaze_analysis.py).
+# - use_headless_backend switches matplotlib to Agg, which renders straight to PNG without a GUI.
+# - reusable_axes hands out the same figure and axes for every graph of the same layout in a
+#   process, cleared, instead of building (and tearing down) a new figure per session.
+# - A session has hundreds of thousands of samples but a plot is about a thousand pixels wide, so
+#   dense series are reduced to what can be seen before they are drawn: min_max_envelope keeps the
+#   lowest and highest value of every pixel column of a line, and occupied_pixels keeps one sample
+#   per pixel for markers and scatters. The saved image looks the same at a fraction of the cost.
+# The batch scripts render their sessions on a process pool (see parallel.run_parallel), every
+# worker keeping its own figures.
+OVERSAMPLE = 2
+
+_figures = {}
+
+
+def use_headless_backend():
+    """ Renders with Agg (no windows); safe to call at any time and more than once. """
+    import matplotlib
+    if matplotlib.get_backend().lower() != 'agg':
+        import matplotlib.pyplot as plt
+        plt.switch_backend('Agg')
+
+
+def reusable_axes(nrows=1, ncols=1, figsize=(10, 6)):
+    """
+    The figure and flat list of axes of a layout, created on first use and cleared on later ones.
+    The figure must not be closed by the caller.
+    """
+    import matplotlib.pyplot as plt
+    key = (nrows, ncols, tuple(figsize))
+    if key not in _figures:
+        fig, axes = plt.subplots(nrows, ncols, figsize=figsize, squeeze=False)
+        _figures[key] = (fig, list(axes.flat))
+    fig, axes = _figures[key]
+    for ax in axes:
+        ax.clear()
+    return fig, axes
+
+
+def axes_pixels(ax, oversample=OVERSAMPLE):
+    """ (columns, rows) of the axes area in pixels, times oversample. """
+    extent = ax.get_window_extent()
+    return max(1, int(extent.width * oversample)), max(1, int(extent.height * oversample))
+
+
+def _sorted_by_x(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[keep], y[keep]
+    if len(x) > 1 and np.any(np.diff(x) < 0):
+        order = np.argsort(x, kind='stable')
+        x, y = x[order], y[order]
+    return x, y
+
+
+def min_max_envelope(x, y, columns):
+    """
+    A line through the lowest and highest value of every pixel column, which draws the same as
+    the full line.
+
+    Parameters:
+    - x, y: The values of the line
+    - columns: Number of pixel columns across the x range (see axes_pixels)
+
+    Returns:
+    - (x, y) arrays with at most two points per column, or the sorted values if there are fewer
+      samples than that
+    """
+    x, y = _sorted_by_x(x, y)
+    if len(x) <= 2 * columns:
+        return x, y
+    span = x[-1] - x[0]
+    column = np.minimum(((x - x[0]) / span * columns).astype(np.int64), columns - 1) if span > 0 else np.zeros(len(x), np.int64)
+    starts = np.flatnonzero(np.r_[True, np.diff(column) != 0])
+    lows = np.minimum.reduceat(y, starts)
+    highs = np.maximum.reduceat(y, starts)
+    # Every column is drawn as a vertical stroke at its first sample's x
+    column_x = x[starts]
+    return np.repeat(column_x, 2), np.column_stack([lows, highs]).ravel()
+
+
+def occupied_pixels(x, y, columns, rows):
+    """
+    One sample of every pixel (of a columns x rows grid over the data range) that has samples,
+    for drawing markers: the markers of the other samples fall on the same pixels.
+
+    Returns:
+    - (x, y) arrays of the samples kept, in x order
+    """
+    x, y = _sorted_by_x(x, y)
+    if len(x) <= columns:
+        return x, y
+    x_span = x[-1] - x[0]
+    y_low, y_span = y.min(), y.max() - y.min()
+    column = np.minimum(((x - x[0]) / x_span * columns).astype(np.int64), columns - 1) if x_span > 0 else 0
+    row = np.minimum(((y - y_low) / y_span * rows).astype(np.int64), rows - 1) if y_span > 0 else 0
+    _, first = np.unique(column * rows + row, return_index=True)
+    first.sort()
+    return x[first], y[first]
@@ -0,0 +1,198 @@
+import atexit
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+# Structured timings of the analysis stages (discovery, read, filter, FFT, integration, plot, write).
+# A stage is wrapped in `with stage('read', patient=..., file=...) as record:` and the code inside
+# adds what it processed with record.add(rows_in=..., rows_out=..., bytes_read=...). Every stage
+# becomes one record with its wall and CPU time, the counts and the peak RSS of the process.
+# Set the ANALYSIS_REPORT environment variable to a path (without extension) to switch it on: the
+# records are written to <path>.json (with a per-stage summary) and <path>.csv when the run ends.
+# When it is not set, stage() hands back one shared object that does nothing, so the calls can
+# stay in the scripts at no measurable cost.
+REPORT_VARIABLE = 'ANALYSIS_REPORT'
+RECORD_FIELDS = ['stage', 'patient', 'file', 'pid', 'start_s', 'wall_s', 'cpu_s', 'rows_in', 'rows_out',
+                 'bytes_read', 'peak_rss_mb', 'status', 'error']
+
+_report_path = None
+_records = []
+_run_start = time.time()
+
+
+def peak_rss_mb():
+    """ The peak resident memory of this process so far in MB, or None where it cannot be read. """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes on Linux
+        return round(peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10, 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        # Windows keeps the peak working set; elsewhere only the current RSS is known
+        return round(getattr(info, 'peak_wset', info.rss) / 2 ** 20, 1)
+    except ImportError:
+        return None
+
+
+def file_size(path):
+    """ Size of a file in bytes, 0 if it cannot be read. """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class StageRecord:
+    """ Times one stage from `with` to the end of the block and collects its counts. """
+
+    def __init__(self, name, patient=None, file=None):
+        self.values = {'stage': name, 'patient': patient, 'file': file, 'pid': os.getpid(),
+                       'rows_in': 0, 'rows_out': 0, 'bytes_read': 0, 'status': 'ok', 'error': ''}
+
+    def add(self, rows_in=0, rows_out=0, bytes_read=0):
+        self.values['rows_in'] += rows_in
+        self.values['rows_out'] += rows_out
+        self.values['bytes_read'] += bytes_read
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.values['start_s'] = round(time.time() - _run_start, 3)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.values['wall_s'] = round(time.perf_counter() - self._wall, 6)
+        self.values['cpu_s'] = round(time.process_time() - self._cpu, 6)
+        self.values['peak_rss_mb'] = peak_rss_mb()
+        if exc_type is not None:
+            self.values['status'] = 'error'
+            self.values['error'] = f"{exc_type.__name__}: {exc_value}"
+        _records.append(self.values)
+        return False
+
+
+class _DisabledStage:
+    """ Stands in for StageRecord when the instrumentation is off. """
+
+    def add(self, rows_in=0, rows_out=0, bytes_read=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_DISABLED = _DisabledStage()
+
+
+def enabled():
+    return _report_path is not None
+
+
+def stage(name, patient=None, file=None):
+    """
+    Context manager timing one stage.
+
+    Parameters:
+    - name: Stage name, e.g. 'discovery', 'read', 'filter', 'fft', 'integration', 'plot', 'write'
+    - patient: Patient ID the work belongs to, if any
+    - file: File the stage works on, if any
+
+    Returns:
+    - A StageRecord (or a stand-in doing nothing when disabled) whose add() counts rows and bytes
+    """
+    if _report_path is None:
+        return _DISABLED
+    return StageRecord(name, patient, file)
+
+
+def records_mark():
+    """ Position in the records of this process, for taking the records of one task (see take_records). """
+    return len(_records)
+
+
+def take_records(mark):
+    """ Removes and returns the records added since mark; parallel._call sends them back from the workers. """
+    taken = _records[mark:]
+    del _records[mark:]
+    return taken
+
+
+def add_records(records):
+    """ Adds records made in another process. """
+    _records.extend(records)
+
+
+def summary(records=None):
+    """ Per stage totals: calls, errors, wall and CPU time, rows, bytes read and the highest peak RSS. """
+    totals = {}
+    for record in (_records if records is None else records):
+        total = totals.setdefault(record['stage'], {'calls': 0, 'errors': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                    'rows_in': 0, 'rows_out': 0, 'bytes_read': 0, 'peak_rss_mb': None})
+        total['calls'] += 1
+        total['errors'] += record['status'] != 'ok'
+        for field in ('wall_s', 'cpu_s', 'rows_in', 'rows_out', 'bytes_read'):
+            total[field] += record[field]
+        if record['peak_rss_mb'] is not None:
+            total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0, record['peak_rss_mb'])
+    for total in totals.values():
+        total['wall_s'] = round(total['wall_s'], 3)
+        total['cpu_s'] = round(total['cpu_s'], 3)
+    return totals
+
+
+def write_report(path=None):
+    """ Writes the records to <path>.json and <path>.csv. Returns the JSON path, or None if there is nothing to write. """
+    path = path or _report_path
+    if not path:
+        return None
+    path = os.path.splitext(path)[0]
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    report = {
+        'command': sys.argv,
+        'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(_run_start)),
+        'wall_s': round(time.time() - _run_start, 3),
+        'stages': summary(),
+        'records': _records,
+    }
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    with open(path + '.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+        writer.writeheader()
+        writer.writerows(_records)
+    print(f"Run report saved to: {path}.json")
+    return path + '.json'
+
+
+def enable(report_path):
+    """
+    Switches the instrumentation on for this run and for the worker processes it starts.
+    The report is written to report_path (.json and .csv) when the run ends.
+    """
+    global _report_path
+    if _report_path is None and multiprocessing.parent_process() is None:
+        atexit.register(write_report)
+    _report_path = report_path
+    os.environ[REPORT_VARIABLE] = report_path
+
+
+# Worker processes inherit the variable and collect records too, but only the main process
+# writes the report
+if os.environ.get(REPORT_VARIABLE):
+    if multiprocessing.parent_process() is None:
+        enable(os.environ[REPORT_VARIABLE])
+    else:
+        _report_path = os.environ[REPORT_VARIABLE]
@@ -0,0 +1,117 @@
+import os
+import pandas as pd
+from instrumentation import file_size, stage
+
+# The files the turn analysis stages hand to each other (turns_data_*, non_turns_data_*, gaze_data_*).
+# They are written as Parquet, which is read and written far faster than Excel and has no row limit;
+# an Excel copy next to the Parquet file (same name, .xlsx) is only written on request, for the
+# R Markdown reports and for looking at the data by hand. The readers accept both formats, so folders
+# written before the switch still work.
+INTERMEDIATE_SUFFIX = '.parquet'
+EXCEL_SUFFIX = '.xlsx'
+INTERMEDIATE_SUFFIXES = (INTERMEDIATE_SUFFIX, EXCEL_SUFFIX)
+# Rows of an Excel sheet, one of them is the header
+EXCEL_MAX_ROWS = 1_048_576
+
+
+def intermediate_path(path):
+    """ The Parquet path of an intermediate file, whatever extension the given path has. """
+    return os.path.splitext(path)[0] + INTERMEDIATE_SUFFIX
+
+
+def excel_path(path):
+    """ The path of the Excel copy of an intermediate file. """
+    return os.path.splitext(path)[0] + EXCEL_SUFFIX
+
+
+def is_intermediate(file_name, prefix=''):
+    """ True if a file name is an intermediate file (of either format) starting with prefix. """
+    return (file_name.startswith(prefix) and file_name.endswith(INTERMEDIATE_SUFFIXES)
+            and not file_name.startswith('~$'))
+
+
+def export_excel(df, path):
+    """ Writes the Excel copy of an intermediate file. Returns its path, or None if the table does not fit in a sheet. """
+    output_file = excel_path(path)
+    if len(df) >= EXCEL_MAX_ROWS:
+        print(f"{len(df)} rows do not fit in an Excel sheet, not exporting: {output_file}")
+        return None
+    with stage('excel_write', file=output_file) as record:
+        df.to_excel(output_file, index=False, engine='openpyxl')
+        record.add(rows_out=len(df))
+    return output_file
+
+
+def write_intermediate(df, path, excel=False):
+    """
+    Writes an intermediate file.
+
+    Parameters:
+    - df: DataFrame to write
+    - path: Output path; a .xlsx path writes only Excel (the old format), any other extension
+      writes Parquet
+    - excel: Also write the Excel copy next to the Parquet file
+
+    Returns:
+    - Path of the file written
+    """
+    if path.endswith(EXCEL_SUFFIX):
+        export_excel(df, path)
+        return path
+
+    stored = df.copy()
+    stored.columns = [str(column) for column in stored.columns]
+    # Columns with mixed values are kept as text, like in the session store
+    for column in stored.columns[stored.dtypes == object]:
+        stored[column] = stored[column].astype('string')
+
+    # Write to a temporary file first so an interrupted run never leaves a half written file
+    with stage('write', file=path) as record:
+        tmp_path = path + '.tmp'
+        stored.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        record.add(rows_out=len(stored))
+    if excel:
+        export_excel(df, path)
+    return path
+
+
+def read_intermediate(path, columns=None):
+    """ Load an intermediate file of either format, optionally only some columns. """
+    with stage('read', file=path) as record:
+        if path.endswith(EXCEL_SUFFIX):
+            df = pd.read_excel(path, engine='openpyxl')
+            if columns is not None:
+                df = df[[column for column in columns if column in df.columns]]
+        else:
+            if columns is not None:
+                import pyarrow.parquet as pq
+                available = set(pq.read_schema(path).names)
+                columns = [column for column in columns if column in available]
+            df = pd.read_parquet(path, columns=columns)
+        record.add(rows_out=len(df), bytes_read=file_size(path))
+    return df
+
+
+def intermediate_files(folder, prefix='', recursive=False):
+    """
+    The intermediate files of a folder, sorted by name. When a file exists in both formats only
+    the Parquet one is listed, the Excel one being its export.
+    """
+    if not os.path.isdir(folder):
+        return []
+    if recursive:
+        listing = [(root, files) for root, _, files in os.walk(folder)]
+    else:
+        listing = [(folder, os.listdir(folder))]
+
+    paths = []
+    for root, files in listing:
+        stems = {}
+        for file in sorted(files):
+            if is_intermediate(file, prefix):
+                stem, suffix = os.path.splitext(file)
+                if stem not in stems or suffix == INTERMEDIATE_SUFFIX:
+                    stems[stem] = file
+        paths += [os.path.join(root, stems[stem]) for stem in sorted(stems)]
+    return paths
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class TimeIntervalIndex:
+    """
+    Index over the timestamp column of a recording (the '#VALUE!' / first column of the gaze files),
+    used to cut many [start, end] windows out of it with binary search instead of one boolean mask
+    over the whole frame per window.
+
+    Pupil Labs exports are recorded in time order, so the column is normally already sorted and the
+    windows are plain slices of the frame. If it is not, the index keeps a sorted copy and maps the
+    positions back, so every method still returns row positions in the original row order.
+    """
+
+    def __init__(self, timestamps):
+        times = np.asarray(timestamps, dtype=float)
+        self.length = len(times)
+        # NaN timestamps make this False, and they end up after every real time in the sorted copy
+        self.is_sorted = bool(np.all(times[1:] >= times[:-1]))
+        if self.is_sorted:
+            self.order = None
+            self.sorted_times = times
+        else:
+            self.order = np.argsort(times, kind='stable')
+            self.sorted_times = times[self.order]
+
+    @classmethod
+    def from_frame(cls, df, column=None):
+        """ Builds the index over df[column], or over the first column of df if no column is given. """
+        return cls(df.iloc[:, 0] if column is None else df[column])
+
+    def bounds(self, starts, ends):
+        """ Positions [lo, hi) in the sorted times of every window start <= t <= end. """
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        ends = np.atleast_1d(np.asarray(ends, dtype=float))
+        lo = np.searchsorted(self.sorted_times, starts, side='left')
+        hi = np.searchsorted(self.sorted_times, ends, side='right')
+        return lo, np.maximum(hi, lo)
+
+    def windows(self, starts, ends):
+        """
+        Row positions of every window, one entry per window. With a sorted column these are slice
+        objects, so df.iloc[window] is a view of the frame and nothing is copied.
+        """
+        lo, hi = self.bounds(starts, ends)
+        if self.is_sorted:
+            return [slice(int(a), int(b)) for a, b in zip(lo, hi)]
+        return [np.sort(self.order[a:b]) for a, b in zip(lo, hi)]
+
+    def positions(self, starts, ends):
+        """ Row positions of all windows, one after the other, ready for a single df.iloc gather. """
+        lo, hi = self.bounds(starts, ends)
+        lengths = hi - lo
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        # position k of window w is lo[w] + (k - offset[w])
+        offsets = np.cumsum(lengths) - lengths
+        sorted_positions = np.arange(total) + np.repeat(lo - offsets, lengths)
+        if self.is_sorted:
+            return sorted_positions
+        positions = self.order[sorted_positions]
+        # keep the original row order inside every window
+        window_ids = np.repeat(np.arange(len(lengths)), lengths)
+        return positions[np.lexsort((positions, window_ids))]
+
+    def take(self, df, starts, ends):
+        """ All rows of df that fall in the windows, concatenated in window order (like the old concat loop). """
+        return df.iloc[self.positions(starts, ends)]
+
+    def window_ends(self, starts, ends):
+        """ Row positions of the first and last row of every window (-1, -1 for empty windows). """
+        lo, hi = self.bounds(starts, ends)
+        empty = hi <= lo
+        if self.is_sorted:
+            first, last = lo, hi - 1
+        else:
+            first = np.array([self.order[a:b].min() if b > a else -1 for a, b in zip(lo, hi)], dtype=np.int64)
+            last = np.array([self.order[a:b].max() if b > a else -1 for a, b in zip(lo, hi)], dtype=np.int64)
+        return np.where(empty, -1, first), np.where(empty, -1, last)
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import instrumentation
+
+# Runs independent per-patient / per-session work on a pool of processes.
+# The batch scripts build a list of tasks (the arguments of one call each, the first one naming the
+# task in the messages), hand it to run_parallel together with a module-level function, and get back
+# one TaskResult per task in the order of the list, whatever order the workers finish in. An
+# exception in a task is caught in the worker and returned with its traceback, so one bad
+# recording does not stop the cohort.
+# The number of processes is taken from the ANALYSIS_WORKERS environment variable when it is set,
+# otherwise every core is used; workers=1 runs the tasks one by one in this process.
+# The stage records a task makes in a worker (see instrumentation) are sent back with its result.
+WORKERS_VARIABLE = 'ANALYSIS_WORKERS'
+
+
+def default_workers():
+    """ The number of worker processes to use when the caller does not say. """
+    value = os.environ.get(WORKERS_VARIABLE)
+    if value:
+        try:
+            return max(1, int(value))
+        except ValueError:
+            print(f"Ignoring {WORKERS_VARIABLE}={value}: not a number")
+    return os.cpu_count() or 1
+
+
+class TaskResult:
+    """
+    The outcome of one task.
+
+    Parameters:
+    - args: The arguments the task was called with
+    - value: What the function returned (None if it failed)
+    - error: The traceback of the exception the task raised, or None
+    """
+
+    def __init__(self, args, value=None, error=None):
+        self.args = args
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _call(function, args):
+    # Runs in the worker: the exception is turned into text so it can always be sent back
+    try:
+        return function(*args), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def _call_in_worker(function, args):
+    mark = instrumentation.records_mark()
+    value, error = _call(function, args)
+    return value, error, instrumentation.take_records(mark)
+
+
+class Progress:
+    """ Prints "[label] done/total" about every 5% of the tasks and at the end. """
+
+    def __init__(self, total, label):
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.failed = 0
+        self.step = max(1, total // 20)
+
+    def update(self, result):
+        self.done += 1
+        if not result.ok:
+            self.failed += 1
+        if self.done % self.step == 0 or self.done == self.total:
+            failed = f", {self.failed} failed" if self.failed else ""
+            print(f"[{self.label}] {self.done}/{self.total} done{failed}")
+
+
+def run_parallel(function, tasks, workers=None, label='tasks', start_method=None):
+    """
+    Calls function(*args) for every args of tasks on a process pool.
+
+    Parameters:
+    - function: A module-level function (it is sent to the workers by name)
+    - tasks: List of argument tuples, one per call
+    - workers: Number of processes, None for default_workers(); 1 runs everything in this process
+    - label: Name printed with the progress counter
+    - start_method: multiprocessing start method of the workers, None for the platform default;
+      'spawn' starts them fresh, e.g. when this process has already loaded TensorFlow
+
+    Returns:
+    - List of TaskResult, in the order of tasks
+    """
+    tasks = [tuple(args) for args in tasks]
+    if workers is None:
+        workers = default_workers()
+    workers = min(workers, len(tasks))
+    progress = Progress(len(tasks), label)
+    results = [None] * len(tasks)
+
+    if workers <= 1:
+        for index, args in enumerate(tasks):
+            results[index] = TaskResult(args, *_call(function, args))
+            progress.update(results[index])
+        return results
+
+    context = multiprocessing.get_context(start_method) if start_method else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(_call_in_worker, function, args): index for index, args in enumerate(tasks)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                value, error, records = future.result()
+                instrumentation.add_records(records)
+            except Exception:
+                # The worker itself died (e.g. out of memory) or the result could not be sent back
+                value, error = None, traceback.format_exc()
+            results[index] = TaskResult(tasks[index], value, error)
+            progress.update(results[index])
+    return results
+
+
+def report_failures(results, label='tasks', details=False):
+    """
+    Prints the error of every failed task: the exception line, or the whole traceback with
+    details=True. Returns the number of failures.
+    """
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        name = result.args[0] if result.args else ''
+        error = result.error if details else result.error.strip().splitlines()[-1]
+        print(f"[{label}] {name} failed: {error}")
+    return len(failed)
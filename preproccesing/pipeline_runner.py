@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+
+# A small incremental runner for chains of scripts that turn files into files.
+# A pipeline is a set of stages; a stage plans its tasks (usually one per patient) once the
+# stages it depends on have run, and every task declares the files it reads and writes.
+# A task is run again only when the content of one of its inputs (or its parameters) changed,
+# when one of the outputs it wrote is gone, or when it failed the last time. File contents are hashed with SHA-256, and the
+# hashes are cached by file size and mtime, so an unchanged cohort is checked without reading it.
+STATE_VERSION = 1
+
+
+def sha256_file(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Task:
+    """
+    One unit of work of a stage.
+
+    Parameters:
+    - name: Unique name of the task within its stage (e.g. the input file name)
+    - action: Function without arguments that does the work
+    - inputs: Paths of the files the task reads (paths that are None are ignored)
+    - outputs: Paths of the files the task writes
+    - params: Anything JSON serializable that changes the result (e.g. a threshold)
+    """
+
+    def __init__(self, name, action, inputs=(), outputs=(), params=None):
+        self.name = name
+        self.action = action
+        self.inputs = [path for path in inputs if path]
+        self.outputs = list(outputs)
+        self.params = params
+
+
+class PipelineRunner:
+    """
+    Runs the stages of a pipeline in dependency order, skipping the tasks whose inputs did not change.
+
+    Parameters:
+    - state_file: JSON file that keeps the fingerprints between runs
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.stages = {}
+        self.state = {'version': STATE_VERSION, 'files': {}, 'tasks': {}}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable pipeline state {self.state_file}: {e}")
+            return
+        if stored.get('version') == STATE_VERSION:
+            self.state = stored
+
+    def save(self):
+        folder = os.path.dirname(self.state_file)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_file, self.state_file)
+
+    def add_stage(self, name, plan, after=()):
+        """
+        Declares a stage.
+
+        Parameters:
+        - name: Stage name
+        - plan: Function without arguments returning the stage's list of Task; it is called when
+          the stage is about to run, so it can list the files the earlier stages wrote
+        - after: Names of the stages that have to run first
+        """
+        self.stages[name] = {'plan': plan, 'after': list(after)}
+
+    def stage_order(self):
+        """ The stage names, every stage after the ones it depends on. """
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Pipeline stages depend on each other in a cycle at stage {name}")
+            visiting.add(name)
+            for dependency in self.stages[name]['after']:
+                visit(dependency)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def file_digest(self, path):
+        """ SHA-256 of a file, or None if it does not exist. Re-hashed only when its size or mtime changed. """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self.state['files'].get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+            return cached['sha256']
+        digest = sha256_file(path)
+        self.state['files'][path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest}
+        return digest
+
+    def fingerprint(self, task):
+        """ Hash of the task parameters and of the content of all its inputs. """
+        inputs = [[path, self.file_digest(path)] for path in sorted(task.inputs)]
+        payload = json.dumps({'params': task.params, 'inputs': inputs, 'outputs': sorted(task.outputs)},
+                             sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _outputs_intact(self, record):
+        for path, (size, mtime) in record['written'].items():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if stat.st_size != size or stat.st_mtime != mtime:
+                return False
+        return True
+
+    def run(self, stages=None, force=False):
+        """
+        Runs the pipeline.
+
+        Parameters:
+        - stages: Names of the stages to run (with the stages they depend on), or None for all
+        - force: Run every task even if its inputs did not change
+
+        Returns:
+        - Dictionary {stage: {'run': n, 'skipped': n, 'failed': n}}
+        """
+        order = self.stage_order()
+        if stages is not None:
+            needed = set()
+            pending = list(stages)
+            while pending:
+                name = pending.pop()
+                if name not in needed:
+                    needed.add(name)
+                    pending.extend(self.stages[name]['after'])
+            order = [name for name in order if name in needed]
+
+        summary = {}
+        for stage in order:
+            summary[stage] = self.run_stage(stage, force)
+            self.save()
+        return summary
+
+    def run_stage(self, stage, force=False):
+        counts = {'run': 0, 'skipped': 0, 'failed': 0}
+        records = self.state['tasks'].setdefault(stage, {})
+        tasks = self.stages[stage]['plan']()
+
+        # Outputs of tasks that are no longer planned because an input was deleted from its folder
+        # (e.g. a workbook) are stale. Tasks that are only missing from this plan (e.g. a drive
+        # that is not connected) keep their outputs.
+        planned = {task.name for task in tasks}
+        for name in [name for name in records if name not in planned]:
+            deleted = [path for path in records[name].get('inputs', [])
+                       if not os.path.exists(path) and os.path.isdir(os.path.dirname(path))]
+            if not deleted:
+                continue
+            for path in records[name]['written']:
+                if os.path.exists(path):
+                    os.remove(path)
+                    print(f"Removed stale output: {path}")
+            del records[name]
+
+        for task in tasks:
+            fingerprint = self.fingerprint(task)
+            record = records.get(task.name)
+            # A task that failed is tried again on the next run, whether or not its inputs changed
+            if not force and record and record.get('status') == 'done' and record['fingerprint'] == fingerprint \
+                    and self._outputs_intact(record):
+                counts['skipped'] += 1
+                continue
+
+            status = 'done'
+            try:
+                task.action()
+            except Exception as e:
+                print(f"[{stage}] {task.name} failed: {e}")
+                status = 'failed'
+
+            written = {}
+            for path in task.outputs:
+                if os.path.exists(path):
+                    stat = os.stat(path)
+                    written[path] = [stat.st_size, stat.st_mtime]
+            records[task.name] = {'fingerprint': fingerprint, 'status': status, 'inputs': task.inputs,
+                                  'written': written}
+            counts['run' if status == 'done' else 'failed'] += 1
+
+        print(f"[{stage}] {counts['run']} run, {counts['skipped']} unchanged, {counts['failed']} failed")
+        return counts
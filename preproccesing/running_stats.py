@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class RunningStats:
+    """
+    Count, mean, variance, min and max of a stream of values, updated chunk by chunk.
+
+    The mean and variance are kept as (count, mean, sum of squared deviations) and combined with
+    the parallel form of Welford's algorithm, so two accumulators built over different chunks
+    (or different files) can be merged into the statistics of all their values. NaN values are
+    ignored, like pandas does.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = np.inf
+        self._max = -np.inf
+
+    @classmethod
+    def from_values(cls, values):
+        """ An accumulator holding the statistics of one array of values. """
+        stats = cls()
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values):
+            stats.count = len(values)
+            stats._mean = float(values.mean())
+            stats._m2 = float(((values - stats._mean) ** 2).sum())
+            stats._min = float(values.min())
+            stats._max = float(values.max())
+        return stats
+
+    def to_dict(self):
+        """ The state of the accumulator as plain numbers, e.g. to save it as JSON. """
+        return {'count': self.count, 'mean': self._mean, 'm2': self._m2,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, state):
+        """ An accumulator restored from to_dict. """
+        stats = cls()
+        if state['count']:
+            stats.count = int(state['count'])
+            stats._mean, stats._m2 = float(state['mean']), float(state['m2'])
+            stats._min, stats._max = float(state['min']), float(state['max'])
+        return stats
+
+    def update(self, values):
+        """ Adds an array of values. """
+        return self.merge(RunningStats.from_values(values))
+
+    def merge(self, other):
+        """ Adds the values another accumulator has seen. """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self._mean, self._m2 = other.count, other._mean, other._m2
+            self._min, self._max = other._min, other._max
+            return self
+
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        self._mean += delta * other.count / count
+        self._m2 += other._m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        return self
+
+    @property
+    def mean(self):
+        return self._mean if self.count else np.nan
+
+    def variance(self, ddof=1):
+        return self._m2 / (self.count - ddof) if self.count > ddof else np.nan
+
+    def std(self, ddof=1):
+        """ Standard deviation; ddof=1 by default, like pandas Series.std(). """
+        return np.sqrt(self.variance(ddof))
+
+    @property
+    def min(self):
+        return self._min if self.count else np.nan
+
+    @property
+    def max(self):
+        return self._max if self.count else np.nan
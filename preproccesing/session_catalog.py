@@ -0,0 +1,385 @@
+import json
+import os
+from instrumentation import stage
+
+# The catalog replaces the os.walk / os.listdir discovery that every script used to repeat.
+# One scan records, for every data folder, the directory tree with the entries of each
+# directory and its mtime. Later runs only stat the directories: a directory whose mtime
+# did not change is not listed again, so refreshing a catalog of an unchanged drive is cheap.
+CATALOG_FILE = os.environ.get('SESSION_CATALOG', os.path.join(os.path.expanduser('~'), '.session_catalog.json'))
+CATALOG_VERSION = 1
+
+GAZE_FILES = ['gaze_positions.csv', 'gaze_positions_new.csv']
+PUPIL_FILES = ['pupil_positions.csv']
+VIDEO_FILES = ['world.mp4', 'world_on.mp4']
+ANNOTATION_SUFFIXES = ('.xlsx',)
+
+# group name -> identifier that filter_file_path looks for in the path
+GROUP_IDENTIFIERS = {'EC': 'EC', 'PD_OFF': 'OFF', 'PD_ON': 'ON'}
+FILTER_OPTIONS = [1, 2, 3, 4]
+SESSION_TYPES = {1: 'STRAIGHT', 2: 'STRAIGHT_DT', 3: 'RESH', 4: 'RESH_DT'}
+
+
+def file_kind(file_name):
+    """ Returns 'gaze', 'pupil', 'video' or 'annotation' for the files the catalog tracks, otherwise None. """
+    if file_name in GAZE_FILES:
+        return 'gaze'
+    if file_name in PUPIL_FILES:
+        return 'pupil'
+    if file_name in VIDEO_FILES:
+        return 'video'
+    if file_name.endswith(ANNOTATION_SUFFIXES) and not file_name.startswith('~$'):
+        return 'annotation'
+    return None
+
+
+def patient_id_from_path(file_path):
+    """ The patient ID is the folder right after the 'PD' or 'EC' folder, as in process_patient_data. """
+    parts = file_path.split(os.sep)
+    if "PD" in parts:
+        ec_index = parts.index("PD")
+    elif "EC" in parts:
+        ec_index = parts.index("EC")
+    else:
+        return None
+    return parts[ec_index + 1] if ec_index + 1 < len(parts) else None
+
+
+def patient_state(file_path):
+    """ Returns EC, PD_OFF or PD_ON for a session path, or None if it cannot be told. """
+    parts = file_path.split(os.sep)
+    if "EC" in parts:
+        return 'EC'
+    path_upper = file_path.upper()
+    if 'OFF' in path_upper:
+        return 'PD_OFF'
+    if 'ON' in path_upper:
+        return 'PD_ON'
+    return None
+
+
+def session_type(file_path):
+    """ Returns the single walking condition (1-4, see SESSION_TYPES) a session belongs to, or -1. """
+    path_upper = file_path.upper()
+    straight = any(keyword in path_upper for keyword in ["STRIGHT", "STRAIGHT"])
+    dual_task = "DT" in path_upper
+    if straight:
+        return 2 if dual_task else 1
+    if "RESH" in path_upper:
+        return 4 if dual_task else 3
+    return -1
+
+
+def normalize_patient_id(name):
+    return name.lower().replace('_', '-').replace('-', '_')
+
+
+class SessionCatalog:
+    def __init__(self, catalog_file=CATALOG_FILE):
+        self.catalog_file = catalog_file
+        # directory path -> {'mtime': float, 'names': [...], 'subdirs': [...]}
+        self.dirs = {}
+        self.roots = []
+        self.changed = False
+        self._refreshed = set()
+        self._lookups = {}
+        self._load()
+
+    def _load(self):
+        if not self.catalog_file or not os.path.exists(self.catalog_file):
+            return
+        try:
+            with open(self.catalog_file, encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable session catalog {self.catalog_file}: {e}")
+            return
+        if stored.get('version') != CATALOG_VERSION:
+            return
+        self.dirs = stored.get('dirs', {})
+        self.roots = stored.get('roots', [])
+
+    def save(self):
+        """ Writes the catalog back to disk if a refresh changed it. """
+        if not self.catalog_file or not self.changed:
+            return
+        # Worker processes of a parallel run may save at the same time, each through its own file
+        tmp_file = f"{self.catalog_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': CATALOG_VERSION, 'roots': self.roots, 'dirs': self.dirs}, f, ensure_ascii=False)
+        os.replace(tmp_file, self.catalog_file)
+        self.changed = False
+
+    def refresh(self, root):
+        """
+        Bring the cached tree under `root` up to date.
+
+        Every directory is stat-ed; only directories whose mtime changed since the last scan
+        (entries added, removed or renamed) are listed again.
+        """
+        root = os.path.normpath(root)
+        if root not in self.roots:
+            self.roots.append(root)
+            self.changed = True
+
+        seen = set()
+        stack = [root]
+        # rows_in: directories stat-ed, rows_out: directories listed again
+        with stage('catalog_refresh', file=root) as record:
+            while stack:
+                directory = stack.pop()
+                seen.add(directory)
+                try:
+                    mtime = os.stat(directory).st_mtime
+                except OSError:
+                    continue
+                cached = self.dirs.get(directory)
+                if cached is None or cached['mtime'] != mtime:
+                    try:
+                        with os.scandir(directory) as it:
+                            entries = list(it)
+                    except OSError:
+                        continue
+                    cached = {
+                        'mtime': mtime,
+                        'names': [entry.name for entry in entries],
+                        'subdirs': [entry.name for entry in entries if entry.is_dir()],
+                    }
+                    self.dirs[directory] = cached
+                    self.changed = True
+                    record.add(rows_out=1)
+                # Reversed so the stack pops subdirectories in listing order, like os.walk
+                stack.extend(os.path.join(directory, name) for name in reversed(cached['subdirs']))
+            record.add(rows_in=len(seen))
+
+        # Forget directories that were removed from the tree
+        prefix = root + os.sep
+        for directory in [d for d in self.dirs if (d == root or d.startswith(prefix)) and d not in seen]:
+            del self.dirs[directory]
+            self.changed = True
+
+        self._refreshed.add(root)
+        self._lookups.clear()
+
+    def ensure(self, root):
+        """ Refreshes `root` once per process; later calls are free. """
+        root = os.path.normpath(root)
+        covered = any(root == r or root.startswith(r.rstrip(os.sep) + os.sep) for r in self._refreshed)
+        if not covered:
+            self.refresh(root)
+            self.save()
+        return root
+
+    def walk(self, root):
+        """ Same as os.walk(root) but served from the catalog. """
+        root = self.ensure(root)
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            cached = self.dirs.get(directory)
+            if cached is None:
+                continue
+            subdirs = cached['subdirs']
+            files = [name for name in cached['names'] if name not in subdirs]
+            yield directory, subdirs, files
+            stack.extend(os.path.join(directory, name) for name in reversed(subdirs))
+
+    def listdir(self, folder):
+        """ Same as os.listdir(folder) but served from the catalog. """
+        folder = self.ensure(folder)
+        cached = self.dirs.get(folder)
+        return list(cached['names']) if cached else []
+
+    def files(self, root, kind):
+        """ All files of one kind ('gaze', 'pupil', 'video', 'annotation') under root, in walk order. """
+        key = ('files', os.path.normpath(root), kind)
+        if key not in self._lookups:
+            self._lookups[key] = [
+                os.path.join(directory, name)
+                for directory, _, files in self.walk(root)
+                for name in files if file_kind(name) == kind
+            ]
+        return self._lookups[key]
+
+    def sessions(self, root):
+        """
+        One record per recording under root: patient ID, EC/PD_OFF/PD_ON state, session type,
+        the filter options (see filter_file_path) it matches for each group, and the paths
+        of the gaze, pupil and video files in its export folder.
+        """
+        key = ('sessions', os.path.normpath(root))
+        if key not in self._lookups:
+            # Imported here because pupil_diameter itself uses the catalog
+            from pupil_diameter import filter_file_path
+            records = []
+            for directory, _, files in self.walk(root):
+                kinds = {}
+                for name in files:
+                    kind = file_kind(name)
+                    if kind in ('gaze', 'pupil', 'video'):
+                        kinds.setdefault(kind, {})[name] = os.path.join(directory, name)
+                if 'pupil' not in kinds and 'gaze' not in kinds:
+                    continue
+                records.append({
+                    'directory': directory,
+                    'patient_id': patient_id_from_path(os.path.join(directory, '')),
+                    'state': patient_state(directory),
+                    'session_type': session_type(directory),
+                    'filter_options': {
+                        group: [option for option in FILTER_OPTIONS
+                                if filter_file_path(directory, identifier, option)]
+                        for group, identifier in GROUP_IDENTIFIERS.items()
+                    },
+                    'gaze_files': kinds.get('gaze', {}),
+                    'pupil_files': kinds.get('pupil', {}),
+                    'video_files': kinds.get('video', {}),
+                })
+            self._lookups[key] = records
+        return self._lookups[key]
+
+    def pupil_files(self, folders, group_name, filter_option, max_patients=10):
+        """
+        The (file_path, patient_id) pairs that process_patient_data used to collect with os.walk:
+        the first pupil_positions.csv of every patient that matches the group and filter option.
+        """
+        return self.pupil_file_partitions(folders, group_name, [filter_option], max_patients)[filter_option]
+
+    def pupil_file_partitions(self, folders, group_name, filter_options=FILTER_OPTIONS, max_patients=10):
+        """
+        pupil_files for several filter options from one pass over the folders.
+        Every file is classified once and goes to each option it matches (a RESH_DT session
+        matches option 3 as well as option 4).
+
+        Returns:
+        - Dictionary {filter_option: [(file_path, patient_id), ...]}
+        """
+        folder_list = folders if isinstance(folders, list) else [folders]
+        key = ('pupil', tuple(os.path.normpath(f) for f in folder_list), group_name, tuple(filter_options), max_patients)
+        if key in self._lookups:
+            return self._lookups[key]
+
+        from pupil_diameter import filter_file_path
+        group_identifier = GROUP_IDENTIFIERS.get(group_name, 'EC')
+        partitions = {option: [] for option in filter_options}
+        processed_patients = {option: set() for option in filter_options}
+        # rows_in: pupil files seen, rows_out: (file, option) pairs selected
+        with stage('discovery', file=';'.join(folder_list)) as record:
+            for folder in folder_list:
+                for root, dirs, files in self.walk(folder):
+                    # options that reached max_patients in this directory (the break of the old loop)
+                    full_options = set()
+                    for file in files:
+                        if file in PUPIL_FILES:
+                            record.add(rows_in=1)
+                            file_path = os.path.join(root, file)
+                            options = [option for option in filter_options if option not in full_options
+                                       and filter_file_path(file_path, group_identifier, option)]
+                            if not options:
+                                continue
+                            patient_id = patient_id_from_path(file_path)
+                            for option in options:
+                                if patient_id and patient_id not in processed_patients[option]:
+                                    partitions[option].append((file_path, patient_id))
+                                    processed_patients[option].add(patient_id)
+                                    record.add(rows_out=1)
+                                    if len(partitions[option]) >= max_patients:
+                                        full_options.add(option)
+        self._lookups[key] = partitions
+        return partitions
+
+    def patient_folder(self, gaze_folder, patient_id):
+        """ The entry of gaze_folder whose name contains the patient ID (ignoring '-' / '_'), or None. """
+        key = ('patient_folder', os.path.normpath(gaze_folder), patient_id)
+        if key not in self._lookups:
+            names = self.listdir(gaze_folder)
+            normalized_id = normalize_patient_id(patient_id)
+            folder = next((f for f in names if normalized_id in normalize_patient_id(f)), None)
+            if not folder:
+                folder = next((f for f in names if patient_id in f), None)
+            self._lookups[key] = folder
+        return self._lookups[key]
+
+    def find_file(self, folder, file_name):
+        """ The first file called file_name under folder, in os.walk order, or None. """
+        key = ('find_file', os.path.normpath(folder), file_name)
+        if key not in self._lookups:
+            self._lookups[key] = next(
+                (os.path.join(root, file_name) for root, _, files in self.walk(folder) if file_name in files),
+                None
+            )
+        return self._lookups[key]
+
+    def find_patient_file(self, gaze_folder, patient_id, file_name='gaze_positions_new.csv'):
+        """ Looks up the patient's folder in gaze_folder and the first file_name inside it. """
+        patient_folder = self.patient_folder(gaze_folder, patient_id)
+        if not patient_folder:
+            return None
+        return self.find_file(os.path.join(gaze_folder, patient_folder), file_name)
+
+    def find_video(self, data_directory, participant_code, video_name='world.mp4'):
+        """ The first video_name under a folder of data_directory whose name contains the participant code. """
+        key = ('video', os.path.normpath(data_directory), participant_code, video_name)
+        if key not in self._lookups:
+            video_path = None
+            for root, dirs, _ in self.walk(data_directory):
+                for directory in dirs:
+                    if participant_code in directory:
+                        video_path = self.find_file(os.path.join(root, directory), video_name)
+                        if video_path:
+                            break
+                if video_path:
+                    break
+            self._lookups[key] = video_path
+        return self._lookups[key]
+
+
+def load_partitions(partitions, load, loaded=None):
+    """
+    Loads the files of pupil_file_partitions, each file once however many options it belongs to.
+
+    Parameters:
+    - partitions: Dictionary {filter_option: [(file_path, patient_id), ...]}
+    - load: Function reading one file, e.g. lambda file_path: read_session(file_path, ...)
+    - loaded: Dictionary {file_path: data} to share the loaded files between calls (e.g. between groups)
+
+    Returns:
+    - Dictionary {filter_option: [(file_path, patient_id, data), ...]}
+    """
+    loaded = {} if loaded is None else loaded
+    routed = {}
+    for option, patient_files in partitions.items():
+        routed[option] = []
+        for file_path, patient_id in patient_files:
+            if file_path not in loaded:
+                with stage('load', patient=patient_id, file=file_path):
+                    loaded[file_path] = load(file_path)
+            routed[option].append((file_path, patient_id, loaded[file_path]))
+    return routed
+
+
+_catalog = None
+
+
+def get_catalog():
+    """ The process wide catalog, loaded from CATALOG_FILE on first use. """
+    global _catalog
+    if _catalog is None:
+        _catalog = SessionCatalog()
+    return _catalog
+
+
+def main():
+    # Folders to index
+    data_folders = ['D:\\EC', 'D:\\PD', r'D:\annotations', r"C:\Users\shach\Documents\Shachar's_Thesis1\preproccesing_data\data"]
+
+    catalog = get_catalog()
+    for folder in data_folders:
+        catalog.refresh(folder)
+        sessions = catalog.sessions(folder)
+        print(f"{folder}: {len(sessions)} sessions, {len(catalog.files(folder, 'annotation'))} annotation files")
+    catalog.save()
+    print(f"Catalog saved to: {catalog.catalog_file}")
+
+
+if __name__ == "__main__":
+    main()
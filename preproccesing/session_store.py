@@ -0,0 +1,127 @@
+import os
+import pandas as pd
+from instrumentation import file_size, stage
+
+# The Pupil Labs exports that the analysis scripts read again and again.
+# Each one is converted once into a typed Parquet file that sits next to the CSV
+# (gaze_positions.csv -> gaze_positions.parquet), so later runs only read the
+# columns they need instead of re-parsing the whole text file.
+EXPORT_FILES = ['gaze_positions.csv', 'gaze_positions_new.csv', 'pupil_positions.csv']
+STORE_SUFFIX = '.parquet'
+
+
+def store_path(csv_path):
+    """ Returns the path of the columnar copy of a CSV export. """
+    return os.path.splitext(csv_path)[0] + STORE_SUFFIX
+
+
+def is_fresh(csv_path):
+    """ True if the columnar copy exists and is not older than the CSV it was made from. """
+    parquet_path = store_path(csv_path)
+    if not os.path.exists(parquet_path):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)
+
+
+def ingest_csv(csv_path, force=False):
+    """ Converts one CSV export into a typed Parquet file next to it. Returns the Parquet path. """
+    parquet_path = store_path(csv_path)
+    if not force and is_fresh(csv_path):
+        return parquet_path
+
+    df = pd.read_csv(csv_path, low_memory=False)
+
+    # Columns with mixed values (the reason the scripts use low_memory=False) are kept as text
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].astype('string')
+
+    # Write to a temporary file first so an interrupted ingest never leaves a half written store
+    tmp_path = parquet_path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, parquet_path)
+    return parquet_path
+
+
+def _available_columns(csv_path, parquet_path):
+    if parquet_path:
+        import pyarrow.parquet as pq
+        return pq.read_schema(parquet_path).names
+    return pd.read_csv(csv_path, nrows=0).columns.tolist()
+
+
+def read_session(csv_path, columns=None):
+    """
+    Load a Pupil Labs export, reading only the requested columns.
+
+    Parameters:
+    - csv_path: Path of the original CSV export (e.g. .../gaze_positions_new.csv)
+    - columns: List of column names to load, or None for all columns. Columns that
+      the file does not have are left out, so callers can keep checking
+      `'confidence' in df.columns` as before.
+
+    The Parquet copy is used when it is up to date; otherwise the CSV is parsed.
+    """
+    with stage('read', file=csv_path) as record:
+        parquet_path = store_path(csv_path) if is_fresh(csv_path) else None
+
+        if columns is not None:
+            available = set(_available_columns(csv_path, parquet_path))
+            columns = [column for column in columns if column in available]
+
+        if parquet_path:
+            df = pd.read_parquet(parquet_path, columns=columns)
+        else:
+            df = pd.read_csv(csv_path, usecols=columns, low_memory=False)
+        record.add(rows_out=len(df), bytes_read=file_size(parquet_path or csv_path))
+    return df
+
+
+def iter_session_chunks(csv_path, columns=None, chunksize=1_000_000):
+    """
+    Same as read_session but yields the export in DataFrames of at most chunksize rows, for files
+    too large to load whole.
+    """
+    parquet_path = store_path(csv_path) if is_fresh(csv_path) else None
+
+    if columns is not None:
+        available = set(_available_columns(csv_path, parquet_path))
+        columns = [column for column in columns if column in available]
+
+    if parquet_path:
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(csv_path, usecols=columns, low_memory=False, chunksize=chunksize)
+
+
+def ingest_folder(root_dir, file_names=EXPORT_FILES, force=False):
+    """ Walks a data folder and converts every Pupil Labs export found into the columnar store. """
+    converted = 0
+    for root, dirs, files in os.walk(root_dir):
+        for file in files:
+            if file in file_names:
+                csv_path = os.path.join(root, file)
+                try:
+                    if force or not is_fresh(csv_path):
+                        ingest_csv(csv_path, force=True)
+                        converted += 1
+                        print(f"Ingested: {csv_path}")
+                except Exception as e:
+                    print(f"Skipping file {csv_path}: {e}")
+    return converted
+
+
+def main():
+    # Folders containing the Pupil Labs exports
+    data_folders = ['D:\\EC', 'D:\\PD', r"C:\Users\shach\Documents\Shachar's_Thesis1\preproccesing_data\data"]
+
+    for folder in data_folders:
+        converted = ingest_folder(folder)
+        print(f"{converted} files converted in {folder}")
+
+
+if __name__ == "__main__":
+    main()
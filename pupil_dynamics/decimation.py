@@ -0,0 +1,146 @@
+import base64
+import numpy as np
+
+# Shape-preserving downsampling of long traces for the interactive plots.
+# A spectrum of a long recording has tens of thousands of bins; drawing every one of them makes
+# the HTML files large and the browser slow, while a plot is only a few thousand pixels wide.
+# Both methods return the indices of the points to keep, so the same selection can be applied
+# to the x and y values (and the first and last points are always kept).
+#   min_max_indices - the smallest and largest value of every bin, so no peak is lost
+#   lttb_indices    - Largest-Triangle-Three-Buckets, the point of every bucket that keeps the
+#                     largest triangle with its neighbours; closer to the look of the full trace
+# full_resolution_script embeds the full trace in the HTML file as base64 float32 and swaps in the
+# visible part (min/max decimated again in the browser) whenever the x axis is zoomed or panned.
+MAX_PLOT_POINTS = 2000
+
+# Placeholders __VALUES__, __X_START__, __X_STEP__ and __MAX_POINTS__ are filled in by full_resolution_script;
+# plotly replaces {plot_id} with the id of the plot
+FULL_RESOLUTION_SCRIPT = """
+var gd = document.getElementById('{plot_id}');
+var raw = atob('__VALUES__');
+var bytes = new Uint8Array(raw.length);
+for (var i = 0; i < raw.length; i++) { bytes[i] = raw.charCodeAt(i); }
+var values = new Float32Array(bytes.buffer);
+var xStart = __X_START__, xStep = __X_STEP__, maxPoints = __MAX_POINTS__;
+function visibleTrace(x0, x1) {
+    var first = Math.max(0, Math.floor((x0 - xStart) / xStep));
+    var last = Math.min(values.length, Math.ceil((x1 - xStart) / xStep) + 1);
+    var xs = [], ys = [], binSize = Math.max(1, Math.ceil(2 * (last - first) / maxPoints));
+    for (var start = first; start < last; start += binSize) {
+        var end = Math.min(last, start + binSize), low = start, high = start;
+        for (var j = start; j < end; j++) {
+            if (values[j] < values[low]) { low = j; }
+            if (values[j] > values[high]) { high = j; }
+        }
+        var picked = low === high ? [low] : [Math.min(low, high), Math.max(low, high)];
+        for (var k = 0; k < picked.length; k++) {
+            xs.push(xStart + picked[k] * xStep);
+            ys.push(values[picked[k]]);
+        }
+    }
+    return [xs, ys];
+}
+gd.on('plotly_relayout', function (event) {
+    var range;
+    if (event['xaxis.range[0]'] !== undefined) { range = [event['xaxis.range[0]'], event['xaxis.range[1]']]; }
+    else if (event['xaxis.range']) { range = event['xaxis.range']; }
+    else if (event['xaxis.autorange']) { range = [xStart, xStart + values.length * xStep]; }
+    else { return; }
+    var trace = visibleTrace(range[0], range[1]);
+    Plotly.restyle(gd, {x: [trace[0]], y: [trace[1]]}, [0]);
+});
+"""
+
+
+def min_max_indices(y, max_points=MAX_PLOT_POINTS):
+    """
+    Indices of the minimum and maximum of y in bins of equal length.
+
+    Parameters:
+    - y: 1D array of values
+    - max_points: Upper bound on the number of indices returned
+
+    Returns:
+    - Sorted array of indices, all of them if y has at most max_points values
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+
+    # Two points per bin, and room for the first and last point
+    bin_size = int(np.ceil(n / max(1, (max_points - 2) // 2)))
+    bins = int(np.ceil(n / bin_size))
+    padded = np.full(bins * bin_size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(bins, bin_size)
+    # NaN values (padding or missing data) are never picked unless the whole bin is NaN
+    filled_low = np.where(np.isnan(padded), np.inf, padded)
+    filled_high = np.where(np.isnan(padded), -np.inf, padded)
+    offsets = np.arange(bins) * bin_size
+    indices = np.concatenate(([0, n - 1], offsets + filled_low.argmin(axis=1), offsets + filled_high.argmax(axis=1)))
+    return np.unique(indices[indices < n])
+
+
+def lttb_indices(x, y, max_points=MAX_PLOT_POINTS):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps.
+
+    Parameters:
+    - x: 1D array of increasing x values
+    - y: 1D array of values, the same length as x
+    - max_points: Number of points to keep (at least 3)
+
+    Returns:
+    - Sorted array of indices, all of them if y has at most max_points values
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+
+    # The first and last points are kept; the others are split into max_points - 2 buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    selected = 0
+    for bucket in range(max_points - 2):
+        first, last = edges[bucket], edges[bucket + 1]
+        # The third corner is the mean of the next bucket (the last point for the last bucket)
+        if bucket + 2 < len(edges):
+            next_x = x[last:edges[bucket + 2]].mean()
+            next_y = y[last:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        areas = np.abs((x[selected] - next_x) * (y[first:last] - y[selected])
+                       - (x[selected] - x[first:last]) * (next_y - y[selected]))
+        selected = first + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return indices
+
+
+def full_resolution_script(y, x_step, x_start=0.0, max_points=MAX_PLOT_POINTS):
+    """
+    The post_script for plotly's write_html that redraws the first trace of the plot at full
+    resolution on zoom.
+
+    Parameters:
+    - y: All values of the trace, at x = x_start + i * x_step
+    - x_step, x_start: Spacing and first x value (e.g. the frequency resolution of a spectrum)
+    - max_points: Points drawn for the visible range
+    """
+    values = base64.b64encode(np.asarray(y, dtype='<f4').tobytes()).decode('ascii')
+    return (FULL_RESOLUTION_SCRIPT.replace('__VALUES__', values).replace('__X_START__', repr(float(x_start)))
+            .replace('__X_STEP__', repr(float(x_step))).replace('__MAX_POINTS__', str(int(max_points))))
+
+
+def decimate(x, y, max_points=MAX_PLOT_POINTS, method='minmax'):
+    """ The (x, y) values of a trace reduced to at most max_points points with 'minmax' or 'lttb'. """
+    if method == 'minmax':
+        indices = min_max_indices(y, max_points)
+    elif method == 'lttb':
+        indices = lttb_indices(x, y, max_points)
+    else:
+        raise ValueError(f"Unknown decimation method: {method}")
+    return np.asarray(x)[indices], np.asarray(y)[indices]
@@ -3,158 +3,242 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
-from pupil_diameter import filter_file_path
-from scipy.integrate import simpson  # For numerical integration using Simpson's rule
-
+from decimation import MAX_PLOT_POINTS, decimate, full_resolution_script
+from instrumentation import stage
+from parallel import report_failures, run_parallel
+from patient_signal import GroupSignals, PatientSignal
+from session_catalog import FILTER_OPTIONS, get_catalog, load_partitions
+from session_store import read_session
+from spectral_bands import magnitude_spectra, spectrum_area_table  # batched rfft and Simpson band areas
+
+# How perform_interactive_fft_analysis writes the per-patient plots:
+#   'light' - the trace decimated to MAX_PLOT_POINTS points, the full spectrum embedded compactly and
+#             drawn on zoom, and one plotly.min.js per output folder that all the plots share
+#   'full'  - every bin, with plotly.js embedded in every file (the original standalone files)
+#   'skip'  - no plots, when only the numeric reports are needed
+HTML_MODES = ('light', 'full', 'skip')
+
+
+def load_diameters(file_path):
+    """ The pupil diameters with confidence >= 0.7 of one file, or None if it has no confidence column. """
+    df = read_session(file_path, columns=['confidence', 'diameter'])
+
+    # Keep the samples where confidence >= 0.7
+    if 'confidence' not in df.columns:
+        print(f"Warning: 'confidence' column missing in {file_path}. Skipping this file.")
+        return None
+    with stage('filter', file=file_path) as record:
+        confidence = df['confidence'].to_numpy(dtype=float)
+        diameters = df['diameter'].to_numpy(dtype=float)[confidence >= 0.7]
+        record.add(rows_in=len(df), rows_out=len(diameters))
+    return diameters
+
+
+def process_patient_data_by_option(folders, group_name, filter_options=FILTER_OPTIONS, max_patients=10, loaded=None):
+    """
+    Load the pupil diameters of the group's patients for several filter options at once.
+    The sessions are classified in one pass and every file is read once, even when it matches
+    more than one option.
 
-def process_patient_data(folders, group_name, filter_option, max_patients=10):
-    patient_files = []
-    processed_patients = set()
-    group_identifier = 'ON' if group_name == 'PD_ON' else 'OFF' if group_name == 'PD_OFF' else 'EC'
+    Parameters:
+    - loaded: Dictionary {file_path: diameters} shared between calls, so files are not read again
 
+    Returns:
+    - Dictionary {filter_option: GroupSignals with one PatientSignal per file}
+    """
     # Handle multiple folders for 'PD_ON', single for other groups
-    folder_list = folders if isinstance(folders, list) else [folders]
-    for folder in folder_list:
-        for root, dirs, files in os.walk(folder):
-            for file in files:
-                if file == 'pupil_positions.csv':
-                    file_path = os.path.join(root, file)
-                    if filter_file_path(file_path, group_identifier, filter_option):
-                        parts = file_path.split(os.sep)
-                        ec_index = parts.index("PD") if "PD" in parts else parts.index("EC")
-                        patient_id = parts[ec_index + 1] if ec_index != -1 and ec_index + 1 < len(parts) else None
-                        if patient_id and patient_id not in processed_patients:
-                            patient_files.append(file_path)
-                            processed_patients.add(patient_id)
-                            if len(patient_files) >= max_patients:
-                                break
-
-    # List to store processed data
-    data = []
-
-    for file_path in patient_files:
-        df = pd.read_csv(file_path)
-
-        # Filter rows where confidence >= 0.7
-        if 'confidence' in df.columns:
-            df = df[df['confidence'] >= 0.7]
-        else:
-            print(f"Warning: 'confidence' column missing in {file_path}. Skipping this file.")
-            continue
+    partitions = get_catalog().pupil_file_partitions(folders, group_name, filter_options, max_patients)
 
-        # Extract patient ID
-        parts = file_path.split(os.sep)
-        ec_index = parts.index("PD") if "PD" in parts else parts.index("EC")
-        patient_id = parts[ec_index + 1] if ec_index != -1 and ec_index + 1 < len(parts) else None
+    data = {}
+    for filter_option, patient_files in load_partitions(partitions, load_diameters, loaded).items():
+        data[filter_option] = GroupSignals(group_name)
+        for file_path, patient_id, diameters in patient_files:
+            if diameters is not None:
+                data[filter_option].append(PatientSignal(patient_id, group_name, diameters, file_path))
+    return data
 
-        # Append each valid sample as a row in the final dataset
-        for _, row in df.iterrows():
-            data.append({
-                'Patient_ID': patient_id,
-                'Group': group_name,
-                'Pupil_Diameter': row['diameter']
-            })
 
-    return pd.DataFrame(data)
+def process_patient_data(folders, group_name, filter_option, max_patients=10):
+    """
+    Load the pupil diameters (confidence >= 0.7) of the group's patients.
 
+    Returns:
+    - GroupSignals with one PatientSignal per file
+    """
+    return process_patient_data_by_option(folders, group_name, [filter_option], max_patients)[filter_option]
 
 
-def get_pupil_diameter(ec_folder, pd_folder, pd_on_paths, filter_option):
+def get_pupil_diameter_by_option(ec_folder, pd_folder, pd_on_paths, filter_options=FILTER_OPTIONS):
+    """ {filter_option: (ec_data, pd_off_data, pd_on_data)}, reading every file once. """
+    loaded = {}
     # Process EC data
-    ec_data = process_patient_data(ec_folder, 'EC', filter_option)
+    ec_data = process_patient_data_by_option(ec_folder, 'EC', filter_options, loaded=loaded)
 
     # Process PD_OFF data
-    pd_off_data = process_patient_data(pd_folder, 'PD_OFF', filter_option)
+    pd_off_data = process_patient_data_by_option(pd_folder, 'PD_OFF', filter_options, loaded=loaded)
 
     # Process PD_ON data
-    pd_on_data = pd.concat([process_patient_data(folder, 'PD_ON', filter_option) for folder in pd_on_paths], ignore_index=True)
+    pd_on_folders = [process_patient_data_by_option(folder, 'PD_ON', filter_options, loaded=loaded)
+                     for folder in pd_on_paths]
+
+    return {
+        filter_option: (ec_data[filter_option], pd_off_data[filter_option],
+                        GroupSignals.concat([folder_data[filter_option] for folder_data in pd_on_folders], 'PD_ON'))
+        for filter_option in filter_options
+    }
+
+
+def get_pupil_diameter(ec_folder, pd_folder, pd_on_paths, filter_option):
+    return get_pupil_diameter_by_option(ec_folder, pd_folder, pd_on_paths, [filter_option])[filter_option]
+
+
+def patient_signals(data):
+    """ The (patient_id, pupil diameters) of every patient of a GroupSignals with valid pupil diameter data. """
+    signals = []
+    for patient in data.by_patient():
+        pupil_sizes = patient.valid_values()
+        if len(pupil_sizes) == 0:
+            print(f"No valid pupil diameter data for patient {patient.patient_id}, skipping...")
+            continue
+        signals.append((patient.patient_id, pupil_sizes))
+    return signals
+
+
+def compute_fft_results(datasets, pad_to_fast_length=False):
+    """
+    FFT of every patient of every dataset in one batched pass.
+
+    Parameters:
+    - datasets: Dictionary {key: GroupSignals}, e.g. one entry per (filter option, group)
+    - pad_to_fast_length: Zero-pad the signals to a fast FFT length (see magnitude_spectra)
+
+    Returns:
+    - Dictionary {key: list of tuples containing (patient_id, magnitude, n_fft)}, where magnitude is
+      the one-sided (rfft) magnitude spectrum in float32 and n_fft the length of the transform
+    """
+    signals = {key: patient_signals(data) for key, data in datasets.items()}
+    all_signals = [pupil_sizes for key in signals for _, pupil_sizes in signals[key]]
+    with stage('fft') as record:
+        spectra = iter(magnitude_spectra(all_signals, pad_to_fast_length=pad_to_fast_length))
+        record.add(rows_in=sum(len(pupil_sizes) for pupil_sizes in all_signals), rows_out=len(all_signals))
+    return {key: [(patient_id,) + next(spectra) for patient_id, _ in signals[key]] for key in signals}
+
+
+def write_fft_plot(patient_id, group_name, fft_magnitude, n_fft, output_dir, fs=120, html='light'):
+    """
+    Saves the interactive plotly plot of one patient's spectrum ('light' or 'full', see HTML_MODES).
+    Returns the path of the HTML file.
+    """
+    frequencies = np.fft.rfftfreq(n_fft, d=1 / fs)[:n_fft // 2]
+    magnitudes = fft_magnitude[:n_fft // 2]
+    if html == 'light':
+        # Peaks are kept by the min/max decimation, the rest is drawn when zooming in
+        frequencies, magnitudes = decimate(frequencies, magnitudes, MAX_PLOT_POINTS)
+
+    # Create interactive plot
+    fig = go.Figure()
+
+    # Add FFT trace
+    fig.add_trace(go.Scatter(
+        x=frequencies,
+        y=magnitudes,
+        name='Amplitude',
+        line=dict(color='blue', width=2)
+    ))
+
+    # Update layout with title and axes labels
+    fig.update_layout(
+        title=f"FFT of Pupil Size for Patient {patient_id} ({group_name})",
+        xaxis_title="Frequency (Hz)",
+        yaxis_title="Amplitude",
+        showlegend=True,
+        hovermode='x',
+        # Add buttons for predefined zoom levels
+        updatemenus=[
+            dict(
+                type="buttons",
+                direction="right",
+                x=0.1,
+                y=1.1,
+                buttons=[
+                    dict(label="Full View",
+                         method="relayout",
+                         args=[{"xaxis.range": [0, fs / 2]}]),
+                    dict(label="0-10 Hz",
+                         method="relayout",
+                         args=[{"xaxis.range": [0, 10]}]),
+                    dict(label="0-5 Hz",
+                         method="relayout",
+                         args=[{"xaxis.range": [0, 5]}]),
+                    dict(label="0-1 Hz",
+                         method="relayout",
+                         args=[{"xaxis.range": [0, 1]}]),
+                ]
+            )
+        ]
+    )
 
-    return ec_data, pd_off_data, pd_on_data
+    # Add grid
+    fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
+    fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
+
+    # Save the interactive plot as HTML
+    plot_path = os.path.join(output_dir, f"Interactive_FFT_{patient_id}_{group_name}.html")
+    with stage('plot', patient=patient_id, file=plot_path) as record:
+        if html == 'light':
+            fig.write_html(plot_path, include_plotlyjs='directory',
+                           post_script=full_resolution_script(fft_magnitude[:n_fft // 2], fs / n_fft))
+        else:
+            fig.write_html(plot_path)
+        record.add(rows_in=n_fft // 2, rows_out=len(magnitudes))
+    print(f"Interactive FFT plot saved for Patient {patient_id}: {plot_path}")
+    return plot_path
 
 
-def perform_interactive_fft_analysis(data, output_dir):
+def write_plotly_bundle(output_dir):
+    """ Writes the plotly.min.js that the 'light' plots of a folder share, unless it is there already. """
+    bundle_path = os.path.join(output_dir, 'plotly.min.js')
+    if not os.path.exists(bundle_path):
+        from plotly.offline import get_plotlyjs
+        tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(get_plotlyjs())
+        os.replace(tmp_path, bundle_path)
+    return bundle_path
+
+
+def perform_interactive_fft_analysis(data, output_dir, fft_results=None, workers=None, html='light'):
     """
     Perform FFT analysis for each patient and save interactive plots using plotly.
+    The plots are written in parallel (see parallel.run_parallel).
 
     Parameters:
-    - data: DataFrame containing columns 'Patient_ID', 'Group', 'Pupil_Diameter'
+    - data: GroupSignals of the group's patients
     - output_dir: Directory to save the interactive HTML plots
+    - fft_results: The spectra of data from compute_fft_results; computed here if not given
+    - workers: Number of processes writing the plots, None for all cores
+    - html: 'light', 'full' or 'skip' (see HTML_MODES)
     """
-    # Group the data by Patient_ID
-    grouped_data = data.groupby('Patient_ID')
-    patient_ids = data['Patient_ID'].unique()
-    fft_results = []
-
-    # Iterate through each patient
-    for patient_id, patient_data in grouped_data:
-        # Extract pupil diameter values for the current patient
-        pupil_sizes = patient_data['Pupil_Diameter'].dropna().values
-        if len(pupil_sizes) == 0:
-            print(f"No valid pupil diameter data for patient {patient_id}, skipping...")
-            continue
+    if html not in HTML_MODES:
+        raise ValueError(f"Unknown html mode {html}, expected one of {HTML_MODES}")
+    patient_ids = data.patient_ids
+    if fft_results is None:
+        fft_results = compute_fft_results({'data': data})['data']
+    if html == 'skip':
+        return fft_results, patient_ids
+    patient_groups = {patient.patient_id: patient.group_name for patient in data.by_patient()}
+
+    # Sampling frequency (Hz)
+    fs = 120
+
+    # The shared bundle is written before the workers start, so they do not all copy it
+    if html == 'light':
+        write_plotly_bundle(output_dir)
 
-        # Get the group of the current patient
-        group_name = patient_data['Group'].iloc[0]
-
-        # Sampling frequency (Hz)
-        fs = 120
-
-        # Perform FFT
-        fft_result = np.fft.fft(pupil_sizes)
-        frequencies = np.fft.fftfreq(len(pupil_sizes), d=1 / fs)
-        fft_results.append((patient_id, fft_result))
-
-        # Create interactive plot
-        fig = go.Figure()
-
-        # Add FFT trace
-        fig.add_trace(go.Scatter(
-            x=frequencies[:len(frequencies) // 2],
-            y=np.abs(fft_result)[:len(fft_result) // 2],
-            name='Amplitude',
-            line=dict(color='blue', width=2)
-        ))
-
-        # Update layout with title and axes labels
-        fig.update_layout(
-            title=f"FFT of Pupil Size for Patient {patient_id} ({group_name})",
-            xaxis_title="Frequency (Hz)",
-            yaxis_title="Amplitude",
-            showlegend=True,
-            hovermode='x',
-            # Add buttons for predefined zoom levels
-            updatemenus=[
-                dict(
-                    type="buttons",
-                    direction="right",
-                    x=0.1,
-                    y=1.1,
-                    buttons=[
-                        dict(label="Full View",
-                             method="relayout",
-                             args=[{"xaxis.range": [0, fs / 2]}]),
-                        dict(label="0-10 Hz",
-                             method="relayout",
-                             args=[{"xaxis.range": [0, 10]}]),
-                        dict(label="0-5 Hz",
-                             method="relayout",
-                             args=[{"xaxis.range": [0, 5]}]),
-                        dict(label="0-1 Hz",
-                             method="relayout",
-                             args=[{"xaxis.range": [0, 1]}]),
-                    ]
-                )
-            ]
-        )
-
-        # Add grid
-        fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
-        fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGray')
-
-        # Save the interactive plot as HTML
-        plot_path = os.path.join(output_dir, f"Interactive_FFT_{patient_id}_{group_name}.html")
-        fig.write_html(plot_path)
-        print(f"Interactive FFT plot saved for Patient {patient_id}: {plot_path}")
+    # One plot per patient
+    tasks = [(patient_id, patient_groups[patient_id], fft_magnitude, n_fft, output_dir, fs, html)
+             for patient_id, fft_magnitude, n_fft in fft_results]
+    report_failures(run_parallel(write_fft_plot, tasks, workers, label='FFT plots'), label='FFT plots')
     return fft_results, patient_ids
 
 def make_report_file(fft_results_ec, fft_results_pd_off, fft_results_pd_on,
@@ -165,105 +249,108 @@ def make_report_file(fft_results_ec, fft_results_pd_off, fft_results_pd_on,
     # Create lists for group averages results
     group_averages = []
     # Process EC results
-    fft_magnitudes_ec = np.abs(fft_results_ec[1][1])[:len(fft_results_ec[1][1]) // 2]
+    fft_magnitudes_ec = fft_results_ec[1][1][:fft_results_ec[1][2] // 2]
     group_averages.append({
         'Condition': 'EC',
-        'FFT_Mean': np.mean(fft_magnitudes_ec),
-        'FFT_STD': np.std(fft_magnitudes_ec)
+        'FFT_Mean': np.mean(fft_magnitudes_ec, dtype=np.float64),
+        'FFT_STD': np.std(fft_magnitudes_ec, dtype=np.float64)
     })
     # Process PD OFF results
-    fft_magnitudes_pd_off = np.abs(fft_results_pd_off[1][1])[:len(fft_results_pd_off[1][1]) // 2]
+    fft_magnitudes_pd_off = fft_results_pd_off[1][1][:fft_results_pd_off[1][2] // 2]
     group_averages.append({
         'Condition': 'PD_OFF',
-        'FFT_Mean': np.mean(fft_magnitudes_pd_off),
-        'FFT_STD': np.std(fft_magnitudes_pd_off)
+        'FFT_Mean': np.mean(fft_magnitudes_pd_off, dtype=np.float64),
+        'FFT_STD': np.std(fft_magnitudes_pd_off, dtype=np.float64)
     })
     # Process PD ON results
-    fft_magnitudes_pd_on = np.abs(fft_results_pd_on[1][1])[:len(fft_results_pd_on[1][1]) // 2]
+    fft_magnitudes_pd_on = fft_results_pd_on[1][1][:fft_results_pd_on[1][2] // 2]
     group_averages.append({
         'Condition': 'PD_ON',
-        'FFT_Mean': np.mean(fft_magnitudes_pd_on),
-        'FFT_STD': np.std(fft_magnitudes_pd_on)
+        'FFT_Mean': np.mean(fft_magnitudes_pd_on, dtype=np.float64),
+        'FFT_STD': np.std(fft_magnitudes_pd_on, dtype=np.float64)
     })
 
     # Create lists for individual results
     # TODO: check and debug this part
     individual_results = []
     for fft_result in fft_results_ec:
-        fft_magnitude = np.abs(fft_result[1])[: len(fft_result[1])//2]
+        fft_magnitude = fft_result[1][:fft_result[2] // 2]
         individual_results.append({
             'Patient_ID': fft_result[0],
             'Condition': 'EC',
-            'FFT_Mean': np.mean(fft_magnitude),
-            'FFT_STD': np.std(fft_magnitude)
+            'FFT_Mean': np.mean(fft_magnitude, dtype=np.float64),
+            'FFT_STD': np.std(fft_magnitude, dtype=np.float64)
         })
     for fft_result in fft_results_pd_off:
-        fft_magnitude = np.abs(fft_result[1])[: len(fft_result[1])//2]
+        fft_magnitude = fft_result[1][:fft_result[2] // 2]
         individual_results.append({
             'Patient_ID': fft_result[0],
             'Condition': 'PD_OFF',
-            'FFT_Mean': np.mean(fft_magnitude),
-            'FFT_STD': np.std(fft_magnitude)
+            'FFT_Mean': np.mean(fft_magnitude, dtype=np.float64),
+            'FFT_STD': np.std(fft_magnitude, dtype=np.float64)
         })
     for fft_result in fft_results_pd_on:
-        fft_magnitude = np.abs(fft_result[1])[: len(fft_result[1])//2]
+        fft_magnitude = fft_result[1][:fft_result[2] // 2]
         individual_results.append({
             'Patient_ID': fft_result[0],
             'Condition': 'PD_ON',
-            'FFT_Mean': np.mean(fft_magnitude),
-            'FFT_STD': np.std(fft_magnitude)
+            'FFT_Mean': np.mean(fft_magnitude, dtype=np.float64),
+            'FFT_STD': np.std(fft_magnitude, dtype=np.float64)
         })
     # create an excel file with 2 sheets: individual results and group averages
     output_file = os.path.join(output_dir, f'fft_results_report{filter_option}.xlsx')
-    with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+    with stage('excel_write', file=output_file) as record, pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
         # Write individual results
         df_individual = pd.DataFrame(individual_results)
         df_individual.to_excel(writer, sheet_name='Individual Results', index=False)
         # Write group averages
         df_group = pd.DataFrame(group_averages)
         df_group.to_excel(writer, sheet_name='Group Averages', index=False)
+        record.add(rows_out=len(df_individual) + len(df_group))
 
 
-def calculate_area_under_fft(fft_results, patient_ids, frequency_range, output_dir, group_name):
+def build_area_tables(fft_results, fs=120):
+    """
+    Precompute the prefix-sum tables of every patient's spectrum once, so the area of any
+    frequency range is answered without going over the spectrum again.
+
+    Returns:
+    - List of tuples containing (patient_id, BandAreaTable)
+    """
+    with stage('integration') as record:
+        tables = [(patient_id, spectrum_area_table(fft_magnitude, n_fft, fs)) for patient_id, fft_magnitude, n_fft in fft_results]
+        record.add(rows_in=len(fft_results))
+    return tables
+
+
+def calculate_area_under_fft(fft_results, patient_ids, frequency_range, output_dir, group_name, area_tables=None):
     """
     Calculate the area under the FFT graph for the specified frequency range.
     Save the results for all patients into a new Excel file with two sheets.
 
     Parameters:
-    - fft_results: List of tuples containing (patient_id, fft_result)
+    - fft_results: List of tuples containing (patient_id, fft_magnitude, n_fft)
     - patient_ids: List of patient IDs
     - frequency_range: Tuple specifying the frequency range (e.g., (0, 0.1))
     - output_dir: Directory to save the Excel file
     - group_name: Group name for the patients (e.g., 'EC', 'PD_ON', 'PD_OFF')
+    - area_tables: Output of build_area_tables(fft_results); built here if not given
     """
     # Sampling frequency
     fs = 120
+    if area_tables is None:
+        area_tables = build_area_tables(fft_results, fs)
 
     # Create a list to store individual results
     individual_results = []
 
-    for patient_id, fft_result in fft_results:
-        # Get absolute FFT values and frequencies
-        fft_magnitude = np.abs(fft_result)
-        frequencies = np.fft.fftfreq(len(fft_magnitude), d=1 / fs)
-
-        # Filter the frequencies in the specified range
-        mask = (frequencies >= frequency_range[0]) & (frequencies <= frequency_range[1])
-        filtered_frequencies = frequencies[mask]
-        filtered_magnitude = fft_magnitude[mask]
-
-        if len(filtered_frequencies) == 0:
+    for patient_id, area_table in area_tables:
+        if not area_table.has_data([frequency_range])[0]:
             print(f"Warning: No data points found in the frequency range {frequency_range} for patient {patient_id}")
             area = 0
         else:
-            # Calculate the area under the curve using Simpson's rule
-            area = simpson(y=filtered_magnitude, x=filtered_frequencies)
-            # Normalize the area to be between 0 and 1
-            max_possible_area = simpson(
-                y=np.ones_like(filtered_frequencies) * np.max(filtered_magnitude),
-                x=filtered_frequencies
-            )
-            area = area / max_possible_area if max_possible_area > 0 else 0
+            # Area under the curve using Simpson's rule, normalized to be between 0 and 1
+            area = area_table.normalized_areas([frequency_range])[0]
 
 
         # Append the result to the list
@@ -302,11 +389,12 @@ def makefile_area_under_fft_combined(df_dict, output_dir, frequency_range, filte
     output_file = os.path.join(output_dir, f"fft_area_results_{frequency_range}_report_combined{filter_option}.xlsx")
 
     # Save to Excel
-    with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+    with stage('excel_write', file=output_file) as record, pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
         # Write combined individual results
         combined_individuals.to_excel(writer, sheet_name='All Individuals', index=False)
         # Write combined statistics
         combined_statistics.to_excel(writer, sheet_name='All Statistics', index=False)
+        record.add(rows_out=len(combined_individuals) + len(combined_statistics))
 
     print(f"Combined area under FFT curve results saved to: {output_file}")
 
@@ -316,33 +404,28 @@ def analyze_mean_pupil_diameter(data_group, group_name):
     Calculate mean pupil diameter across all patients for each time point.
 
     Parameters:
-    - data_group: DataFrame containing pupil diameter data for one group
+    - data_group: GroupSignals containing pupil diameter data for one group
     - group_name: Name of the group (EC, PD_ON, or PD_OFF)
 
     Returns:
     - mean_values: Array of mean pupil diameter values
-    - fft_result: FFT of mean values
-    - n_points: Length of the FFT result
+    - fft_magnitude: One-sided magnitude spectrum of the mean values
+    - n_points: Length of the FFT
     """
     # Group by Patient_ID to get equal number of samples from each patient
-    grouped = data_group.groupby('Patient_ID')
-    min_length = grouped.size().min()
+    patients = data_group.by_patient()
+    min_length = min(len(patient) for patient in patients)
 
     # Get the first min_length samples for each patient
-    aligned_data = []
-    for _, patient_data in grouped:
-        aligned_data.append(patient_data['Pupil_Diameter'].iloc[:min_length].values)
-
-    # Convert to numpy array for efficient computation
-    aligned_array = np.array(aligned_data)
+    aligned_array = np.vstack([patient.values[:min_length] for patient in patients])
 
     # Calculate mean across patients for each time point
     mean_values = np.mean(aligned_array, axis=0)
 
     # Perform FFT on mean values
-    fft_result = np.fft.fft(mean_values)
+    fft_magnitude, n_points = magnitude_spectra([mean_values])[0]
 
-    return mean_values, fft_result, len(mean_values)
+    return mean_values, fft_magnitude, n_points
 
 
 def plot_group_means(ec_data, pd_off_data, pd_on_data, output_dir, filter_option):
@@ -350,11 +433,11 @@ def plot_group_means(ec_data, pd_off_data, pd_on_data, output_dir, filter_option
     Create interactive plot comparing mean pupil diameter FFT across groups.
 
     Parameters:
-    - ec_data, pd_off_data, pd_on_data: DataFrames for each group
+    - ec_data, pd_off_data, pd_on_data: GroupSignals for each group
     - output_dir: Directory to save the output files
 
     Returns:
-    - Dictionary containing FFT results and frequencies for each group
+    - Dictionary containing the one-sided FFT magnitudes, frequencies and FFT length for each group
     """
     # Calculate mean values and FFT for each group
     ec_mean, ec_fft, ec_len = analyze_mean_pupil_diameter(ec_data, 'EC')
@@ -365,9 +448,9 @@ def plot_group_means(ec_data, pd_off_data, pd_on_data, output_dir, filter_option
     fs = 120
 
     # Calculate frequencies for each group
-    ec_freqs = np.fft.fftfreq(ec_len, d=1 / fs)
-    pd_off_freqs = np.fft.fftfreq(pd_off_len, d=1 / fs)
-    pd_on_freqs = np.fft.fftfreq(pd_on_len, d=1 / fs)
+    ec_freqs = np.fft.rfftfreq(ec_len, d=1 / fs)
+    pd_off_freqs = np.fft.rfftfreq(pd_off_len, d=1 / fs)
+    pd_on_freqs = np.fft.rfftfreq(pd_on_len, d=1 / fs)
 
     # Create interactive plot
     fig = go.Figure()
@@ -375,21 +458,21 @@ def plot_group_means(ec_data, pd_off_data, pd_on_data, output_dir, filter_option
     # Add traces for each group (only plotting positive frequencies)
     fig.add_trace(go.Scatter(
         x=ec_freqs[:ec_len // 2],
-        y=np.abs(ec_fft)[:ec_len // 2],
+        y=ec_fft[:ec_len // 2],
         name='EC',
         line=dict(color='blue', width=2)
     ))
 
     fig.add_trace(go.Scatter(
         x=pd_off_freqs[:pd_off_len // 2],
-        y=np.abs(pd_off_fft)[:pd_off_len // 2],
+        y=pd_off_fft[:pd_off_len // 2],
         name='PD OFF',
         line=dict(color='red', width=2)
     ))
 
     fig.add_trace(go.Scatter(
         x=pd_on_freqs[:pd_on_len // 2],
-        y=np.abs(pd_on_fft)[:pd_on_len // 2],
+        y=pd_on_fft[:pd_on_len // 2],
         name='PD ON',
         line=dict(color='green', width=2)
     ))
@@ -451,22 +534,22 @@ def calculate_group_mean_areas(fft_results, frequency_ranges, output_dir, filter
     """
     results = []
 
-    for freq_range in frequency_ranges:
+    # Sampling frequency
+    fs = 120
+
+    # Prefix-sum tables of every group mean spectrum, built once for all frequency ranges
+    area_tables = {group_name: spectrum_area_table(group_data['fft'], group_data['length'], fs)
+                   for group_name, group_data in fft_results.items()}
+    all_group_areas = {group_name: area_table.areas(frequency_ranges)
+                       for group_name, area_table in area_tables.items()}
+
+    for range_index, freq_range in enumerate(frequency_ranges):
         group_areas = {}
 
         # Calculate area for each group
-        for group_name, group_data in fft_results.items():
-            freqs = group_data['freqs']
-            fft_vals = group_data['fft']
-
-            # Get indices for the frequency range
-            mask = (freqs >= freq_range[0]) & (freqs <= freq_range[1])
-            freq_filtered = freqs[mask]
-            fft_filtered = np.abs(fft_vals[mask])
-
-            # Calculate area
-            if len(freq_filtered) > 0:
-                area = simpson(y=fft_filtered, x=freq_filtered)
+        for group_name, area_table in area_tables.items():
+            if area_table.has_data([freq_range])[0]:
+                area = all_group_areas[group_name][range_index]
             else:
                 area = 0
                 print(f"Warning: No data points in range {freq_range} for group {group_name}")
@@ -487,7 +570,9 @@ def calculate_group_mean_areas(fft_results, frequency_ranges, output_dir, filter
     # Create DataFrame and save to Excel
     df_results = pd.DataFrame(results)
     output_file = os.path.join(output_dir, f'group_mean_fft_areas{filter_option}.xlsx')
-    df_results.to_excel(output_file, index=False)
+    with stage('excel_write', file=output_file) as record:
+        df_results.to_excel(output_file, index=False)
+        record.add(rows_out=len(df_results))
 
     return df_results
 
@@ -502,29 +587,55 @@ def main():
     # Frequency range to calculate area
     frequency_ranges = [(0, 0.1), (0.1, 0.5), (0.5, 1), (1, 5), (5, 10)]
 
-    # Get data for each group
-    for i in range(1,5):
-        filter_option = i
-        ec_data, pd_off_data, pd_on_data = get_pupil_diameter(ec_folder, pd_folder, pd_on_paths, filter_option)
+    filter_options = FILTER_OPTIONS
+    # Per-patient plots: 'light', 'full' or 'skip' (see HTML_MODES)
+    html_mode = 'light'
+
+    # Get data for each group, for all filter options from one read of every file
+    datasets = {}
+    group_data = get_pupil_diameter_by_option(ec_folder, pd_folder, pd_on_paths, filter_options)
+    for filter_option in filter_options:
+        ec_data, pd_off_data, pd_on_data = group_data[filter_option]
+        datasets[(filter_option, 'EC')] = ec_data
+        datasets[(filter_option, 'PD_OFF')] = pd_off_data
+        datasets[(filter_option, 'PD_ON')] = pd_on_data
+
+    # FFT of all patients of all filter options and groups in one batched pass
+    all_fft_results = compute_fft_results(datasets)
+
+    for filter_option in filter_options:
+        ec_data = datasets[(filter_option, 'EC')]
+        pd_off_data = datasets[(filter_option, 'PD_OFF')]
+        pd_on_data = datasets[(filter_option, 'PD_ON')]
         print("Plotting group means and calculating areas...")
         # fft_results = plot_group_means(ec_data, pd_off_data, pd_on_data, output_dir, filter_option)
         # df_group_areas = calculate_group_mean_areas(fft_results, frequency_ranges, output_dir, filter_option)
 
 
         # # Perform interactive FFT analysis for each group
-        fft_results_ec, patients_id_ec = perform_interactive_fft_analysis(ec_data, output_dir)
-        fft_results_pd_off, patients_id_pd_off =perform_interactive_fft_analysis(pd_off_data, output_dir)
-        fft_results_pd_on, patients_id_pd_on =perform_interactive_fft_analysis(pd_on_data, output_dir)
+        fft_results_ec, patients_id_ec = perform_interactive_fft_analysis(
+            ec_data, output_dir, all_fft_results[(filter_option, 'EC')], html=html_mode)
+        fft_results_pd_off, patients_id_pd_off = perform_interactive_fft_analysis(
+            pd_off_data, output_dir, all_fft_results[(filter_option, 'PD_OFF')], html=html_mode)
+        fft_results_pd_on, patients_id_pd_on = perform_interactive_fft_analysis(
+            pd_on_data, output_dir, all_fft_results[(filter_option, 'PD_ON')], html=html_mode)
         make_report_file(fft_results_ec, fft_results_pd_off, fft_results_pd_on,
                          patients_id_ec, patients_id_pd_off, patients_id_pd_on, output_dir, filter_option)
 
 
         # Calculate areas and save results
+        # The spectrum tables are built once per group and reused for every frequency range
+        area_tables_ec = build_area_tables(fft_results_ec)
+        area_tables_pd_off = build_area_tables(fft_results_pd_off)
+        area_tables_pd_on = build_area_tables(fft_results_pd_on)
 
         for frequency in frequency_ranges:
-            df_ec, ec_statistics = calculate_area_under_fft(fft_results_ec, patients_id_ec, frequency, output_dir, 'EC')
-            df_pd_off, pd_off_statistics = calculate_area_under_fft(fft_results_pd_off, patients_id_pd_off, frequency, output_dir, 'PD_OFF')
-            df_pd_on, pd_on_statistics = calculate_area_under_fft(fft_results_pd_on, patients_id_pd_on, frequency, output_dir, 'PD_ON')
+            df_ec, ec_statistics = calculate_area_under_fft(fft_results_ec, patients_id_ec, frequency, output_dir, 'EC',
+                                                            area_tables_ec)
+            df_pd_off, pd_off_statistics = calculate_area_under_fft(fft_results_pd_off, patients_id_pd_off, frequency,
+                                                                    output_dir, 'PD_OFF', area_tables_pd_off)
+            df_pd_on, pd_on_statistics = calculate_area_under_fft(fft_results_pd_on, patients_id_pd_on, frequency,
+                                                                  output_dir, 'PD_ON', area_tables_pd_on)
             # Combine all groups into a dictionary
             df_dict = {
                 'EC': (df_ec, ec_statistics),
@@ -1,42 +1,85 @@
 import os
 import pandas as pd
 import numpy as np
-
-def process_gaze_file(file_path, value_column):
-    df = pd.read_csv(file_path, low_memory=False)
-    total_rows = len(df)
-    low_confidence_rows = len(df[df['confidence'] <= 0.7])
-
-    # Count rows outside the range [0,1]
-    out_range_count = len(df[(df[value_column] < 0) | (df[value_column] > 1)])
+from running_stats import RunningStats
+from session_catalog import get_catalog
+from session_store import iter_session_chunks
+
+# Value type of the report -> gaze column
+VALUE_COLUMNS = {'y': 'norm_pos_y', 'x': 'norm_pos_x'}
+CONFIDENCE_THRESHOLD = 0.7
+
+
+def new_axis_stats():
+    """ Empty accumulators of one gaze column. """
+    return {
+        'total_rows': 0,
+        'out_range_count': 0,
+        'in_range_count': 0,
+        'low_confidence_in_range': 0,
+        'below': RunningStats(),
+        'above': RunningStats(),
+    }
+
+
+def update_axis_stats(stats, values, confidence):
+    """ Adds one chunk of a gaze column (and the matching confidence values) to its accumulators. """
+    stats['total_rows'] += len(values)
+
+    # Values outside the range [0,1] are counted and left out of the statistics
+    stats['out_range_count'] += int(np.count_nonzero((values < 0) | (values > 1)))
+    in_range = (values >= 0) & (values <= 1)
+    below = in_range & (confidence <= CONFIDENCE_THRESHOLD)
+    above = in_range & (confidence > CONFIDENCE_THRESHOLD)
+
+    stats['in_range_count'] += int(np.count_nonzero(in_range))
+    stats['low_confidence_in_range'] += int(np.count_nonzero(below))
+    stats['below'].update(values[below])
+    stats['above'].update(values[above])
+
+
+def gaze_file_statistics(file_path, value_columns=tuple(VALUE_COLUMNS.values()), chunksize=1_000_000):
+    """
+    Statistics of all gaze columns of one file in a single read. The file is read chunk by chunk,
+    so its size is not limited by memory.
+
+    Returns:
+    - Dictionary {value_column: accumulators (see new_axis_stats)}
+    """
+    statistics = {value_column: new_axis_stats() for value_column in value_columns}
+    for chunk in iter_session_chunks(file_path, columns=['confidence'] + list(value_columns), chunksize=chunksize):
+        confidence = chunk['confidence'].to_numpy(dtype=float)
+        for value_column in value_columns:
+            update_axis_stats(statistics[value_column], chunk[value_column].to_numpy(dtype=float), confidence)
+    return statistics
+
+
+def axis_results(stats):
+    """ The values process_gaze_file returns, from the accumulators of one gaze column. """
+    total_rows = stats['total_rows']
+    out_range_count = stats['out_range_count']
     out_of_range_percentage = (out_range_count / total_rows) * 100 if total_rows > 0 else np.nan
+    in_range_count = stats['in_range_count']
+    percentage_in_range = (stats['low_confidence_in_range'] / in_range_count) * 100 if in_range_count > 0 else np.nan
 
-    # Filter data to exclude values outside the range [0,1]
-    df_in_range = df[(df[value_column] >= 0) & (df[value_column] <= 1)]
+    below_threshold, above_threshold = stats['below'], stats['above']
+    return (total_rows, out_range_count, out_of_range_percentage, percentage_in_range,
+            below_threshold.mean, below_threshold.std(), above_threshold.mean, above_threshold.std(),
+            below_threshold.min, below_threshold.max, above_threshold.min, above_threshold.max)
 
-    low_confidence_rows_in_range = len(df_in_range[df_in_range['confidence'] <= 0.7])
-    percentage_in_range = (low_confidence_rows_in_range / len(df_in_range)) * 100 if len(df_in_range) > 0 else np.nan
 
-    below_threshold = df_in_range[df_in_range['confidence'] <= 0.7][value_column]
-    above_threshold = df_in_range[df_in_range['confidence'] > 0.7][value_column]
-
-    mean_below = below_threshold.mean()
-    std_below = below_threshold.std()
-
-    mean_above = above_threshold.mean()
-    std_above = above_threshold.std()
+def process_gaze_file(file_path, value_column):
+    return axis_results(gaze_file_statistics(file_path, [value_column])[value_column])
 
-    min_below = below_threshold.min()
-    max_below = below_threshold.max()
 
-    min_above = above_threshold.min()
-    max_above = above_threshold.max()
+def process_all_files_in_folder(gaze_folder, output_folder, value_column):
+    return process_all_files_in_folder_axes(gaze_folder, [value_column])[value_column]
 
-    return total_rows, out_range_count, out_of_range_percentage, percentage_in_range, mean_below, std_below, mean_above, std_above, min_below, max_below, min_above, max_above
 
-def process_all_files_in_folder(gaze_folder, output_folder, value_column):
-    results = []
-    for root, dirs, files in os.walk(gaze_folder):
+def process_all_files_in_folder_axes(gaze_folder, value_columns):
+    """ The results table of every gaze column, reading each gaze_positions.csv once. """
+    results = {value_column: [] for value_column in value_columns}
+    for root, dirs, files in get_catalog().walk(gaze_folder):
         if 'gaze_positions.csv' in files:
             file_path = os.path.join(root, 'gaze_positions.csv')
 
@@ -63,32 +106,34 @@ def process_all_files_in_folder(gaze_folder, output_folder, value_column):
                 continue  # Skip if patient ID or state can't be determined
 
             patient_id_state = f"{patient_id}_{state}"
-            (total_rows, out_range_count, out_of_range_percentage, percentage_in_range, mean_below, std_below, mean_above, std_above, min_below, max_below,
-             min_above, max_above) = process_gaze_file(file_path, value_column)
-            results.append({
-                'Patient_ID_State_below_or_above': f"{patient_id_state}_below0.7",
-                'Low_Confidence_Percentage': percentage_in_range,
-                'Mean': mean_below,
-                'Std': std_below,
-                'Min': min_below,
-                'Max': max_below,
-                'Total_Rows': total_rows,
-                'out_range_count': out_range_count,
-                'out_of_range_percentage': out_of_range_percentage
-            })
-            results.append({
-                'Patient_ID_State_below_or_above': f"{patient_id_state}_above0.7",
-                'Low_Confidence_Percentage': percentage_in_range,
-                'Mean': mean_above,
-                'Std': std_above,
-                'Min': min_above,
-                'Max': max_above,
-                'Total_Rows': total_rows,
-                'out_range_count': out_range_count,
-                'out_of_range_percentage': out_of_range_percentage
-            })
-
-    return pd.DataFrame(results)
+            statistics = gaze_file_statistics(file_path, value_columns)
+            for value_column in value_columns:
+                (total_rows, out_range_count, out_of_range_percentage, percentage_in_range, mean_below, std_below, mean_above, std_above, min_below, max_below,
+                 min_above, max_above) = axis_results(statistics[value_column])
+                results[value_column].append({
+                    'Patient_ID_State_below_or_above': f"{patient_id_state}_below0.7",
+                    'Low_Confidence_Percentage': percentage_in_range,
+                    'Mean': mean_below,
+                    'Std': std_below,
+                    'Min': min_below,
+                    'Max': max_below,
+                    'Total_Rows': total_rows,
+                    'out_range_count': out_range_count,
+                    'out_of_range_percentage': out_of_range_percentage
+                })
+                results[value_column].append({
+                    'Patient_ID_State_below_or_above': f"{patient_id_state}_above0.7",
+                    'Low_Confidence_Percentage': percentage_in_range,
+                    'Mean': mean_above,
+                    'Std': std_above,
+                    'Min': min_above,
+                    'Max': max_above,
+                    'Total_Rows': total_rows,
+                    'out_range_count': out_range_count,
+                    'out_of_range_percentage': out_of_range_percentage
+                })
+
+    return {value_column: pd.DataFrame(rows) for value_column, rows in results.items()}
 
 # Function to extract the group names based on filename patterns
 def extract_group(filename):
@@ -162,11 +207,10 @@ def main():
     gaze_folder = r"C:\Users\shach\Documents\Shachar's_Thesis1\preproccesing_data\data"
     output_folder = r"C:\Users\shach\Documents\Shachar-s_Thesis2\results\confidence"
 
-    results_y_df = process_all_files_in_folder(gaze_folder, output_folder, 'norm_pos_y')
-    create_excel_report(results_y_df, output_folder, 'y')
-
-    results_x_df = process_all_files_in_folder(gaze_folder, output_folder, 'norm_pos_x')
-    create_excel_report(results_x_df, output_folder, 'x')
+    # Both axes from one read of every gaze file
+    results = process_all_files_in_folder_axes(gaze_folder, list(VALUE_COLUMNS.values()))
+    for value_type, value_column in VALUE_COLUMNS.items():
+        create_excel_report(results[value_column], output_folder, value_type)
 
 if __name__ == "__main__":
     main()
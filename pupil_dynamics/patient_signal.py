@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+# Array-backed containers for the pupil diameter recordings of a group.
+# A group used to be a long DataFrame with one row (Patient_ID, Group, Pupil_Diameter) per sample,
+# built from one Python dict per sample and grouped by patient again by every stage. Here every
+# patient keeps one contiguous float array, so a group costs about as much memory as its samples.
+
+
+class PatientSignal:
+    """
+    The pupil diameters of one patient recording.
+
+    Parameters:
+    - patient_id: Patient ID
+    - group_name: Group of the patient (e.g., 'EC', 'PD_ON', 'PD_OFF')
+    - values: The pupil diameter samples, in recording order
+    - source: Path of the file the samples were read from
+    """
+
+    def __init__(self, patient_id, group_name, values, source=None):
+        self.patient_id = patient_id
+        self.group_name = group_name
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.source = source
+
+    def __len__(self):
+        return len(self.values)
+
+    def valid_values(self):
+        """ The samples without the missing (NaN) diameters. """
+        return self.values[~np.isnan(self.values)]
+
+
+class GroupSignals:
+    """ The PatientSignal of every recording of one group, in load order. """
+
+    def __init__(self, group_name, signals=None):
+        self.group_name = group_name
+        self.signals = list(signals) if signals else []
+
+    @classmethod
+    def concat(cls, groups, group_name=None):
+        """ One GroupSignals with the recordings of all groups, one after the other. """
+        groups = list(groups)
+        if group_name is None:
+            group_name = groups[0].group_name if groups else None
+        return cls(group_name, [signal for group in groups for signal in group.signals])
+
+    def append(self, signal):
+        self.signals.append(signal)
+
+    def __iter__(self):
+        return iter(self.signals)
+
+    def __len__(self):
+        return len(self.signals)
+
+    @property
+    def patient_ids(self):
+        """ The patient IDs in order of first appearance, like data['Patient_ID'].unique(). """
+        return list(dict.fromkeys(signal.patient_id for signal in self.signals))
+
+    @property
+    def n_samples(self):
+        return sum(len(signal) for signal in self.signals)
+
+    def by_patient(self):
+        """
+        One PatientSignal per patient, sorted by patient ID as groupby('Patient_ID') gives them.
+        Recordings of the same patient (e.g. from two PD_ON folders) are joined in load order, and
+        recordings without a patient ID are left out.
+        """
+        recordings = {}
+        for signal in self.signals:
+            if signal.patient_id is not None:
+                recordings.setdefault(signal.patient_id, []).append(signal)
+
+        patients = []
+        for patient_id in sorted(recordings):
+            signals = recordings[patient_id]
+            values = signals[0].values if len(signals) == 1 else np.concatenate([s.values for s in signals])
+            patients.append(PatientSignal(patient_id, signals[0].group_name, values, signals[0].source))
+        return patients
+
+    def to_frame(self):
+        """ The long format DataFrame with the 'Patient_ID', 'Group' and 'Pupil_Diameter' columns. """
+        lengths = [len(signal) for signal in self.signals]
+        return pd.DataFrame({
+            'Patient_ID': np.repeat(np.array([signal.patient_id for signal in self.signals], dtype=object), lengths),
+            'Group': np.repeat(np.array([signal.group_name for signal in self.signals], dtype=object), lengths),
+            'Pupil_Diameter': np.concatenate([signal.values for signal in self.signals]) if self.signals else [],
+        })
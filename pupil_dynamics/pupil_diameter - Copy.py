@@ -1,5 +1,7 @@
 import os
 import pandas as pd
+from session_catalog import get_catalog
+from session_store import read_session
 
 def filter_file_path(file_path, group_identifier, option):
     file_path_upper = file_path.upper()
@@ -26,30 +28,13 @@ def filter_file_path(file_path, group_identifier, option):
     return False
 
 def process_patient_data(folders, group_name, max_patients=10, filter_option=1):
-    patient_files = []
-    processed_patients = set()
-    group_identifier = 'ON' if group_name == 'PD_ON' else 'OFF' if group_name == 'PD_OFF' else 'EC'
-
     # Handle multiple folders for 'PD_ON', single for other groups
-    folder_list = folders if isinstance(folders, list) else [folders]
-    for folder in folder_list:
-        for root, dirs, files in os.walk(folder):
-            for file in files:
-                if file == 'pupil_positions.csv':
-                    file_path = os.path.join(root, file)
-                    if filter_file_path(file_path, group_identifier, filter_option):
-                        parts = file_path.split(os.sep)
-                        ec_index = parts.index("PD") if "PD" in parts else parts.index("EC")
-                        patient_id = parts[ec_index + 1] if ec_index != -1 and ec_index + 1 < len(parts) else None
-                        if patient_id and patient_id not in processed_patients:
-                            patient_files.append(file_path)
-                            processed_patients.add(patient_id)
-                            if len(patient_files) >= max_patients:
-                                break
+    patient_files = [file_path for file_path, patient_id in
+                     get_catalog().pupil_files(folders, group_name, filter_option, max_patients)]
 
     data = []
     for file_path in patient_files:
-        df = pd.read_csv(file_path)
+        df = read_session(file_path, columns=['confidence', 'diameter'])
         below_07 = df[df['confidence'] < 0.7]['diameter']
         above_07 = df[df['confidence'] >= 0.7]['diameter']
         parts = file_path.split(os.sep)
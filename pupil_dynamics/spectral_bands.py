@@ -0,0 +1,163 @@
+import numpy as np
+from scipy.fft import next_fast_len
+
+# Band areas of a magnitude spectrum in O(1) per band.
+# The spectrum of a patient (or of a group mean) is turned once into prefix-sum tables; the area
+# of any frequency band is then a handful of lookups instead of a mask + simpson over the whole
+# spectrum. The areas are the same as scipy.integrate.simpson(y=magnitude[mask], x=frequencies[mask])
+# on the evenly spaced FFT frequencies, including scipy's correction for an even number of points.
+
+
+def magnitude_spectra(signals, pad_to_fast_length=False, dtype=np.float32, batch_size=64):
+    """
+    One-sided magnitude spectra |rfft| of many real signals.
+
+    Signals with the same FFT length are stacked and transformed as one 2-D batch. With
+    pad_to_fast_length every signal is zero-padded to scipy's next fast length, so more signals
+    share a batch and each transform is faster (the frequency grid then follows the padded length).
+
+    Parameters:
+    - signals: List of 1-D arrays
+    - pad_to_fast_length: Zero-pad every signal to next_fast_len(len(signal))
+    - dtype: dtype of the stored magnitudes (float32 halves the memory of the spectra)
+    - batch_size: Maximum number of signals transformed together
+
+    Returns:
+    - List of tuples containing (magnitude, n_fft), in the order of signals
+    """
+    n_ffts = [next_fast_len(len(signal), real=True) if pad_to_fast_length else len(signal) for signal in signals]
+    spectra = [None] * len(signals)
+
+    batches = {}
+    for index, n_fft in enumerate(n_ffts):
+        batches.setdefault(n_fft, []).append(index)
+
+    for n_fft, indices in batches.items():
+        for batch_start in range(0, len(indices), batch_size):
+            batch_indices = indices[batch_start:batch_start + batch_size]
+            batch = np.zeros((len(batch_indices), n_fft))
+            for row, index in enumerate(batch_indices):
+                batch[row, :len(signals[index])] = signals[index]
+            magnitudes = np.abs(np.fft.rfft(batch, axis=1)).astype(dtype)
+            for row, index in enumerate(batch_indices):
+                spectra[index] = (magnitudes[row], n_fft)
+    return spectra
+
+
+def spectrum_area_table(magnitude, n_fft, fs=120):
+    """
+    BandAreaTable over the non-negative frequencies of a one-sided spectrum of an n_fft point FFT.
+    The Nyquist bin of an even n_fft is left out, as np.fft.fftfreq puts it at -fs/2.
+    """
+    n_positive = (n_fft - 1) // 2 + 1
+    return BandAreaTable(magnitude[:n_positive], np.fft.rfftfreq(n_fft, d=1 / fs)[:n_positive])
+
+
+def band_grid(width, step, max_frequency, min_frequency=0):
+    """ Sliding bands [(f, f + width), ...] every `step` Hz up to max_frequency. """
+    starts = np.arange(min_frequency, max_frequency - width + step / 2, step)
+    return [(float(start), float(start + width)) for start in starts]
+
+
+class BandAreaTable:
+    """
+    Prefix sums over one magnitude spectrum.
+
+    Parameters:
+    - magnitude: Magnitude spectrum
+    - frequencies: The matching frequencies, evenly spaced and increasing (e.g. np.fft.rfftfreq)
+    """
+
+    def __init__(self, magnitude, frequencies):
+        self.magnitude = np.asarray(magnitude, dtype=np.float64)
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.step = self.frequencies[1] - self.frequencies[0] if len(self.frequencies) > 1 else 0.0
+
+        # prefix_by_parity[p][k] = sum of magnitude[j] for j < k with j % 2 == p
+        even = np.where(np.arange(len(self.magnitude)) % 2 == 0, self.magnitude, 0.0)
+        odd = self.magnitude - even
+        self.prefix_by_parity = np.stack([
+            np.concatenate(([0.0], np.cumsum(even))),
+            np.concatenate(([0.0], np.cumsum(odd))),
+        ])
+
+        # Sparse table for the maximum of any index range
+        self.max_table = [self.magnitude]
+        width = 1
+        while 2 * width <= len(self.magnitude):
+            previous = self.max_table[-1]
+            self.max_table.append(np.maximum(previous[:-width], previous[width:]))
+            width *= 2
+
+    def index_range(self, bands):
+        """ First and last spectrum index inside every (low, high) band; last < first for empty bands. """
+        bands = np.asarray(bands, dtype=np.float64).reshape(-1, 2)
+        first = np.searchsorted(self.frequencies, bands[:, 0], side='left')
+        last = np.searchsorted(self.frequencies, bands[:, 1], side='right') - 1
+        return first, last
+
+    def _parity_sum(self, start, stop, parity):
+        """ Sum of magnitude[j] for start <= j < stop with j % 2 == parity (arrays). """
+        table = self.prefix_by_parity
+        return table[parity, stop] - table[parity, start]
+
+    def _odd_simpson(self, first, last):
+        """ Composite Simpson over first..last where last - first is even (0 for a single point). """
+        y = self.magnitude
+        inner_start = np.minimum(first + 1, last)
+        odd_positions = self._parity_sum(inner_start, last, (first + 1) % 2)
+        even_positions = self._parity_sum(inner_start, last, first % 2)
+        total = y[first] + y[last] + 4 * odd_positions + 2 * even_positions
+        return np.where(last > first, self.step / 3 * total, 0.0)
+
+    def areas(self, bands):
+        """ Area under the spectrum for every (low, high) band, as simpson() would give it. """
+        first, last = self.index_range(bands)
+        count = last - first + 1
+        if len(self.magnitude) == 0:
+            return np.zeros(len(first))
+        first = np.clip(first, 0, len(self.magnitude) - 1)
+        last = np.clip(last, 0, len(self.magnitude) - 1)
+        y, h = self.magnitude, self.step
+
+        # Odd number of points: plain composite Simpson
+        odd_area = self._odd_simpson(first, np.where(count % 2 == 1, last, last - 1))
+
+        # Even number of points: Simpson on all but the last interval plus the correction for the
+        # last interval (the uniform spacing form of the one scipy uses)
+        last_minus_2 = np.maximum(last - 2, 0)
+        correction = 5 * h / 12 * y[last] + 2 * h / 3 * y[last - 1] - h / 12 * y[last_minus_2]
+        even_area = odd_area + correction
+        two_points = h / 2 * (y[first] + y[last])
+
+        area = np.where(count % 2 == 1, odd_area, np.where(count == 2, two_points, even_area))
+        return np.where(count >= 2, area, 0.0)
+
+    def maxima(self, bands):
+        """ Largest magnitude inside every band (0 for empty bands). """
+        first, last = self.index_range(bands)
+        count = last - first + 1
+        result = np.zeros(len(first))
+        for i in np.flatnonzero(count > 0):
+            level = int(np.log2(count[i]))
+            table = self.max_table[level]
+            result[i] = max(table[first[i]], table[last[i] - (1 << level) + 1])
+        return result
+
+    def normalized_areas(self, bands):
+        """
+        Area divided by the area of a flat spectrum at the band maximum, as calculate_area_under_fft does.
+        Simpson is exact for a constant, so that area is max * (last frequency - first frequency).
+        """
+        first, last = self.index_range(bands)
+        areas = self.areas(bands)
+        count = last - first + 1
+        span = np.where(count >= 2, self.step * (last - first), 0.0)
+        max_possible = self.maxima(bands) * span
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(max_possible > 0, areas / max_possible, 0.0)
+
+    def has_data(self, bands):
+        """ True for the bands that contain at least one frequency bin. """
+        first, last = self.index_range(bands)
+        return last >= first
@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from instrumentation import stage
+from parallel import report_failures, run_parallel
+from session_catalog import FILTER_OPTIONS, get_catalog, session_type
+from session_store import read_session
+from spectral_bands import magnitude_spectra, spectrum_area_table
+
+# Spectral features of the pupil diameter, computed once per session and kept on disk for the
+# classifiers, sweeps and reports, which then read a few KB per session instead of the raw samples.
+# For every session (and every window of it) the store holds:
+#   - the Simpson area, normalized area and share of the power of every frequency range, computed
+#     as in fft_pupil_size - Copy.py (confidence >= min_confidence samples, magnitude spectrum)
+#   - the dominant frequency and the normalized spectral entropy (without the DC bin)
+#   - the mean confidence and the share of low-confidence samples, at min_confidence and at the
+#     thresholds of confidence_level - Copy.py
+# Layout of the store:
+#   <store_dir>/v<FEATURE_VERSION>/<parameters hash>/index.json    parameters and one entry per session
+#   <store_dir>/v<FEATURE_VERSION>/<parameters hash>/<session>.parquet
+# A session's file is written again only when its pupil_positions.csv changed (size or mtime);
+# other parameters, or a new FEATURE_VERSION, go to a folder of their own.
+# The windows are cut by pupil_timestamp: pupil_positions.csv has a row per eye per sample, so a
+# number of rows is not a duration.
+FEATURE_VERSION = 2
+INDEX_FILE = 'index.json'
+GROUP_LABELS = {'EC': 0, 'PD_OFF': 1, 'PD_ON': 2}
+SESSION_WINDOW = -1
+DEFAULT_PARAMS = {
+    'fs': 120,
+    'frequency_ranges': [(0, 0.1), (0.1, 0.5), (0.5, 1), (1, 5), (5, 10)],
+    'min_confidence': 0.7,
+    'confidence_thresholds': [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8],
+    # Windows of window_seconds every stride_seconds of pupil_timestamp; a window needs
+    # min_window_fraction of its samples above min_confidence to get spectral features
+    'window_seconds': 30,
+    'stride_seconds': 15,
+    'min_window_fraction': 0.5,
+}
+
+
+def feature_params(**overrides):
+    """ DEFAULT_PARAMS with the given values replaced, in the JSON form the store keys on. """
+    unknown = set(overrides) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown feature parameters: {sorted(unknown)}")
+    params = dict(DEFAULT_PARAMS, **overrides)
+    return json.loads(json.dumps(params))
+
+
+def store_folder(store_dir, params=None):
+    """ The folder of the store that holds the features of these parameters. """
+    params = feature_params() if params is None else params
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(store_dir, f"v{FEATURE_VERSION}", key)
+
+
+def session_file_name(file_path):
+    return hashlib.sha1(os.path.normpath(file_path).encode('utf-8')).hexdigest()[:16] + '.parquet'
+
+
+def source_key(file_path):
+    """ Size and mtime of a session file, which its stored features have to match to be reused. """
+    stat = os.stat(file_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def band_name(frequency_range):
+    low, high = frequency_range
+    return f"{low:g}-{high:g}Hz"
+
+
+def feature_columns(params=None):
+    """ The feature columns of the store, in order. """
+    params = feature_params() if params is None else params
+    bands = [band_name(frequency_range) for frequency_range in params['frequency_ranges']]
+    return ([f"area_{band}" for band in bands] + [f"norm_area_{band}" for band in bands]
+            + [f"power_{band}" for band in bands] + ['dominant_frequency', 'spectral_entropy']
+            + ['confidence_mean', 'low_confidence_ratio']
+            + [f"low_confidence_{threshold:g}" for threshold in params['confidence_thresholds']])
+
+
+def spectrum_features(magnitude, n_fft, params):
+    """
+    Band and shape features of one magnitude spectrum (see magnitude_spectra).
+
+    Returns:
+    - Dictionary {column: value} with the area_, norm_area_ and power_ columns of every band,
+      dominant_frequency and spectral_entropy
+    """
+    fs = params['fs']
+    bands = params['frequency_ranges']
+    table = spectrum_area_table(magnitude, n_fft, fs)
+    features = {}
+    for name, values in (('area', table.areas(bands)), ('norm_area', table.normalized_areas(bands))):
+        for frequency_range, value in zip(bands, values):
+            features[f"{name}_{band_name(frequency_range)}"] = float(value)
+
+    # Power spectrum without the DC bin, which only holds the mean diameter
+    power = table.magnitude[1:] ** 2
+    frequencies = table.frequencies[1:]
+    total = power.sum()
+    for low, high in bands:
+        in_band = (frequencies >= low) & (frequencies <= high)
+        features[f"power_{band_name((low, high))}"] = float(power[in_band].sum() / total) if total > 0 else 0.0
+    if total > 0 and len(power) > 1:
+        p = power / total
+        p = p[p > 0]
+        features['dominant_frequency'] = float(frequencies[np.argmax(power)])
+        features['spectral_entropy'] = float(-(p * np.log(p)).sum() / np.log(len(power)))
+    else:
+        features['dominant_frequency'] = np.nan
+        features['spectral_entropy'] = np.nan
+    return features
+
+
+def confidence_features(confidence, params):
+    """ Mean confidence and the share of samples below min_confidence and at or below every threshold. """
+    confidence = confidence[~np.isnan(confidence)]
+    features = {'confidence_mean': float(confidence.mean()) if len(confidence) else np.nan,
+                'low_confidence_ratio': float((confidence < params['min_confidence']).mean()) if len(confidence) else np.nan}
+    # Same definition as confidence_level - Copy.py (confidence <= threshold)
+    sorted_confidence = np.sort(confidence)
+    low_counts = np.searchsorted(sorted_confidence, params['confidence_thresholds'], side='right')
+    for threshold, count in zip(params['confidence_thresholds'], low_counts):
+        features[f"low_confidence_{threshold:g}"] = count / len(confidence) if len(confidence) else np.nan
+    return features
+
+
+def session_features(file_path, params):
+    """
+    The features of one session and of each of its windows.
+
+    Returns:
+    - DataFrame with one row per window and a last row for the whole session (window =
+      SESSION_WINDOW), holding window, start_seconds (from the first pupil_timestamp), samples,
+      kept_samples and the feature columns
+    """
+    df = read_session(file_path, columns=['pupil_timestamp', 'confidence', 'diameter'])
+    for column in ('pupil_timestamp', 'confidence'):
+        if column not in df.columns:
+            raise ValueError(f"'{column}' column missing in {file_path}")
+    confidence = df['confidence'].to_numpy(dtype=float)
+    diameters = df['diameter'].to_numpy(dtype=float)
+    keep = (confidence >= params['min_confidence']) & ~np.isnan(diameters)
+
+    # Window bounds from the timestamps; the running maximum keeps the search valid when the two
+    # eyes' rows are slightly out of order
+    times = df['pupil_timestamp'].to_numpy(dtype=float)
+    times = np.maximum.accumulate(times - times[0]) if len(times) else times
+    # The last sample covers one more sample period
+    duration = times[-1] + 1 / params['fs'] if len(times) else 0.0
+    window_seconds = params['window_seconds']
+    stride_seconds = params['stride_seconds']
+    if window_seconds > 0 and stride_seconds > 0 and duration >= window_seconds:
+        start_times = np.arange(0, duration - window_seconds + 1e-9, stride_seconds)
+    else:
+        start_times = np.empty(0)
+    starts = np.searchsorted(times, start_times, side='left')
+    stops = np.searchsorted(times, start_times + window_seconds, side='left')
+    segments = [(i, start_time, start, stop) for i, (start_time, start, stop)
+                in enumerate(zip(start_times.tolist(), starts.tolist(), stops.tolist()))]
+    segments.append((SESSION_WINDOW, 0.0, 0, len(df)))
+
+    # The kept samples of every segment; too sparse windows get no spectrum
+    signals = []
+    for i, _, start, stop in segments:
+        kept = diameters[start:stop][keep[start:stop]]
+        enough = len(kept) >= 2 and (i == SESSION_WINDOW or len(kept) >= params['min_window_fraction'] * (stop - start))
+        signals.append(kept if enough else None)
+    spectra = iter(magnitude_spectra([signal for signal in signals if signal is not None]))
+
+    rows = []
+    for (i, start_time, start, stop), signal in zip(segments, signals):
+        row = {'window': i, 'start_seconds': start_time, 'samples': stop - start,
+               'kept_samples': 0 if signal is None else len(signal)}
+        if signal is not None:
+            row.update(spectrum_features(*next(spectra), params))
+        row.update(confidence_features(confidence[start:stop], params))
+        rows.append(row)
+    return pd.DataFrame(rows).reindex(columns=['window', 'start_seconds', 'samples', 'kept_samples']
+                                      + feature_columns(params))
+
+
+def compute_session_features(file_path, folder, params):
+    """ Computes the features of one session and writes them to the store folder; returns the entry fields. """
+    with stage('features', file=file_path) as record:
+        source = source_key(file_path)
+        features = session_features(file_path, params)
+        file_name = session_file_name(file_path)
+        tmp_path = os.path.join(folder, file_name + '.tmp')
+        features.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(folder, file_name))
+        record.add(rows_in=int(features['samples'].iloc[-1]), rows_out=len(features))
+    return {'file': file_name, 'source': source, 'windows': len(features) - 1}
+
+
+def load_index(folder):
+    """ The index of a store folder, or None if there is none. """
+    index_path = os.path.join(folder, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_index(folder, index):
+    index_path = os.path.join(folder, INDEX_FILE)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, index_path)
+
+
+def collect_sessions(ec_folder, pd_folder, pd_on_paths, filter_options=FILTER_OPTIONS, max_patients=10):
+    """
+    The pupil sessions fft_pupil_size - Copy.py analyses, as a list of dicts with the 'file',
+    'patient_id', 'group' and the 'filter_options' it belongs to.
+    """
+    sessions = {}
+    catalog = get_catalog()
+    for folders, group_name in [(ec_folder, 'EC'), (pd_folder, 'PD_OFF')] + [(folder, 'PD_ON') for folder in pd_on_paths]:
+        partitions = catalog.pupil_file_partitions(folders, group_name, filter_options, max_patients)
+        for filter_option, patient_files in partitions.items():
+            for file_path, patient_id in patient_files:
+                session = sessions.setdefault(file_path, {'file': file_path, 'patient_id': patient_id,
+                                                          'group': group_name, 'filter_options': []})
+                if filter_option not in session['filter_options']:
+                    session['filter_options'].append(filter_option)
+    return list(sessions.values())
+
+
+def build_feature_store(sessions, store_dir, params=None, workers=None):
+    """
+    Brings the store up to date for the sessions: features are computed (on the process pool)
+    only for sessions that are new or whose file changed.
+
+    Parameters:
+    - sessions: Output of collect_sessions
+    - store_dir: Root folder of the store
+    - params: Output of feature_params (None for the defaults)
+    - workers: Number of processes (see parallel.run_parallel)
+
+    Returns:
+    - The index of the store folder
+    """
+    params = feature_params() if params is None else params
+    folder = store_folder(store_dir, params)
+    os.makedirs(folder, exist_ok=True)
+    index = load_index(folder) or {'version': FEATURE_VERSION, 'params': params, 'sessions': {}}
+
+    tasks = []
+    for session in sessions:
+        file_path = session['file']
+        entry = index['sessions'].get(file_path)
+        fresh = (entry is not None and entry['source'] == source_key(file_path)
+                 and os.path.exists(os.path.join(folder, entry['file'])))
+        if fresh:
+            # The features stay; the grouping may come from another run
+            entry.update(patient_id=session['patient_id'], group=session['group'],
+                         filter_options=sorted(set(entry['filter_options']) | set(session['filter_options'])))
+        else:
+            tasks.append((file_path, folder, params))
+    print(f"Spectral features: {len(sessions) - len(tasks)} sessions up to date, {len(tasks)} to compute")
+
+    results = run_parallel(compute_session_features, tasks, workers, label='spectral features')
+    report_failures(results, label='spectral features')
+    by_file = {session['file']: session for session in sessions}
+    for result in results:
+        if result.ok:
+            session = by_file[result.args[0]]
+            index['sessions'][session['file']] = dict(result.value, patient_id=session['patient_id'],
+                                                      group=session['group'],
+                                                      session_type=session_type(session['file']),
+                                                      filter_options=sorted(session['filter_options']))
+    save_index(folder, index)
+    return index
+
+
+def load_features(store_dir, params=None, level='session', filter_option=None, groups=None):
+    """
+    Reads features from the store.
+
+    Parameters:
+    - store_dir, params: As given to build_feature_store
+    - level: 'session' for one row per session, 'window' for one row per window
+    - filter_option: Only the sessions of this filter option (None for all)
+    - groups: Only the sessions of these groups (None for all)
+
+    Returns:
+    - DataFrame with file, patient_id, group, label, filter_options and the stored columns
+    """
+    if level not in ('session', 'window'):
+        raise ValueError(f"Unknown level: {level}")
+    params = feature_params() if params is None else params
+    folder = store_folder(store_dir, params)
+    index = load_index(folder)
+    if index is None:
+        raise FileNotFoundError(f"No feature store for these parameters in {store_dir}")
+
+    frames = []
+    for file_path, entry in index['sessions'].items():
+        if filter_option is not None and filter_option not in entry['filter_options']:
+            continue
+        if groups is not None and entry['group'] not in groups:
+            continue
+        comparison = '==' if level == 'session' else '!='
+        df = pd.read_parquet(os.path.join(folder, entry['file']), filters=[('window', comparison, SESSION_WINDOW)])
+        df.insert(0, 'file', file_path)
+        df.insert(1, 'patient_id', entry['patient_id'])
+        df.insert(2, 'group', entry['group'])
+        df.insert(3, 'label', GROUP_LABELS[entry['group']])
+        df.insert(4, 'filter_options', ','.join(str(option) for option in entry['filter_options']))
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=['file', 'patient_id', 'group', 'label', 'filter_options', 'window']
+                            + feature_columns(params))
+    return pd.concat(frames, ignore_index=True)
+
+
+def feature_matrix(df, columns=None):
+    """
+    (X, labels, patient_ids) of a load_features frame for the classifiers; rows without a
+    spectrum (too few confident samples) are left out.
+    """
+    columns = [column for column in df.columns if column.startswith(('area_', 'norm_area_', 'power_'))] + \
+              ['dominant_frequency', 'spectral_entropy', 'confidence_mean', 'low_confidence_ratio'] \
+        if columns is None else columns
+    complete = df[columns].notna().all(axis=1).to_numpy()
+    return (df.loc[complete, columns].to_numpy(dtype=np.float32), df.loc[complete, 'label'].to_numpy(dtype=np.int64),
+            df.loc[complete, 'patient_id'].to_numpy())
+
+
+def main():
+    # Directories
+    ec_folder = 'D:\\EC'
+    pd_folder = 'D:\\PD'
+    pd_on_paths = []  # add the PD_ON folders here
+    store_dir = 'D:\\spectral_features'
+
+    sessions = collect_sessions(ec_folder, pd_folder, pd_on_paths)
+    index = build_feature_store(sessions, store_dir)
+    print(f"{len(index['sessions'])} sessions in {store_folder(store_dir)}")
+
+
+if __name__ == "__main__":
+    main()
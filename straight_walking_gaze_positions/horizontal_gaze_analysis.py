@@ -1,54 +1,74 @@
 import os
-import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
+from batch_rendering import reusable_axes, use_headless_backend
+from intermediate_store import intermediate_files, read_intermediate
+from parallel import report_failures, run_parallel
 
-# Path to the folder containing gaze position files
-folder_path = r'C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\new_clean_outputs\non_turns_data'
-
-# Create a directory to save the graphs
-output_dir = r'C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\non_turns_data\gaze_data\gaze_analysis_graphs'
-os.makedirs(output_dir, exist_ok=True)
-i = 1
-state = " "
-
-# Process each Excel file in the folder
-for file_name in os.listdir(folder_path):
-    if file_name.endswith('.xlsx'):
-        file_path = os.path.join(folder_path, file_name)
-        data = pd.read_excel(file_path)
-
-        # Extract patient ID from the file name
-        patient_id = file_name.split('_', 2)[2].replace('.xlsx', '')
-        if 'EC' in patient_id:
-            state = "EC"
-        elif 'OFF' in patient_id:
-            state = "PD_OFF"
-        else:
-            state = "PD_ON"
-        name = state + "_" + str(i)
-        i += 1
-
-        # Use percentiles to determine the "good" range, avoiding extreme values
-        lower_percentile = data['norm_pos_x'].quantile(0.1)
-        upper_percentile = data['norm_pos_x'].quantile(0.9)
-
-        # Filter out extreme values for the pivot calculation only (data itself remains unchanged)
-        filtered_data = data[(data['norm_pos_y'] >= lower_percentile) & (data['norm_pos_y'] <= upper_percentile)]
-
-        # Calculate the new pivot as the middle point between min and max values
-        pivot = (filtered_data['norm_pos_x'].min() + filtered_data['norm_pos_x'].max()) / 2
-
-        # Analyze "norm_pos_y" to determine left vs. right gazes based on the new pivot
-        left_gazes = data[data['norm_pos_x'] < pivot].shape[0]
-        right_gazes = data[data['norm_pos_x'] >= pivot].shape[0]
-
-        # Determine whether the patient looked more left or more right
-        if left_gazes > right_gazes:
-            result = 'More Left'
-        else:
-            result = 'More Right'
-
-        # Plot the gaze distribution (original data, without changes)
+
+def analyze_gaze_file(file_path, i, output_dir, batch=True):
+    """
+    Finds whether the patient of one gaze data file looked more left or more right and saves the
+    histogram of norm_pos_x.
+
+    Parameters:
+    - file_path: Gaze data file (Parquet, or Excel for folders written before)
+    - i: Number of the file, used in the anonymized name of the patient on the graph
+    - output_dir: Directory to save the graph
+    - batch: Render headless on a reused figure
+
+    Returns:
+    - (patient_id, result)
+    """
+    file_name = os.path.basename(file_path)
+    data = read_intermediate(file_path, columns=['norm_pos_x', 'norm_pos_y'])
+
+    # Extract patient ID from the file name
+    patient_id = os.path.splitext(file_name.split('_', 2)[2])[0]
+    if 'EC' in patient_id:
+        state = "EC"
+    elif 'OFF' in patient_id:
+        state = "PD_OFF"
+    else:
+        state = "PD_ON"
+    name = state + "_" + str(i)
+
+    # Use percentiles to determine the "good" range, avoiding extreme values
+    lower_percentile = data['norm_pos_x'].quantile(0.1)
+    upper_percentile = data['norm_pos_x'].quantile(0.9)
+
+    # Filter out extreme values for the pivot calculation only (data itself remains unchanged)
+    filtered_data = data[(data['norm_pos_y'] >= lower_percentile) & (data['norm_pos_y'] <= upper_percentile)]
+
+    # Calculate the new pivot as the middle point between min and max values
+    pivot = (filtered_data['norm_pos_x'].min() + filtered_data['norm_pos_x'].max()) / 2
+
+    # Analyze "norm_pos_y" to determine left vs. right gazes based on the new pivot
+    left_gazes = data[data['norm_pos_x'] < pivot].shape[0]
+    right_gazes = data[data['norm_pos_x'] >= pivot].shape[0]
+
+    # Determine whether the patient looked more left or more right
+    if left_gazes > right_gazes:
+        result = 'More Left'
+    else:
+        result = 'More Right'
+
+    # Plot the gaze distribution (original data, without changes)
+    output_file = os.path.join(output_dir, f'{patient_id}_gaze_analysis.png')
+    if batch:
+        use_headless_backend()
+        fig, (ax,) = reusable_axes(1, 1, figsize=(10, 6))
+        # The 20 bin counts are computed first, so only 20 bars are handed to matplotlib
+        values = data['norm_pos_x'].dropna().to_numpy(dtype=float)
+        counts, edges = np.histogram(values, bins=20)
+        ax.hist(edges[:-1], bins=edges, weights=counts, color='skyblue', edgecolor='black')
+        ax.set_title(f'Gaze Analysis for Patient {name}\n{result}', fontsize=14)
+        ax.set_xlabel('norm_pos_x')
+        ax.set_ylabel('Frequency')
+        ax.axvline(pivot, color='red', linestyle='--', label=f'Median Pivot ({pivot:.2f})')
+        ax.legend()
+        fig.savefig(output_file)
+    else:
         plt.figure(figsize=(10, 6))
         plt.hist(data['norm_pos_x'], bins=20, color='skyblue', edgecolor='black')
         plt.title(f'Gaze Analysis for Patient {name}\n{result}', fontsize=14)
@@ -58,10 +78,32 @@ for file_name in os.listdir(folder_path):
         plt.legend()
 
         # Save the graph
-        output_file = os.path.join(output_dir, f'{patient_id}_gaze_analysis.png')
         plt.savefig(output_file)
         plt.close()
 
-        print(f'Graph saved for Patient {patient_id} - {result}')
+    print(f'Graph saved for Patient {patient_id} - {result}')
+    return patient_id, result
+
+
+def main(batch=True, workers=None):
+    # Path to the folder containing gaze position files
+    folder_path = r'C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\new_clean_outputs\non_turns_data'
+
+    # Create a directory to save the graphs
+    output_dir = r'C:\Users\shach\Documents\Shachar-s_Thesis2\דטה בסיבובים\non_turns_data\gaze_data\gaze_analysis_graphs'
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Process each gaze data file in the folder (Parquet, or Excel for folders written before),
+    # numbered from 1 in file order; batch=True renders them headless on a pool of workers
+    tasks = [(file_path, i, output_dir, batch) for i, file_path in enumerate(intermediate_files(folder_path), start=1)]
+    if batch:
+        report_failures(run_parallel(analyze_gaze_file, tasks, workers, label='gaze analysis'), label='gaze analysis')
+    else:
+        for task in tasks:
+            analyze_gaze_file(*task)
+
+    print("Analysis completed.")
+
 
-print("Analysis completed.")
+if __name__ == "__main__":
+    main()